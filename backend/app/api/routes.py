@@ -1,19 +1,38 @@
 """API routes for email generation."""
 
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+import time
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 from ..config import get_settings
+from .. import database
 from ..database import get_db
 from ..models import (
     EmailGenerationRequest,
     EmailGenerationResponse,
     EmailAnalysisRequest,
+    EmailParameters,
     EmailParametersResponse,
     DetailedEmailAnalysis,
+    AnalyzeAndDraftResponse,
+    PromptPreviewResponse,
+    SectionRegenerationRequest,
+    SectionRegenerationResponse,
 )
-from ..services.yandex_gpt_client import YandexGPTService
+from ..services.batch_generation import get_batch_service
+from ..services.conversation_chain import ThreadChain, chain_for_reply, start_chain
+from ..services.llm_backends import get_llm_service
 from ..services.email_analyzer import EmailAnalyzer
+from ..services.latency_budget import resolve_deadline
+from ..services.section_rewriter import rewrite_section
+from ..services.speculative_drafts import speculate
+from ..services.analysis_store import StoredAnalysis, get_analysis_store
 from ..services.context_service import ContextService
 from ..services.thread_service import ThreadService
 
@@ -21,23 +40,50 @@ router = APIRouter(prefix="/api/emails", tags=["emails"])
 
 
 def _get_service():
-    """Get AI service based on configuration."""
-    return YandexGPTService()
+    """Get AI service based on configuration (LLM_BACKENDS, with failover)."""
+    return get_llm_service()
 
 
 def _get_analyzer():
     """Get email analyzer service."""
     service = _get_service()
-    return EmailAnalyzer(service)
+    return EmailAnalyzer(async_service=service)
 
 
-@router.post("/generate", response_model=EmailGenerationResponse)
-def generate_email(
+def _resolve_analysis(request: EmailGenerationRequest) -> tuple[EmailGenerationRequest, StoredAnalysis | None]:
+    """Fill the letter and company context from the stored analysis (request.analysis_id)."""
+    if not request.analysis_id:
+        return request, None
+    stored = get_analysis_store().get(request.analysis_id)
+    if stored is None:
+        if request.source_subject is None or request.source_body is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Analysis {request.analysis_id} not found or expired, send source_subject and source_body"
+            )
+        print(f"[DEBUG] Analysis {request.analysis_id} not found or expired, generating from the letter in the request")
+        return request, None
+    update = {"source_subject": stored.subject, "source_body": stored.body}
+    if not request.company_context and not request.company_context_id:
+        update["company_context"] = stored.company_context
+    return request.model_copy(update=update), stored
+
+
+def _prepare_generation(
     request: EmailGenerationRequest,
-    db: Session = Depends(get_db)
-) -> EmailGenerationResponse:
-    """Generate a professional email based on the request parameters."""
+    db: Session,
+    save_incoming: bool = True,
+) -> tuple[EmailGenerationRequest, str | None, str | None, ThreadChain | None, DetailedEmailAnalysis | None]:
+    """Load context and thread data, save the incoming letter and resolve the recipient.
+
+    Also returns the upstream conversation chain of the thread (LLM_THREAD_CHAINING_ENABLED)
+    and the /analyze-detailed result referenced by request.analysis_id. With
+    save_incoming=False the thread is only read (variants are drafts to compare).
+
+    Runs in the threadpool: everything here is blocking database work.
+    """
     print(f"[DEBUG] Received request - thread_id={request.thread_id}, extra_directives={request.parameters.extra_directives if request.parameters else None}, custom_prompt={request.custom_prompt}")
+    request, stored_analysis = _resolve_analysis(request)
     # Load context from database if context_id is provided
     if request.company_context_id:
         context_text = ContextService.get_context_text(db, request.company_context_id)
@@ -51,6 +97,7 @@ def generate_email(
         request = EmailGenerationRequest(
             source_subject=original_request.source_subject,
             source_body=original_request.source_body,
+            analysis_id=original_request.analysis_id,
             company_context=context_text,
             company_context_id=original_request.company_context_id,
             thread_id=original_request.thread_id,
@@ -65,7 +112,8 @@ def generate_email(
             sender_hotline=original_request.sender_hotline,
             sender_website=original_request.sender_website,
             custom_prompt=original_request.custom_prompt,
-            parameters=original_request.parameters
+            parameters=original_request.parameters,
+            latency_budget_ms=original_request.latency_budget_ms,
         )
     elif not request.company_context:
         raise HTTPException(
@@ -75,6 +123,7 @@ def generate_email(
     
     # Handle thread history and directives
     thread_history = None
+    history_messages = []
     thread_id = request.thread_id
     thread_extra_directives = None
     thread_custom_prompt = None
@@ -92,8 +141,8 @@ def generate_email(
                 status_code=404,
                 detail=f"Thread with ID {thread_id} not found"
             )
-        messages = ThreadService.get_thread_history(db, thread_id)
-        thread_history = ThreadService.format_thread_history(messages)
+        history_messages = ThreadService.get_thread_history(db, thread_id)
+        thread_history = ThreadService.format_thread_history(history_messages)
         
         # Load directives from thread
         thread_extra_directives, thread_custom_prompt = ThreadService.get_thread_directives(thread)
@@ -143,7 +192,7 @@ def generate_email(
             request.custom_prompt = thread_custom_prompt
     
     # Save incoming message to thread
-    if thread_id:
+    if thread_id and save_incoming:
         sender_name = None
         if request.sender_first_name or request.sender_last_name:
             sender_name = f"{request.sender_first_name or ''} {request.sender_last_name or ''}".strip()
@@ -160,7 +209,10 @@ def generate_email(
     
     # Extract recipient name from incoming email
     from ..services.recipient_extractor import extract_recipient_name, format_recipient_name
-    recipient_name = format_recipient_name(request.source_subject, request.source_body)
+    if stored_analysis is not None:
+        recipient_name = stored_analysis.recipient_name
+    else:
+        recipient_name = format_recipient_name(request.source_subject, request.source_body)
     
     # Validate address_style - if full_name is selected but recipient data is not available, reset to "vy"
     if request.parameters.address_style == "full_name" and not recipient_name:
@@ -177,16 +229,19 @@ def generate_email(
             request.custom_prompt = recipient_info
         print(f"[DEBUG] Extracted recipient name: {recipient_name}")
     
-    # Measure generation time
-    import time
-    generation_start_time = time.time()
-    
-    service = _get_service()
-    response = service.generate_letter(request, thread_history=thread_history, recipient_name=recipient_name)
-    
-    generation_time_seconds = time.time() - generation_start_time
-    
-    # Save generated response to thread
+    chain = chain_for_reply(history_messages, request, recipient_name) if thread_id else None
+    return request, thread_history, recipient_name, chain, stored_analysis.analysis if stored_analysis else None
+
+
+def _save_generated_message(
+    db: Session,
+    request: EmailGenerationRequest,
+    response: EmailGenerationResponse,
+    generation_time_seconds: float,
+    chain: ThreadChain | None = None,
+) -> None:
+    """Save generated response to thread (with the upstream answer it continues from, if chained)."""
+    thread_id = request.thread_id
     if thread_id:
         sender_name = None
         if request.sender_first_name or request.sender_last_name:
@@ -200,29 +255,245 @@ def generate_email(
             body=response.body,
             sender_name=sender_name,
             sender_position=request.sender_position,
-            generation_time_seconds=generation_time_seconds
+            generation_time_seconds=generation_time_seconds,
+            llm_response_id=chain.response_id if chain else None,
+            llm_folder_id=chain.folder_id if chain else None
+        )
+
+
+@router.post("/generate", response_model=EmailGenerationResponse)
+async def generate_email(
+    request: EmailGenerationRequest,
+    db: Session = Depends(get_db),
+    x_latency_budget_ms: Optional[int] = Header(None, alias="X-Latency-Budget-Ms"),
+) -> EmailGenerationResponse:
+    """Generate a professional email based on the request parameters.
+
+    With a latency budget the call fails with 504 if the model does not answer in time.
+    With ``variants`` the drafts for all parameter sets are generated concurrently and
+    streamed as server-sent events in the order they finish (see _variant_events).
+    """
+    deadline = resolve_deadline(request.latency_budget_ms, x_latency_budget_ms)
+    if request.variants:
+        max_variants = get_settings().generation_max_variants
+        if len(request.variants) > max_variants:
+            raise HTTPException(status_code=400, detail=f"Не больше {max_variants} вариантов за запрос")
+        request, thread_history, recipient_name, _chain, analysis = await run_in_threadpool(
+            _prepare_generation, request, db, False
+        )
+        variants = [_variant_request(request, parameters, recipient_name) for parameters in request.variants]
+        return StreamingResponse(
+            _variant_events(_get_service(), variants, thread_history, recipient_name, deadline, analysis),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    request, thread_history, recipient_name, chain, analysis = await run_in_threadpool(_prepare_generation, request, db)
+
+    # Measure generation time
+    generation_start_time = time.time()
+    
+    service = _get_service()
+    start_chain(chain)
+    response = await service.generate_letter(
+        request, thread_history=thread_history, recipient_name=recipient_name, deadline=deadline, analysis=analysis
+    )
+    
+    generation_time_seconds = time.time() - generation_start_time
+    
+    if request.thread_id:
+        await run_in_threadpool(
+            _save_generated_message, db, request, response, generation_time_seconds, chain
         )
     
     return response
 
 
+def _save_streamed_message(
+    request: EmailGenerationRequest,
+    response: EmailGenerationResponse,
+    generation_time_seconds: float,
+    chain: ThreadChain | None = None,
+) -> None:
+    """Save a streamed draft with its own session: the request-scoped one is closed by now."""
+    db = database.SessionLocal()
+    try:
+        _save_generated_message(db, request, response, generation_time_seconds, chain)
+    finally:
+        db.close()
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _variant_request(
+    request: EmailGenerationRequest, parameters: EmailParameters, recipient_name: str | None
+) -> EmailGenerationRequest:
+    """The request for one variant: its parameters, the directives of the request/thread."""
+    update = {}
+    if parameters.extra_directives is None:
+        update["extra_directives"] = request.parameters.extra_directives
+    if parameters.address_style == "full_name" and not recipient_name:
+        update["address_style"] = "vy"
+    return request.model_copy(update={"parameters": parameters.model_copy(update=update), "variants": None})
+
+
+async def _variant_events(service, variants, thread_history, recipient_name, deadline, analysis):
+    """Generate the variants concurrently and yield each as soon as it is ready.
+
+    Events: ``variant`` (index in the request, parameters, subject and body),
+    ``error`` (index and detail) and ``done``. Every variant is a regular
+    generate_letter call, so it goes through the rate limiter and is cached under
+    its own parameters: sending the chosen one to /generate is a cache hit.
+    Variants are not written to the thread and do not continue its upstream chain.
+    """
+    async def run(index: int, variant: EmailGenerationRequest):
+        try:
+            letter = await service.generate_letter(
+                variant, thread_history=thread_history, recipient_name=recipient_name, deadline=deadline, analysis=analysis
+            )
+            return index, variant, letter, None
+        except Exception as e:
+            return index, variant, None, e
+
+    tasks = [asyncio.ensure_future(run(index, variant)) for index, variant in enumerate(variants)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            index, variant, letter, error = await next_done
+            if error is not None:
+                print(f"Ошибка генерации варианта {index}: {error}")
+                yield _sse("error", {"index": index, "detail": str(error) or type(error).__name__})
+                continue
+            yield _sse("variant", {"index": index, "parameters": variant.parameters.model_dump(), **letter.model_dump()})
+        yield _sse("done", {"variants": len(tasks)})
+    finally:
+        # Клиент отключился: оставшиеся варианты больше не нужны
+        for task in tasks:
+            task.cancel()
+
+
+@router.post("/generate/stream")
+async def generate_email_stream(
+    request: EmailGenerationRequest,
+    db: Session = Depends(get_db)
+) -> StreamingResponse:
+    """Generate an email and stream it as server-sent events while the model writes.
+
+    Events: ``subject``, ``delta`` (body text), ``signature``, ``done`` (the final
+    letter, identical to what /generate returns) and ``error``.
+    """
+    request, thread_history, recipient_name, chain, analysis = await run_in_threadpool(_prepare_generation, request, db)
+    service = _get_service()
+
+    async def event_stream():
+        generation_start_time = time.time()
+        # Поток может идти в другой задаче, чем обработчик: цепочку привязываем в самом генераторе
+        start_chain(chain)
+        try:
+            async for event, data in service.stream_letter(
+                request, thread_history=thread_history, recipient_name=recipient_name, analysis=analysis
+            ):
+                yield _sse(event, data)
+                if event == "done" and request.thread_id:
+                    await run_in_threadpool(
+                        _save_streamed_message,
+                        request,
+                        EmailGenerationResponse(**data),
+                        time.time() - generation_start_time,
+                        chain,
+                    )
+        except Exception as e:
+            print(f"Ошибка потоковой генерации: {e}")
+            yield _sse("error", {"detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/generate/dry-run", response_model=PromptPreviewResponse)
+async def preview_generation_prompt(
+    request: EmailGenerationRequest,
+    db: Session = Depends(get_db)
+) -> PromptPreviewResponse:
+    """Render the prompt /generate would send, with its template version and token estimate.
+
+    The model is not called and nothing is saved to the thread. The full prompt is
+    shown even when thread chaining would send only the new letter.
+    """
+    request, thread_history, recipient_name, _chain, analysis = await run_in_threadpool(
+        _prepare_generation, request, db, False
+    )
+    return _get_service().preview_letter(
+        request, thread_history=thread_history, recipient_name=recipient_name, analysis=analysis
+    )
+
+
+@router.post("/generate/batch", response_model=dict, status_code=202)
+async def generate_email_batch(
+    request: EmailGenerationRequest,
+    db: Session = Depends(get_db)
+) -> dict:
+    """Queue a non-urgent letter for off-peak batch generation.
+
+    The answer is written to the thread as an outgoing message once the
+    asynchronous upstream operation finishes; poll GET /generate/batch/{job_id}.
+    """
+    if not request.thread_id:
+        raise HTTPException(status_code=400, detail="Пакетная генерация требует thread_id: ответ записывается в переписку")
+    request, thread_history, recipient_name, _chain, _analysis = await run_in_threadpool(_prepare_generation, request, db)
+    batch = get_batch_service()
+    job = await run_in_threadpool(batch.enqueue, db, request, thread_history, recipient_name)
+    return batch.job_to_dict(db, job)
+
+
+@router.get("/generate/batch/{job_id}", response_model=dict)
+def get_batch_job(
+    job_id: int,
+    db: Session = Depends(get_db)
+) -> dict:
+    """Status of a batch job; subject and body once the letter is ready."""
+    batch = get_batch_service()
+    job = batch.get_job(db, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Batch job not found")
+    return batch.job_to_dict(db, job)
+
+
 @router.post("/analyze", response_model=EmailParametersResponse)
-def analyze_email(request: EmailAnalysisRequest) -> EmailParametersResponse:
+async def analyze_email(
+    request: EmailAnalysisRequest,
+    x_latency_budget_ms: Optional[int] = Header(None, alias="X-Latency-Budget-Ms"),
+) -> EmailParametersResponse:
     """Analyze incoming email and automatically determine optimal parameters."""
     service = _get_service()
     
-    params = service.analyze_email_parameters(
+    params = await service.analyze_email_parameters(
         subject=request.source_subject,
         body=request.source_body,
         company_context=request.company_context,
+        deadline=resolve_deadline(request.latency_budget_ms, x_latency_budget_ms),
     )
     
     return EmailParametersResponse(parameters=params)
 
 
 @router.post("/analyze-detailed", response_model=DetailedEmailAnalysis)
-def analyze_email_detailed(request: EmailAnalysisRequest) -> DetailedEmailAnalysis:
-    """Расширенный анализ входящего письма с извлечением ключевой информации."""
+async def analyze_email_detailed(
+    request: EmailAnalysisRequest,
+    x_latency_budget_ms: Optional[int] = Header(None, alias="X-Latency-Budget-Ms"),
+) -> DetailedEmailAnalysis:
+    """Расширенный анализ входящего письма с извлечением ключевой информации.
+
+    Если модель не укладывается в бюджет (X-Latency-Budget-Ms или latency_budget_ms),
+    возвращается анализ по ключевым словам с degraded=true. analysis_id ответа можно передать
+    в /generate вместо письма. С SPECULATIVE_DRAFTS_ENABLED после ответа в фоне генерируется
+    черновик с предложенными параметрами.
+    """
+    deadline = resolve_deadline(request.latency_budget_ms, x_latency_budget_ms)
     try:
         # Валидация входных данных
         if not request.source_subject or not request.source_subject.strip():
@@ -231,12 +502,22 @@ def analyze_email_detailed(request: EmailAnalysisRequest) -> DetailedEmailAnalys
             raise ValueError("Текст письма не может быть пустым")
         
         analyzer = _get_analyzer()
+        subject = request.source_subject.strip()
+        body = request.source_body.strip()
+        company_context = request.company_context.strip() if request.company_context else "ПСБ банк"
         
-        return analyzer.analyze_email_detailed(
-            subject=request.source_subject.strip(),
-            body=request.source_body.strip(),
-            company_context=request.company_context.strip() if request.company_context else "ПСБ банк",
+        analysis = await analyzer.analyze_email_detailed_async(
+            subject=subject,
+            body=body,
+            company_context=company_context,
+            deadline=deadline,
         )
+        # Оператор обычно принимает предложенные параметры: черновик начинаем генерировать сразу
+        await speculate(analyzer.async_service, subject, body, company_context, analysis)
+        # analysis_id: /generate возьмёт письмо и результаты анализа, не пересчитывая их.
+        # Хранилище пишет в синхронный Redis, поэтому не в event loop
+        analysis_id = await asyncio.to_thread(get_analysis_store().put, subject, body, company_context, analysis)
+        return analysis.model_copy(update={"analysis_id": analysis_id})
     except ValueError as e:
         # Ошибки валидации - возвращаем понятное сообщение
         import traceback
@@ -263,3 +544,75 @@ def analyze_email_detailed(request: EmailAnalysisRequest) -> DetailedEmailAnalys
             status_code=500, 
             detail=f"Внутренняя ошибка сервера: {str(e)}"
         )
+
+
+@router.post("/analyze-and-draft", response_model=AnalyzeAndDraftResponse)
+async def analyze_and_draft(
+    request: EmailGenerationRequest,
+    db: Session = Depends(get_db),
+    x_latency_budget_ms: Optional[int] = Header(None, alias="X-Latency-Budget-Ms"),
+) -> AnalyzeAndDraftResponse:
+    """Detailed analysis and a draft reply in one model round trip.
+
+    Replaces the usual /analyze-detailed + /generate pair: the draft uses the
+    parameters suggested by the analysis (``request.parameters`` only supplies
+    extra_directives). Both results are cached, and the draft is saved to the
+    thread like a /generate result.
+    """
+    deadline = resolve_deadline(request.latency_budget_ms, x_latency_budget_ms)
+    request, thread_history, recipient_name, _chain, _analysis = await run_in_threadpool(_prepare_generation, request, db)
+
+    generation_start_time = time.time()
+    analysis, draft = await _get_analyzer().analyze_and_draft_async(
+        request, thread_history=thread_history, recipient_name=recipient_name, deadline=deadline
+    )
+    generation_time_seconds = time.time() - generation_start_time
+
+    if request.thread_id:
+        await run_in_threadpool(_save_generated_message, db, request, draft, generation_time_seconds)
+
+    analysis_id = await asyncio.to_thread(
+        get_analysis_store().put,
+        request.source_subject.strip(),
+        request.source_body.strip(),
+        request.company_context.strip(),
+        analysis,
+    )
+    return AnalyzeAndDraftResponse(analysis=analysis.model_copy(update={"analysis_id": analysis_id}), draft=draft)
+
+
+def _load_draft(db: Session, message_id: int) -> tuple[str, str]:
+    """Subject and body of an outgoing thread message."""
+    message = ThreadService.get_message(db, message_id)
+    if not message:
+        raise HTTPException(status_code=404, detail=f"Message with ID {message_id} not found")
+    if message.message_type != "outgoing":
+        raise HTTPException(status_code=400, detail="Переписать можно только исходящее письмо")
+    return message.subject, message.body
+
+
+@router.post("/regenerate-section", response_model=SectionRegenerationResponse)
+async def regenerate_section(
+    request: SectionRegenerationRequest,
+    db: Session = Depends(get_db),
+    x_latency_budget_ms: Optional[int] = Header(None, alias="X-Latency-Budget-Ms"),
+) -> SectionRegenerationResponse:
+    """Rewrite one fragment of a draft (body[start:end] or the subject) by an instruction.
+
+    The draft comes from the request or from an outgoing thread message
+    (message_id; the stored message is not changed). Only the draft and the
+    fragment are sent to the model; text outside the fragment and the locally
+    built signature are returned unchanged.
+    """
+    deadline = resolve_deadline(request.latency_budget_ms, x_latency_budget_ms)
+    if request.message_id is not None:
+        subject, body = await run_in_threadpool(_load_draft, db, request.message_id)
+    else:
+        subject, body = request.subject, request.body
+
+    try:
+        return await rewrite_section(
+            _get_service(), subject, body, request.target, request.start, request.end, request.instruction, deadline
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
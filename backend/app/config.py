@@ -14,8 +14,21 @@ class Settings:
 
     yandex_api_key: str
     yandex_folder_id: str
+    # Key/folder pairs with a weight; calls are balanced across them
+    yandex_credentials: list[tuple[str, str, float]]
+    llm_credential_strategy: str
+    llm_credential_cooldown_seconds: float
+    llm_credential_max_failures: int
     yandex_model: str
-    
+    yandex_responses_url: str
+
+    # Upstream HTTP connection pool settings
+    http2_enabled: bool
+    http_max_connections: int
+    http_max_keepalive_connections: int
+    http_keepalive_expiry: float
+    http_warmup_enabled: bool
+
     # Redis cache settings
     redis_enabled: bool
     redis_host: str
@@ -25,18 +38,171 @@ class Settings:
     redis_ttl_analysis: int  # TTL for analysis cache in hours
     redis_ttl_generation: int  # TTL for generation cache in hours
 
+    # Shared token-bucket limiter for the Yandex folder quota
+    llm_rate_limit_enabled: bool
+    llm_rate_limit_rps: float
+    llm_rate_limit_burst: float
+    llm_rate_limit_tokens_per_minute: float
+    llm_rate_limit_max_wait_seconds: float
+    llm_expected_output_tokens: int
+
+    # Circuit breaker and hedged requests
+    circuit_breaker_enabled: bool
+    circuit_failure_rate_threshold: float
+    circuit_slow_call_seconds: float
+    circuit_slow_call_rate_threshold: float
+    circuit_window_size: int
+    circuit_min_calls: int
+    circuit_open_seconds: float
+    llm_hedging_enabled: bool
+    llm_hedge_percentile: float
+
+    # Coalescing of identical in-flight LLM calls
+    single_flight_enabled: bool
+    single_flight_lock_ttl_seconds: float
+    single_flight_wait_timeout_seconds: float
+
+    # Micro-batching of detailed analysis calls into one packed prompt
+    analysis_batch_enabled: bool
+    analysis_batch_window_ms: float
+    analysis_batch_max_size: int
+
+    # Multi-variant generation: parameter sets per /generate request
+    generation_max_variants: int
+
+    # Analysis handles: /generate reuses a stored /analyze-detailed result
+    analysis_handle_ttl_seconds: float
+
+    # Speculative drafts generated right after the detailed analysis
+    speculative_drafts_enabled: bool
+    speculative_draft_ttl_seconds: float
+
+    # LLM backends and failover
+    llm_backends: list[str]
+    llm_failover_attempt_timeout_seconds: float
+    llm_local_latency_ms: float
+    yandex_completion_model: str
+    yandex_completion_url: str
+
+    # Model routing between the fast and the large model
+    yandex_fast_model: str
+    yandex_completion_fast_model: str
+    llm_route_parameters: str
+    llm_route_analysis: str
+    llm_route_generation: str
+    llm_route_generation_short: str
+    llm_route_fast_max_prompt_tokens: int
+    llm_escalate_invalid_json: bool
+
+    # Output caps: max_output_tokens per task and requested letter length
+    llm_output_caps_enabled: bool
+    # Signature is assembled locally only: no sender block and signature rules in the prompt
+    prompt_local_signature: bool
+    llm_max_output_tokens_parameters: int
+    llm_max_output_tokens_analysis: int
+    llm_suppress_reasoning: bool
+
+    # Continuing a thread's upstream conversation instead of resending its history
+    llm_thread_chaining_enabled: bool
+    llm_thread_chain_max_age_hours: float
+
+    # Record/replay of upstream LLM traffic
+    llm_cassette_mode: str
+    llm_cassette_path: str
+
+    # Off-peak batch generation through the asynchronous operations API
+    batch_enabled: bool
+    yandex_completion_async_url: str
+    yandex_operations_url: str
+    batch_submit_window: str
+    batch_poll_interval_seconds: float
+    batch_max_jobs_per_run: int
+    batch_max_attempts: int
+    batch_min_sla_days: int
+    batch_claim_timeout_seconds: float
+
+    # Retries and adaptive timeouts of LLM calls
+    llm_retry_max_attempts: int
+    llm_retry_base_delay_seconds: float
+    llm_retry_max_delay_seconds: float
+    llm_retry_budget_seconds: float
+    llm_connect_timeout_seconds: float
+    llm_read_timeout_min_seconds: float
+    llm_read_timeout_max_seconds: float
+    llm_timeout_percentile: float
+    llm_timeout_multiplier: float
+
     def __init__(self) -> None:
+        # LLM backends in failover order: yandex_responses, yandex_completion, local
+        self.llm_backends = [
+            name.strip() for name in os.getenv("LLM_BACKENDS", "yandex_responses").split(",") if name.strip()
+        ]
+        self.llm_failover_attempt_timeout_seconds = float(os.getenv("LLM_FAILOVER_ATTEMPT_TIMEOUT_SECONDS", "0"))  # 0 = no limit
+        self.llm_local_latency_ms = float(os.getenv("LLM_LOCAL_LATENCY_MS", "0"))
+
         api_key = os.getenv("YANDEX_API_KEY") or os.getenv("api_key")
         folder_id = os.getenv("YANDEX_FOLDER_ID") or os.getenv("folder_id")
+        # Several folders scale past one folder's quota: "key1:folder1[:weight],key2:folder2"
+        credentials = _parse_credentials(os.getenv("YANDEX_CREDENTIALS", ""))
+        if credentials:
+            api_key = api_key or credentials[0][0]
+            folder_id = folder_id or credentials[0][1]
         
-        if not api_key:
+        # The local backend works offline, so credentials are only needed for Yandex backends
+        uses_yandex = any(name.startswith("yandex") for name in self.llm_backends)
+        if not api_key and uses_yandex:
             raise RuntimeError("YANDEX_API_KEY (or api_key) is not set")
-        if not folder_id:
+        if not folder_id and uses_yandex:
             raise RuntimeError("YANDEX_FOLDER_ID (or folder_id) is not set")
 
-        self.yandex_api_key = api_key
-        self.yandex_folder_id = folder_id
+        self.yandex_api_key = api_key or ""
+        self.yandex_folder_id = folder_id or "local"
+        self.yandex_credentials = credentials or [(self.yandex_api_key, self.yandex_folder_id, 1.0)]
+        self.llm_credential_strategy = os.getenv("LLM_CREDENTIAL_STRATEGY", "least_loaded")  # or "weighted"
+        self.llm_credential_cooldown_seconds = float(os.getenv("LLM_CREDENTIAL_COOLDOWN_SECONDS", "30"))
+        self.llm_credential_max_failures = int(os.getenv("LLM_CREDENTIAL_MAX_FAILURES", "3"))
         self.yandex_model = os.getenv("YANDEX_MODEL", "qwen3-235b-a22b-fp8/latest")
+        self.yandex_responses_url = os.getenv(
+            "YANDEX_RESPONSES_URL", "https://rest-assistant.api.cloud.yandex.net/v1/responses"
+        )
+        self.yandex_completion_model = os.getenv("YANDEX_COMPLETION_MODEL", "yandexgpt/latest")
+        self.yandex_completion_url = os.getenv(
+            "YANDEX_COMPLETION_URL", "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+        )
+
+        # Model routing: each task goes to the "fast" or the "large" model tier
+        self.yandex_fast_model = os.getenv("YANDEX_FAST_MODEL", "yandexgpt-lite/latest")
+        self.yandex_completion_fast_model = os.getenv("YANDEX_COMPLETION_FAST_MODEL", "yandexgpt-lite/latest")
+        self.llm_route_parameters = os.getenv("LLM_ROUTE_PARAMETERS", "fast")
+        self.llm_route_analysis = os.getenv("LLM_ROUTE_ANALYSIS", "large")
+        self.llm_route_generation = os.getenv("LLM_ROUTE_GENERATION", "large")
+        self.llm_route_generation_short = os.getenv("LLM_ROUTE_GENERATION_SHORT", "large")
+        self.llm_route_fast_max_prompt_tokens = int(os.getenv("LLM_ROUTE_FAST_MAX_PROMPT_TOKENS", "3000"))
+        self.llm_escalate_invalid_json = os.getenv("LLM_ESCALATE_INVALID_JSON", "true").lower() == "true"
+
+        # Output caps: the letter length we asked for bounds the tokens the model may spend
+        self.llm_output_caps_enabled = os.getenv("LLM_OUTPUT_CAPS_ENABLED", "true").lower() == "true"
+        # The model's signature is replaced by _build_signature anyway, so it need not be asked for
+        self.prompt_local_signature = os.getenv("PROMPT_LOCAL_SIGNATURE", "false").lower() == "true"
+        self.llm_max_output_tokens_parameters = int(os.getenv("LLM_MAX_OUTPUT_TOKENS_PARAMETERS", "300"))
+        self.llm_max_output_tokens_analysis = int(os.getenv("LLM_MAX_OUTPUT_TOKENS_ANALYSIS", "1200"))
+        # Qwen3 thinks aloud before answering unless told "/no_think"
+        self.llm_suppress_reasoning = os.getenv("LLM_SUPPRESS_REASONING", "true").lower() == "true"
+
+        # Thread chaining: a reply continues the stored answer (previous_response_id) with only the new letter
+        self.llm_thread_chaining_enabled = os.getenv("LLM_THREAD_CHAINING_ENABLED", "false").lower() == "true"
+        self.llm_thread_chain_max_age_hours = float(os.getenv("LLM_THREAD_CHAIN_MAX_AGE_HOURS", "24"))
+
+        # Cassette: "record" stores upstream answers by payload hash, "replay" serves them without the network
+        self.llm_cassette_mode = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+        self.llm_cassette_path = os.getenv("LLM_CASSETTE_PATH", "llm_cassette.jsonl.gz")
+
+        # HTTP connection pool configuration (shared by all upstream calls in the process)
+        self.http2_enabled = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+        self.http_max_connections = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+        self.http_max_keepalive_connections = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.http_keepalive_expiry = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SECONDS", "60"))
+        self.http_warmup_enabled = os.getenv("HTTP_WARMUP_ENABLED", "true").lower() == "true"
         
         # Redis configuration
         self.redis_enabled = os.getenv("REDIS_ENABLED", "false").lower() == "true"
@@ -47,6 +213,88 @@ class Settings:
         self.redis_ttl_analysis = int(os.getenv("REDIS_TTL_ANALYSIS_HOURS", "24"))  # 24 hours default
         self.redis_ttl_generation = int(os.getenv("REDIS_TTL_GENERATION_HOURS", "12"))  # 12 hours default
 
+        # Rate limiting: one bucket per folder shared by all workers through Redis
+        self.llm_rate_limit_enabled = os.getenv("LLM_RATE_LIMIT_ENABLED", "true").lower() == "true"
+        self.llm_rate_limit_rps = float(os.getenv("LLM_RATE_LIMIT_RPS", "10"))
+        self.llm_rate_limit_burst = float(os.getenv("LLM_RATE_LIMIT_BURST", "10"))
+        self.llm_rate_limit_tokens_per_minute = float(os.getenv("LLM_RATE_LIMIT_TOKENS_PER_MINUTE", "0"))  # 0 = no token quota
+        self.llm_rate_limit_max_wait_seconds = float(os.getenv("LLM_RATE_LIMIT_MAX_WAIT_SECONDS", "30"))
+        self.llm_expected_output_tokens = int(os.getenv("LLM_EXPECTED_OUTPUT_TOKENS", "800"))
+
+        # Circuit breaker: fail fast while the upstream errors or is too slow
+        self.circuit_breaker_enabled = os.getenv("CIRCUIT_BREAKER_ENABLED", "true").lower() == "true"
+        self.circuit_failure_rate_threshold = float(os.getenv("CIRCUIT_FAILURE_RATE_THRESHOLD", "0.5"))
+        self.circuit_slow_call_seconds = float(os.getenv("CIRCUIT_SLOW_CALL_SECONDS", "45"))
+        self.circuit_slow_call_rate_threshold = float(os.getenv("CIRCUIT_SLOW_CALL_RATE_THRESHOLD", "0.8"))
+        self.circuit_window_size = int(os.getenv("CIRCUIT_WINDOW_SIZE", "20"))
+        self.circuit_min_calls = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+        self.circuit_open_seconds = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+        # Hedging: duplicate a call that is slower than the observed percentile
+        self.llm_hedging_enabled = os.getenv("LLM_HEDGING_ENABLED", "false").lower() == "true"
+        self.llm_hedge_percentile = float(os.getenv("LLM_HEDGE_PERCENTILE", "95"))
+
+        # Single-flight: identical analysis/generation calls wait for the first one
+        self.single_flight_enabled = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() == "true"
+        self.single_flight_lock_ttl_seconds = float(os.getenv("SINGLE_FLIGHT_LOCK_TTL_SECONDS", "120"))
+        self.single_flight_wait_timeout_seconds = float(os.getenv("SINGLE_FLIGHT_WAIT_TIMEOUT_SECONDS", "90"))
+
+        # Micro-batching: letters analyzed within a short window share one prompt and one call
+        self.analysis_batch_enabled = os.getenv("ANALYSIS_BATCH_ENABLED", "false").lower() == "true"
+        self.analysis_batch_window_ms = float(os.getenv("ANALYSIS_BATCH_WINDOW_MS", "50"))
+        self.analysis_batch_max_size = int(os.getenv("ANALYSIS_BATCH_MAX_SIZE", "8"))
+
+        # Variants: /generate with several parameter sets generates them concurrently
+        self.generation_max_variants = int(os.getenv("GENERATION_MAX_VARIANTS", "4"))
+
+        # Analysis handles: /analyze-detailed returns analysis_id, /generate takes the letter and results by it
+        self.analysis_handle_ttl_seconds = float(os.getenv("ANALYSIS_HANDLE_TTL_SECONDS", "1800"))
+
+        # Speculative drafts: after /analyze-detailed the reply is generated in the background
+        # with the suggested parameters, so the operator's "generate" is usually instant
+        self.speculative_drafts_enabled = os.getenv("SPECULATIVE_DRAFTS_ENABLED", "false").lower() == "true"
+        self.speculative_draft_ttl_seconds = float(os.getenv("SPECULATIVE_DRAFT_TTL_SECONDS", "900"))
+
+        # Batch mode: non-urgent letters go through completionAsync, off the interactive quota
+        self.batch_enabled = os.getenv("BATCH_ENABLED", "false").lower() == "true"
+        self.yandex_completion_async_url = os.getenv(
+            "YANDEX_COMPLETION_ASYNC_URL", "https://llm.api.cloud.yandex.net/foundationModels/v1/completionAsync"
+        )
+        self.yandex_operations_url = os.getenv("YANDEX_OPERATIONS_URL", "https://operation.api.cloud.yandex.net/operations")
+        self.batch_submit_window = os.getenv("BATCH_SUBMIT_WINDOW", "")  # local hours "20-8"; empty = any time
+        self.batch_poll_interval_seconds = float(os.getenv("BATCH_POLL_INTERVAL_SECONDS", "30"))
+        self.batch_max_jobs_per_run = int(os.getenv("BATCH_MAX_JOBS_PER_RUN", "50"))
+        self.batch_max_attempts = int(os.getenv("BATCH_MAX_ATTEMPTS", "3"))
+        self.batch_min_sla_days = int(os.getenv("BATCH_MIN_SLA_DAYS", "3"))
+        # A job claimed for submission but not submitted by then (worker died) goes back to the queue
+        self.batch_claim_timeout_seconds = float(os.getenv("BATCH_CLAIM_TIMEOUT_SECONDS", "600"))
+
+        # Retries: jittered exponential backoff within a total budget per request
+        self.llm_retry_max_attempts = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "3"))
+        self.llm_retry_base_delay_seconds = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+        self.llm_retry_max_delay_seconds = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "10"))
+        self.llm_retry_budget_seconds = float(os.getenv("LLM_RETRY_BUDGET_SECONDS", "120"))
+        # Read timeout = observed latency percentile x multiplier, clamped to [min, max]
+        self.llm_connect_timeout_seconds = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "10"))
+        self.llm_read_timeout_min_seconds = float(os.getenv("LLM_READ_TIMEOUT_MIN_SECONDS", "15"))
+        self.llm_read_timeout_max_seconds = float(os.getenv("LLM_READ_TIMEOUT_MAX_SECONDS", "60"))
+        self.llm_timeout_percentile = float(os.getenv("LLM_TIMEOUT_PERCENTILE", "99"))
+        self.llm_timeout_multiplier = float(os.getenv("LLM_TIMEOUT_MULTIPLIER", "2"))
+
+
+def _parse_credentials(raw: str) -> list[tuple[str, str, float]]:
+    """Parse "key:folder[:weight]" entries separated by commas."""
+    credentials = []
+    for entry in raw.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        parts = entry.split(":")
+        if len(parts) not in (2, 3) or not parts[0] or not parts[1]:
+            raise RuntimeError(f"YANDEX_CREDENTIALS entry must be 'key:folder[:weight]', got '{entry}'")
+        weight = float(parts[2]) if len(parts) == 3 else 1.0
+        credentials.append((parts[0], parts[1], weight))
+    return credentials
+
 
 def get_settings() -> Settings:
     """Return settings instance."""
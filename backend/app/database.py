@@ -41,6 +41,14 @@ def get_db():
         db.close()
 
 
+# Columns of email_messages added after the first release: (name, SQL definition)
+_ADDED_COLUMNS = [
+    ("generation_time_seconds", "FLOAT NULL"),
+    ("llm_response_id", "VARCHAR(100) NULL"),
+    ("llm_folder_id", "VARCHAR(100) NULL"),
+]
+
+
 def init_db():
     """Initialize database tables."""
     if engine is None:
@@ -50,28 +58,29 @@ def init_db():
         Base.metadata.create_all(bind=engine)
         print("Database tables initialized successfully")
         
-        # Add generation_time_seconds column if it doesn't exist
-        try:
-            from sqlalchemy import text
-            with engine.begin() as conn:
-                check_query = text("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name='email_messages' 
-                    AND column_name='generation_time_seconds'
-                """)
-                result = conn.execute(check_query)
-                exists = result.fetchone() is not None
-                
-                if not exists:
-                    alter_query = text("""
-                        ALTER TABLE email_messages 
-                        ADD COLUMN generation_time_seconds FLOAT NULL
+        # Add columns introduced after the table was created
+        for column, definition in _ADDED_COLUMNS:
+            try:
+                from sqlalchemy import text
+                with engine.begin() as conn:
+                    check_query = text("""
+                        SELECT column_name 
+                        FROM information_schema.columns 
+                        WHERE table_name='email_messages' 
+                        AND column_name=:column
                     """)
-                    conn.execute(alter_query)
-                    print("Column 'generation_time_seconds' added successfully!")
-        except Exception as e:
-            print(f"Warning: Could not add generation_time_seconds column: {e}")
+                    result = conn.execute(check_query, {"column": column})
+                    exists = result.fetchone() is not None
+                    
+                    if not exists:
+                        alter_query = text(f"""
+                            ALTER TABLE email_messages 
+                            ADD COLUMN {column} {definition}
+                        """)
+                        conn.execute(alter_query)
+                        print(f"Column '{column}' added successfully!")
+            except Exception as e:
+                print(f"Warning: Could not add {column} column: {e}")
     except Exception as e:
         print(f"Warning: Could not initialize database tables: {e}")
         print("Application will continue, but database features may not work.")
@@ -49,6 +49,28 @@ class EmailMessage(Base):
     sender_position = Column(String(255), nullable=True, comment="Должность отправителя")
     created_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
     generation_time_seconds = Column(Float, nullable=True, comment="Время генерации письма в секундах (только для outgoing)")
+    llm_response_id = Column(String(100), nullable=True, comment="ID ответа модели, от которого продолжается переписка (только для outgoing)")
+    llm_folder_id = Column(String(100), nullable=True, comment="Каталог Yandex Cloud, в котором хранится ответ llm_response_id")
     
     thread = relationship("EmailThread", back_populates="messages")
 
+
+
+class BatchGenerationJob(Base):
+    """Model for letters generated off-peak through the asynchronous operations API."""
+    
+    __tablename__ = "batch_generation_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    thread_id = Column(Integer, ForeignKey("email_threads.id"), nullable=False, index=True, comment="ID переписки, куда записывается ответ")
+    status = Column(String(20), nullable=False, default="queued", index=True, comment="queued, submitting, submitted, done или failed")
+    request_json = Column(Text, nullable=False, comment="Запрос генерации (EmailGenerationRequest) в JSON")
+    messages_json = Column(Text, nullable=False, comment="Готовый промпт в JSON")
+    operation_id = Column(String(100), nullable=True, comment="ID асинхронной операции апстрима")
+    folder_id = Column(String(100), nullable=True, comment="Каталог, в котором запущена операция")
+    attempts = Column(Integer, nullable=False, default=0, comment="Сколько раз задача отправлялась")
+    error = Column(Text, nullable=True, comment="Последняя ошибка")
+    result_message_id = Column(Integer, ForeignKey("email_messages.id"), nullable=True, comment="Сгенерированное письмо")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    submitted_at = Column(DateTime(timezone=True), nullable=True)
+    completed_at = Column(DateTime(timezone=True), nullable=True)
@@ -1,5 +1,7 @@
 """FastAPI ASGI entrypoint."""
 
+import asyncio
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import Response, JSONResponse
@@ -11,7 +13,14 @@ from .api.context_routes import router as context_router
 from .api.thread_routes import router as thread_router
 from .api.analytics_routes import router as analytics_router
 from .api.recipient_routes import router as recipient_router
+from .config import get_settings
 from .database import init_db
+from .services.batch_generation import get_batch_service
+from .services.llm_metrics import start_request_timings
+from .services.circuit_breaker import CircuitOpenError
+from .services.latency_budget import LatencyBudgetExceeded
+from .services.rate_limiter import RateLimitExceeded
+from .services.http_client import init_async_http_client, close_async_http_client
 
 app = FastAPI(
     title="SHIFT HAPPENS — AI-ассистент для корпоративной переписки",
@@ -35,10 +44,34 @@ app.include_router(analytics_router)
 app.include_router(recipient_router)
 
 
+@app.middleware("http")
+async def llm_timing_headers(request: Request, call_next):
+    """Report quota queue wait separately from LLM time."""
+    timings = start_request_timings()
+    response = await call_next(request)
+    if timings.calls:
+        response.headers["X-LLM-Queue-Wait-Ms"] = str(int(timings.queue_wait_seconds * 1000))
+        response.headers["X-LLM-Time-Ms"] = str(int(timings.llm_seconds * 1000))
+    return response
+
+
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database on startup."""
+    """Initialize database and warm up the upstream connection pool on startup."""
     init_db()
+    await init_async_http_client()
+    if get_settings().batch_enabled:
+        # Фоновая отправка и опрос пакетных задач
+        app.state.batch_task = asyncio.create_task(get_batch_service().run_forever())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the batch loop and release pooled upstream connections."""
+    batch_task = getattr(app.state, "batch_task", None)
+    if batch_task is not None:
+        batch_task.cancel()
+    await close_async_http_client()
 
 
 @app.exception_handler(Exception)
@@ -55,6 +88,50 @@ async def global_exception_handler(request: Request, exc: Exception):
     )
 
 
+@app.exception_handler(RateLimitExceeded)
+async def rate_limit_exception_handler(request: Request, exc: RateLimitExceeded):
+    """Quota queue is full: ask the client to retry later instead of failing with 500."""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "type": type(exc).__name__},
+        headers={
+            "Retry-After": str(max(1, int(exc.retry_after_seconds + 0.999))),
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "*",
+            "Access-Control-Allow-Headers": "*",
+        },
+    )
+
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_exception_handler(request: Request, exc: CircuitOpenError):
+    """Upstream is unhealthy: fail fast with 503 instead of waiting for timeouts."""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "type": type(exc).__name__},
+        headers={
+            "Retry-After": str(max(1, int(exc.retry_after_seconds + 0.999))),
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "*",
+            "Access-Control-Allow-Headers": "*",
+        },
+    )
+
+
+@app.exception_handler(LatencyBudgetExceeded)
+async def latency_budget_exception_handler(request: Request, exc: LatencyBudgetExceeded):
+    """The model did not answer within the caller's X-Latency-Budget-Ms."""
+    return JSONResponse(
+        status_code=504,
+        content={"detail": str(exc), "type": type(exc).__name__},
+        headers={
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "*",
+            "Access-Control-Allow-Headers": "*",
+        },
+    )
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     """Handle validation errors with CORS headers."""
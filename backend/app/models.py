@@ -2,7 +2,7 @@
 
 from typing import Literal, Optional, List
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, model_validator
 
 
 Tone = Literal["formal", "neutral", "friendly"]
@@ -43,11 +43,15 @@ class EmailParameters(BaseModel):
 class EmailGenerationRequest(BaseModel):
     """Request payload for /emails/generate."""
 
-    source_subject: str = Field(
-        ..., description="Subject of the inbound letter or summary of request."
+    source_subject: Optional[str] = Field(
+        default=None, description="Subject of the inbound letter or summary of request. May be omitted with analysis_id."
     )
-    source_body: str = Field(
-        ..., description="Original text or structured summary of the incoming letter."
+    source_body: Optional[str] = Field(
+        default=None, description="Original text or structured summary of the incoming letter. May be omitted with analysis_id."
+    )
+    analysis_id: Optional[str] = Field(
+        default=None,
+        description="ID returned by /analyze-detailed: the letter, company context, recipient and analysis results are taken from it.",
     )
     company_context: Optional[str] = Field(
         default=None,
@@ -98,6 +102,21 @@ class EmailGenerationRequest(BaseModel):
     parameters: EmailParameters = Field(
         default_factory=EmailParameters, description="Controls tone/style of the reply."
     )
+    variants: Optional[List[EmailParameters]] = Field(
+        default=None,
+        description="Several parameter sets to compare: /generate streams one draft per set (server-sent events) as each is ready.",
+    )
+    latency_budget_ms: Optional[int] = Field(
+        default=None,
+        gt=0,
+        description="Max time to wait for the model, ms. Overrides the X-Latency-Budget-Ms header.",
+    )
+
+    @model_validator(mode="after")
+    def _require_letter(self) -> "EmailGenerationRequest":
+        if self.analysis_id is None and (self.source_subject is None or self.source_body is None):
+            raise ValueError("source_subject and source_body are required unless analysis_id is given")
+        return self
 
 
 class EmailAnalysisRequest(BaseModel):
@@ -105,6 +124,11 @@ class EmailAnalysisRequest(BaseModel):
     source_subject: str
     source_body: str
     company_context: str = ""
+    latency_budget_ms: Optional[int] = Field(
+        None,
+        gt=0,
+        description="Сколько ждать модель, мс; при превышении возвращается анализ по ключевым словам. Приоритетнее заголовка X-Latency-Budget-Ms",
+    )
 
 
 class EmailParametersResponse(BaseModel):
@@ -129,6 +153,9 @@ class DetailedEmailAnalysis(BaseModel):
     department: str = Field(..., description="Определенный отдел для маршрутизации")
     estimated_sla_days: int = Field(..., description="Расчетный срок ответа в рабочих днях")
     extracted_deadline_days: Optional[int] = Field(None, description="Извлеченный дедлайн из текста письма в рабочих днях, если указан")
+    degraded: bool = Field(False, description="Модель не ответила в бюджет запроса: анализ построен только по ключевым словам")
+    batch_eligible: bool = Field(False, description="Ответ не срочный: его можно сгенерировать в пакетном режиме (/generate/batch)")
+    analysis_id: Optional[str] = Field(None, description="ID анализа для /generate (analysis_id): письмо и результаты анализа не нужно передавать повторно")
 
 
 class EmailGenerationResponse(BaseModel):
@@ -138,6 +165,52 @@ class EmailGenerationResponse(BaseModel):
     body: str
 
 
+class SectionRegenerationRequest(BaseModel):
+    """Запрос на переписывание одного фрагмента готового черновика"""
+    message_id: Optional[int] = Field(None, description="ID исходящего письма переписки; тогда subject и body не нужны")
+    subject: Optional[str] = Field(None, description="Тема черновика")
+    body: Optional[str] = Field(None, description="Текст черновика (вместе с подписью)")
+    target: Literal["subject", "body"] = Field("body", description="Что переписать: тему или фрагмент текста")
+    start: Optional[int] = Field(None, ge=0, description="Начало фрагмента в body (индекс символа), для target=body")
+    end: Optional[int] = Field(None, ge=0, description="Конец фрагмента в body (не включая), для target=body")
+    instruction: str = Field(..., min_length=1, description="Что изменить во фрагменте")
+    latency_budget_ms: Optional[int] = Field(
+        None,
+        gt=0,
+        description="Сколько ждать модель, мс. Приоритетнее заголовка X-Latency-Budget-Ms",
+    )
+
+    @model_validator(mode="after")
+    def _require_draft(self) -> "SectionRegenerationRequest":
+        if self.message_id is None and (self.subject is None or self.body is None):
+            raise ValueError("subject and body are required unless message_id is given")
+        if self.target == "body" and (self.start is None or self.end is None):
+            raise ValueError("start and end are required for target=body")
+        return self
+
+
+class SectionRegenerationResponse(EmailGenerationResponse):
+    """Черновик с переписанным фрагментом; start/end — границы нового фрагмента"""
+    start: int
+    end: int
+
+
+class AnalyzeAndDraftResponse(BaseModel):
+    """Расширенный анализ и черновик ответа, полученные одним вызовом модели"""
+    analysis: DetailedEmailAnalysis
+    draft: EmailGenerationResponse
+
+
+class PromptPreviewResponse(BaseModel):
+    """Промпт генерации, который был бы отправлен модели (без вызова модели)"""
+    template: str = Field(..., description="Имя шаблона промпта")
+    template_version: str = Field(..., description="Версия шаблона (хэш статической части)")
+    messages: List[dict] = Field(..., description="Сообщения для модели")
+    estimated_input_tokens: int = Field(..., description="Оценка числа входных токенов")
+    max_output_tokens: Optional[int] = Field(None, description="Лимит ответа модели (None — без лимита)")
+    model_tier: str = Field(..., description="Модель, выбранная маршрутизатором")
+
+
 class CompanyContextCreate(BaseModel):
     """Request model for creating company context."""
     name: str = Field(..., description="Название контекста")
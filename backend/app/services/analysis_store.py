@@ -0,0 +1,107 @@
+"""Short-lived store of detailed analyses, referenced from /generate by analysis_id."""
+
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from ..config import get_settings
+from ..models import DetailedEmailAnalysis
+from .recipient_extractor import format_recipient_name
+
+
+@dataclass
+class StoredAnalysis:
+    """A letter together with everything /analyze-detailed computed for it."""
+
+    subject: str
+    body: str
+    company_context: str
+    analysis: DetailedEmailAnalysis
+    recipient_name: Optional[str] = None
+
+    def as_dict(self) -> dict:
+        return {
+            "subject": self.subject,
+            "body": self.body,
+            "company_context": self.company_context,
+            "analysis": self.analysis.model_dump(exclude={"analysis_id"}),
+            "recipient_name": self.recipient_name,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StoredAnalysis":
+        return cls(
+            subject=data["subject"],
+            body=data["body"],
+            company_context=data["company_context"],
+            analysis=DetailedEmailAnalysis(**data["analysis"]),
+            recipient_name=data.get("recipient_name"),
+        )
+
+
+class AnalysisStore:
+    """Analyses by id for ``ttl_seconds``: in Redis when the cache is enabled, else in process.
+
+    /generate with ``analysis_id`` takes the letter, the company context, the
+    recipient and the analysis results from here instead of receiving the letter
+    again and recomputing them.
+    """
+
+    def __init__(self, cache=None, ttl_seconds: float = 1800.0, max_entries: int = 1000) -> None:
+        self._cache = cache
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._local: "OrderedDict[str, tuple[float, StoredAnalysis]]" = OrderedDict()
+        # put/get run in worker threads (the Redis client is synchronous)
+        self._lock = threading.Lock()
+
+    def _shared(self) -> bool:
+        return self._cache is not None and self._cache.is_enabled()
+
+    def put(self, subject: str, body: str, company_context: str, analysis: DetailedEmailAnalysis) -> str:
+        """Store the analysis of a letter and return its id."""
+        analysis_id = uuid.uuid4().hex
+        stored = StoredAnalysis(subject, body, company_context, analysis, format_recipient_name(subject, body))
+        if self._shared() and self._cache.set("analysis_handle", stored.as_dict(), self._ttl / 3600, analysis_id):
+            return analysis_id
+
+        with self._lock:
+            self._local[analysis_id] = (time.monotonic() + self._ttl, stored)
+            while len(self._local) > self._max_entries:
+                self._local.popitem(last=False)
+        return analysis_id
+
+    def get(self, analysis_id: str) -> Optional[StoredAnalysis]:
+        """The stored analysis, or None if the id is unknown or expired."""
+        with self._lock:
+            entry = self._local.get(analysis_id)
+            if entry is not None:
+                expires, stored = entry
+                if time.monotonic() < expires:
+                    return stored
+                del self._local[analysis_id]
+        if self._shared():
+            data = self._cache.get("analysis_handle", analysis_id)
+            if data:
+                return StoredAnalysis.from_dict(data)
+        return None
+
+
+# Singleton instance
+_analysis_store: Optional[AnalysisStore] = None
+
+def get_analysis_store() -> AnalysisStore:
+    """Get singleton analysis store."""
+    global _analysis_store
+    if _analysis_store is None:
+        from .cache_service import get_cache_service
+        _analysis_store = AnalysisStore(
+            cache=get_cache_service(),
+            ttl_seconds=get_settings().analysis_handle_ttl_seconds,
+        )
+    return _analysis_store
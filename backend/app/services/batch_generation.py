@@ -0,0 +1,358 @@
+"""Off-peak batch generation of non-urgent letters through the asynchronous operations API."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Optional
+
+import httpx
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from ..config import get_settings
+from .. import database
+from ..db_models import BatchGenerationJob, EmailMessage
+from ..models import EmailGenerationRequest
+from .http_client import get_async_http_client
+from .model_router import LARGE
+from .prompt_builder import build_messages
+from .thread_service import ThreadService
+from .yandex_gpt_client import AsyncYandexCompletionService, _finalize_letter, _letter_output_cap, _local_signature
+
+QUEUED = "queued"
+SUBMITTING = "submitting"
+SUBMITTED = "submitted"
+DONE = "done"
+FAILED = "failed"
+
+def is_batch_eligible(category: str, urgency: str, estimated_sla_days: int) -> bool:
+    """Letter can wait for off-peak batch generation instead of an interactive call.
+
+    Non-urgent notifications always can; information requests only with a long
+    SLA (BATCH_MIN_SLA_DAYS and more).
+    """
+    if urgency == "high":
+        return False
+    if category == "notification":
+        return True
+    return category == "information_request" and estimated_sla_days >= get_settings().batch_min_sla_days
+
+
+def in_submit_window(window: str, hour: int) -> bool:
+    """True if ``hour`` falls into a "start-end" window of local hours (may wrap midnight)."""
+    if not window.strip():
+        return True
+    start, end = (int(part) for part in window.split("-"))
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end
+
+
+class BatchGenerationService:
+    """Collects batch jobs, submits them to completionAsync and writes finished letters to threads.
+
+    Jobs live in ``batch_generation_jobs``: ``queued`` -> ``submitting`` (claimed
+    by one worker) -> ``submitted`` (operation started upstream) -> ``done``
+    (outgoing EmailMessage written) or ``failed``. Rows are claimed with
+    ``SELECT ... FOR UPDATE SKIP LOCKED``, so several uvicorn workers never submit
+    or complete the same job twice. Database work runs in the threadpool: the
+    loop shares the event loop with the API. Submissions bypass the interactive
+    rate limiter: asynchronous operations have their own upstream quota, so
+    operators keep the interactive one.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] | None = None,
+        http_client: httpx.AsyncClient | None = None,
+        completion_client: AsyncYandexCompletionService | None = None,
+    ) -> None:
+        self._session_factory = session_factory
+        self._http_client = http_client
+        self._completion = completion_client
+
+    def _session(self) -> Session:
+        factory = self._session_factory or database.SessionLocal
+        if factory is None:
+            raise RuntimeError("Database is not configured. Please check DATABASE_URL in .env file.")
+        return factory()
+
+    def _client(self) -> httpx.AsyncClient:
+        return self._http_client or get_async_http_client()
+
+    def _completion_client(self) -> AsyncYandexCompletionService:
+        if self._completion is None:
+            self._completion = AsyncYandexCompletionService()
+        return self._completion
+
+    def enqueue(
+        self,
+        db: Session,
+        request: EmailGenerationRequest,
+        thread_history: str | None = None,
+        recipient_name: str | None = None,
+    ) -> BatchGenerationJob:
+        """Store a generation job; the prompt is built now, while the thread history is current."""
+        if not request.thread_id:
+            raise ValueError("Пакетная генерация записывает ответ в переписку: нужен thread_id")
+        messages = build_messages(
+            request,
+            thread_history=thread_history,
+            recipient_name=recipient_name,
+            local_signature=_local_signature(request),
+        )
+        job = BatchGenerationJob(
+            thread_id=request.thread_id,
+            status=QUEUED,
+            request_json=request.model_dump_json(),
+            messages_json=json.dumps(messages, ensure_ascii=False),
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        return job
+
+    @staticmethod
+    def get_job(db: Session, job_id: int) -> Optional[BatchGenerationJob]:
+        return db.query(BatchGenerationJob).filter(BatchGenerationJob.id == job_id).first()
+
+    @staticmethod
+    def job_to_dict(db: Session, job: BatchGenerationJob) -> dict:
+        result = {
+            "id": job.id,
+            "thread_id": job.thread_id,
+            "status": job.status,
+            "attempts": job.attempts,
+            "error": job.error,
+            "result_message_id": job.result_message_id,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "completed_at": job.completed_at.isoformat() if job.completed_at else None,
+        }
+        if job.result_message_id:
+            message = db.query(EmailMessage).filter(EmailMessage.id == job.result_message_id).first()
+            if message:
+                result["subject"] = message.subject
+                result["body"] = message.body
+        return result
+
+    async def _submit(self, job: BatchGenerationJob) -> tuple[str, str]:
+        """Start the upstream operation; returns (operation_id, folder_id)."""
+        completion = self._completion_client()
+        messages = json.loads(job.messages_json)
+        request = EmailGenerationRequest.model_validate_json(job.request_json)
+        credential = completion.credentials.candidates()[0]
+        # Качество важнее задержки: пакетные письма всегда идут в большую модель
+        headers, payload = completion._build_request(
+            messages, LARGE, credential, 0.4, None, _letter_output_cap(request)
+        )
+        response = await self._client().post(get_settings().yandex_completion_async_url, headers=headers, json=payload)
+        response.raise_for_status()
+        return response.json()["id"], credential.folder_id
+
+    def _claim_queued(self, limit: int) -> list[BatchGenerationJob]:
+        """Mark up to ``limit`` queued jobs as ``submitting`` for this worker (blocking, threadpool)."""
+        db = self._session()
+        try:
+            now = datetime.now(timezone.utc)
+            stale = (
+                db.query(BatchGenerationJob)
+                .filter(BatchGenerationJob.status == SUBMITTING)
+                .filter(BatchGenerationJob.submitted_at < now - timedelta(seconds=get_settings().batch_claim_timeout_seconds))
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            for job in stale:
+                print(f"[BATCH] Задача {job.id}: захват устарел, возвращаем в очередь")
+                job.status = QUEUED
+            db.commit()
+
+            jobs = (
+                db.query(BatchGenerationJob)
+                .filter(BatchGenerationJob.status == QUEUED)
+                .order_by(BatchGenerationJob.id)
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+                .all()
+            )
+            for job in jobs:
+                job.status = SUBMITTING
+                job.submitted_at = now  # время захвата; после отправки — время отправки
+            db.commit()
+            for job in jobs:
+                db.refresh(job)
+                db.expunge(job)
+            return jobs
+        finally:
+            db.close()
+
+    def _record_submissions(self, jobs: list[BatchGenerationJob], results: list) -> int:
+        settings = get_settings()
+        db = self._session()
+        submitted = 0
+        try:
+            for claimed, result in zip(jobs, results):
+                job = db.get(BatchGenerationJob, claimed.id)
+                job.attempts += 1
+                if isinstance(result, Exception):
+                    print(f"[BATCH] Задача {job.id}: не удалось отправить ({result})")
+                    job.error = str(result)
+                    job.status = FAILED if job.attempts >= settings.batch_max_attempts else QUEUED
+                    continue
+                job.operation_id, job.folder_id = result
+                job.status = SUBMITTED
+                job.error = None
+                job.submitted_at = datetime.now(timezone.utc)
+                submitted += 1
+            db.commit()
+        finally:
+            db.close()
+        return submitted
+
+    async def submit_pending(self) -> int:
+        """Start upstream operations for queued jobs (only inside BATCH_SUBMIT_WINDOW)."""
+        settings = get_settings()
+        if not in_submit_window(settings.batch_submit_window, datetime.now().hour):
+            return 0
+        jobs = await run_in_threadpool(self._claim_queued, settings.batch_max_jobs_per_run)
+        if not jobs:
+            return 0
+        # Все задачи прогона отправляются одновременно
+        results = await asyncio.gather(*(self._submit(job) for job in jobs), return_exceptions=True)
+        submitted = await run_in_threadpool(self._record_submissions, jobs, results)
+        if submitted:
+            print(f"[BATCH] Отправлено задач: {submitted}")
+        return submitted
+
+    async def _fetch_operation(self, job: BatchGenerationJob) -> dict:
+        completion = self._completion_client()
+        credential = completion.credentials.for_folder(job.folder_id) or completion.credentials.primary
+        response = await self._client().get(
+            f"{get_settings().yandex_operations_url}/{job.operation_id}", headers=completion._headers(credential)
+        )
+        response.raise_for_status()
+        return response.json()
+
+    def _complete(self, db: Session, job: BatchGenerationJob, operation: dict) -> None:
+        completion = self._completion_client()
+        request = EmailGenerationRequest.model_validate_json(job.request_json)
+        # Ответ операции — тот же CompletionResponse, что у синхронного API, без обёртки "result"
+        raw_text = completion._parse_response({"result": operation.get("response") or {}})
+        letter = _finalize_letter(request, raw_text)
+        sender_name = None
+        if request.sender_first_name or request.sender_last_name:
+            sender_name = f"{request.sender_first_name or ''} {request.sender_last_name or ''}".strip()
+        # Статус меняется до add_message: его commit фиксирует письмо и "done" одной транзакцией
+        job.status = DONE
+        job.completed_at = datetime.now(timezone.utc)
+        # generation_time_seconds не пишем: время пакетной генерации не должно портить аналитику интерактивной
+        message = ThreadService.add_message(
+            db=db,
+            thread_id=job.thread_id,
+            message_type="outgoing",
+            subject=letter.subject,
+            body=letter.body,
+            sender_name=sender_name,
+            sender_position=request.sender_position,
+        )
+        job.result_message_id = message.id
+
+    def _submitted_jobs(self) -> list[BatchGenerationJob]:
+        db = self._session()
+        try:
+            jobs = (
+                db.query(BatchGenerationJob)
+                .filter(BatchGenerationJob.status == SUBMITTED)
+                .order_by(BatchGenerationJob.id)
+                .all()
+            )
+            for job in jobs:
+                db.expunge(job)
+            return jobs
+        finally:
+            db.close()
+
+    def _record_operations(self, finished: list[tuple[BatchGenerationJob, dict]]) -> int:
+        """Write finished operations; a job another worker is completing is skipped (blocking, threadpool)."""
+        settings = get_settings()
+        db = self._session()
+        completed = 0
+        try:
+            for polled, operation in finished:
+                job = (
+                    db.query(BatchGenerationJob)
+                    .filter(BatchGenerationJob.id == polled.id, BatchGenerationJob.status == SUBMITTED)
+                    .with_for_update(skip_locked=True)
+                    .first()
+                )
+                if job is None:
+                    continue
+                try:
+                    if operation.get("error"):
+                        raise RuntimeError(operation["error"].get("message", "Unknown error"))
+                    self._complete(db, job, operation)
+                    completed += 1
+                except Exception as e:
+                    db.rollback()
+                    job = db.get(BatchGenerationJob, polled.id)
+                    print(f"[BATCH] Задача {job.id}: операция завершилась ошибкой ({e})")
+                    job.error = str(e)
+                    job.status = FAILED if job.attempts >= settings.batch_max_attempts else QUEUED
+                db.commit()
+        finally:
+            db.close()
+        return completed
+
+    async def poll_submitted(self) -> int:
+        """Check started operations; write finished letters into their threads.
+
+        At most BATCH_MAX_JOBS_PER_RUN status requests are in flight at once.
+        """
+        jobs = await run_in_threadpool(self._submitted_jobs)
+        if not jobs:
+            return 0
+        semaphore = asyncio.Semaphore(get_settings().batch_max_jobs_per_run)
+
+        async def fetch(job: BatchGenerationJob) -> dict:
+            async with semaphore:
+                return await self._fetch_operation(job)
+
+        operations = await asyncio.gather(*(fetch(job) for job in jobs), return_exceptions=True)
+        finished = []
+        for job, operation in zip(jobs, operations):
+            if isinstance(operation, Exception):
+                print(f"[BATCH] Задача {job.id}: не удалось получить статус операции ({operation})")
+            elif operation.get("done"):
+                finished.append((job, operation))
+        completed = await run_in_threadpool(self._record_operations, finished) if finished else 0
+        if completed:
+            print(f"[BATCH] Готово писем: {completed}")
+        return completed
+
+    async def run_once(self) -> None:
+        await self.submit_pending()
+        await self.poll_submitted()
+
+    async def run_forever(self) -> None:
+        """Background loop started on application startup when BATCH_ENABLED=true."""
+        interval = get_settings().batch_poll_interval_seconds
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[BATCH] Ошибка цикла пакетной генерации: {e}")
+            await asyncio.sleep(interval)
+
+
+# Singleton instance
+_batch_service = None
+
+def get_batch_service() -> BatchGenerationService:
+    """Get singleton batch generation service."""
+    global _batch_service
+    if _batch_service is None:
+        _batch_service = BatchGenerationService()
+    return _batch_service
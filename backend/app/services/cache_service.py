@@ -2,6 +2,7 @@
 
 import json
 import hashlib
+import uuid
 from typing import Optional, Any
 import redis
 from redis.exceptions import ConnectionError, TimeoutError
@@ -9,6 +10,15 @@ from redis.exceptions import ConnectionError, TimeoutError
 from ..config import get_settings
 
 
+# Delete the lock only if it still holds our token (it may have expired and been re-taken)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+
 class CacheService:
     """Service for caching AI responses using Redis."""
     
@@ -70,7 +80,7 @@ class CacheService:
         
         try:
             key = self._generate_key(prefix, *args)
-            ttl_seconds = ttl_hours * 3600
+            ttl_seconds = int(ttl_hours * 3600)
             serialized = json.dumps(value, ensure_ascii=False)
             self._redis_client.setex(key, ttl_seconds, serialized)
             print(f"[CACHE] SET: {prefix} (TTL: {ttl_hours}h)")
@@ -87,7 +97,7 @@ class CacheService:
         """Cache analysis result."""
         return self.set("analysis", result, self._ttl_analysis, subject, body, company_context)
     
-    def get_generation(
+    def _generation_args(
         self,
         source_subject: str,
         source_body: str,
@@ -96,10 +106,8 @@ class CacheService:
         thread_history: Optional[str] = None,
         extra_directives: Optional[list] = None,
         custom_prompt: Optional[str] = None
-    ) -> Optional[dict]:
-        """Get cached generation result."""
-        return self.get(
-            "generation",
+    ) -> tuple:
+        return (
             source_subject,
             source_body,
             company_context,
@@ -109,6 +117,25 @@ class CacheService:
             custom_prompt or ""
         )
     
+    def get_generation(
+        self,
+        source_subject: str,
+        source_body: str,
+        company_context: str,
+        parameters_hash: str,
+        thread_history: Optional[str] = None,
+        extra_directives: Optional[list] = None,
+        custom_prompt: Optional[str] = None
+    ) -> Optional[dict]:
+        """Get cached generation result."""
+        return self.get(
+            "generation",
+            *self._generation_args(
+                source_subject, source_body, company_context, parameters_hash,
+                thread_history, extra_directives, custom_prompt
+            )
+        )
+    
     def set_generation(
         self,
         source_subject: str,
@@ -125,15 +152,78 @@ class CacheService:
             "generation",
             result,
             self._ttl_generation,
-            source_subject,
-            source_body,
-            company_context,
-            parameters_hash,
-            thread_history or "",
-            json.dumps(extra_directives or [], sort_keys=True),
-            custom_prompt or ""
+            *self._generation_args(
+                source_subject, source_body, company_context, parameters_hash,
+                thread_history, extra_directives, custom_prompt
+            )
+        )
+    
+    def get_draft(self, generation_key: str) -> Optional[str]:
+        """Get a draft generated ahead of the request (raw model answer, without signature)."""
+        return self.get("draft", generation_key)
+    
+    def set_draft(self, generation_key: str, text: str, ttl_seconds: float) -> bool:
+        """Cache a draft generated ahead of the request."""
+        return self.set("draft", text, ttl_seconds / 3600, generation_key)
+    
+    def analysis_key(self, subject: str, body: str, company_context: str) -> str:
+        """Fingerprint of an analysis request (the key get_analysis reads)."""
+        return self._generate_key("analysis", subject, body, company_context)
+    
+    def generation_key(
+        self,
+        source_subject: str,
+        source_body: str,
+        company_context: str,
+        parameters_hash: str,
+        thread_history: Optional[str] = None,
+        extra_directives: Optional[list] = None,
+        custom_prompt: Optional[str] = None
+    ) -> str:
+        """Fingerprint of a generation request (the key get_generation reads)."""
+        return self._generate_key(
+            "generation",
+            *self._generation_args(
+                source_subject, source_body, company_context, parameters_hash,
+                thread_history, extra_directives, custom_prompt
+            )
         )
     
+    def acquire_lock(self, key: str, ttl_seconds: float) -> Optional[str]:
+        """Try to take a short-lived lock shared by all workers. Returns the lock token."""
+        if not self._enabled or not self._redis_client:
+            return None
+        
+        token = uuid.uuid4().hex
+        try:
+            if self._redis_client.set(f"{key}:lock", token, nx=True, px=int(ttl_seconds * 1000)):
+                return token
+            return None
+        except Exception as e:
+            print(f"[CACHE] Error acquiring lock: {e}")
+            return None
+    
+    def release_lock(self, key: str, token: str) -> None:
+        """Release a lock taken with acquire_lock (only if we still own it)."""
+        if not self._enabled or not self._redis_client:
+            return
+        
+        try:
+            self._redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, f"{key}:lock", token)
+        except Exception as e:
+            print(f"[CACHE] Error releasing lock: {e}")
+    
+    def is_locked(self, key: str) -> bool:
+        """Check whether another worker holds the lock for key."""
+        if not self._enabled or not self._redis_client:
+            return False
+        
+        try:
+            return bool(self._redis_client.exists(f"{key}:lock"))
+        except Exception as e:
+            print(f"[CACHE] Error checking lock: {e}")
+            return False
+    
     def clear_pattern(self, pattern: str) -> int:
         """Clear cache entries matching pattern."""
         if not self._enabled or not self._redis_client:
@@ -151,6 +241,11 @@ class CacheService:
     def is_enabled(self) -> bool:
         """Check if cache is enabled."""
         return self._enabled
+    
+    @property
+    def client(self) -> Optional[redis.Redis]:
+        """Underlying Redis client shared with other services (None when disabled)."""
+        return self._redis_client if self._enabled else None
 
 
 # Singleton instance
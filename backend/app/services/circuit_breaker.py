@@ -0,0 +1,145 @@
+"""Circuit breaker around upstream LLM calls."""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+
+from ..config import get_settings
+
+
+class CircuitOpenError(RuntimeError):
+    """The upstream is considered unhealthy; the call was rejected without being sent."""
+
+    def __init__(self, name: str, retry_after_seconds: float) -> None:
+        super().__init__(
+            f"Сервис {name} временно недоступен (circuit breaker открыт), "
+            f"повторите через {retry_after_seconds:.0f} сек"
+        )
+        self.retry_after_seconds = retry_after_seconds
+
+
+class CircuitBreaker:
+    """Fails fast while the upstream is failing or too slow.
+
+    Outcomes of the last ``window_size`` calls are kept. Once at least
+    ``min_calls`` are recorded and the share of failed calls or of calls
+    slower than ``slow_call_seconds`` reaches its threshold, the circuit
+    opens and calls are rejected for ``open_seconds``. After that it is
+    half-open: up to ``half_open_max_calls`` probe calls go through; a
+    successful probe closes the circuit, a failed one opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float = 0.5,
+        slow_call_seconds: float = 30.0,
+        slow_call_rate_threshold: float = 0.8,
+        window_size: int = 20,
+        min_calls: int = 10,
+        open_seconds: float = 30.0,
+        half_open_max_calls: int = 1,
+    ) -> None:
+        self.name = name
+        self._failure_rate_threshold = failure_rate_threshold
+        self._slow_call_seconds = slow_call_seconds
+        self._slow_call_rate_threshold = slow_call_rate_threshold
+        self._min_calls = min_calls
+        self._open_seconds = open_seconds
+        self._half_open_max_calls = half_open_max_calls
+        self._outcomes: deque[tuple[bool, bool]] = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _maybe_half_open(self) -> None:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self._open_seconds:
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+            print(f"[CIRCUIT] {self.name}: half-open, probing upstream")
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        print(f"[CIRCUIT] {self.name}: open for {self._open_seconds:.0f}s")
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if the call must not be sent."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.OPEN:
+                retry_after = self._open_seconds - (time.monotonic() - self._opened_at)
+                raise CircuitOpenError(self.name, max(1.0, retry_after))
+            if self._state == self.HALF_OPEN:
+                if self._half_open_calls >= self._half_open_max_calls:
+                    raise CircuitOpenError(self.name, 1.0)
+                self._half_open_calls += 1
+
+    def record_success(self, duration_seconds: float) -> None:
+        self._record(failed=False, duration_seconds=duration_seconds)
+
+    def record_failure(self, duration_seconds: float = 0.0) -> None:
+        self._record(failed=True, duration_seconds=duration_seconds)
+
+    def record_cancelled(self) -> None:
+        """The caller abandoned the call: free its half-open probe slot without a verdict."""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._half_open_calls > 0:
+                self._half_open_calls -= 1
+
+    def _record(self, failed: bool, duration_seconds: float) -> None:
+        slow = duration_seconds >= self._slow_call_seconds
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if failed or slow:
+                    self._open()
+                else:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    print(f"[CIRCUIT] {self.name}: closed")
+                return
+            if self._state == self.OPEN:
+                return
+
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self._min_calls:
+                return
+            total = len(self._outcomes)
+            failure_rate = sum(1 for f, _ in self._outcomes if f) / total
+            slow_rate = sum(1 for _, s in self._outcomes if s) / total
+            if failure_rate >= self._failure_rate_threshold or slow_rate >= self._slow_call_rate_threshold:
+                self._open()
+
+
+# Breakers per upstream
+_breakers: dict[str, CircuitBreaker] = {}
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Get the shared circuit breaker for an upstream, configured from Settings."""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        settings = get_settings()
+        breaker = _breakers.setdefault(name, CircuitBreaker(
+            name,
+            failure_rate_threshold=settings.circuit_failure_rate_threshold,
+            slow_call_seconds=settings.circuit_slow_call_seconds,
+            slow_call_rate_threshold=settings.circuit_slow_call_rate_threshold,
+            window_size=settings.circuit_window_size,
+            min_calls=settings.circuit_min_calls,
+            open_seconds=settings.circuit_open_seconds,
+        ))
+    return breaker
@@ -0,0 +1,102 @@
+"""Per-thread continuation of the upstream conversation (Responses API ``previous_response_id``)."""
+
+from __future__ import annotations
+
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from ..config import get_settings
+from ..db_models import EmailMessage
+from ..models import EmailGenerationRequest
+from .prompt_builder import build_followup_messages
+from .thread_service import ThreadService
+
+
+@dataclass
+class ThreadChain:
+    """Conversation state of one reply in a thread.
+
+    ``previous_response_id`` is the upstream answer that produced the last
+    outgoing letter; while it is valid the Responses API gets only
+    ``followup_messages`` (the new letter) instead of the full history.
+    ``response_id`` receives the id of the new answer, to be stored on the
+    outgoing EmailMessage. Stored answers live in one Yandex folder:
+    ``folder_id`` is the folder of the previous answer (the continued call is
+    pinned to its credential), then the folder of the new one. Backends without
+    server-side state ignore the chain and keep using the full prompt.
+    """
+
+    previous_response_id: Optional[str] = None
+    followup_messages: Optional[List[Dict[str, str]]] = None
+    response_id: Optional[str] = None
+    folder_id: Optional[str] = None
+    expired: bool = False
+
+    @property
+    def continues(self) -> bool:
+        """True while the next call should continue the stored conversation."""
+        return bool(self.previous_response_id and self.followup_messages) and not self.expired
+
+
+_current_chain: ContextVar[Optional[ThreadChain]] = ContextVar("thread_chain", default=None)
+
+
+def start_chain(chain: Optional[ThreadChain]) -> None:
+    """Attach ``chain`` to the LLM calls of the current request (None to detach)."""
+    _current_chain.set(chain)
+
+
+def current_chain() -> Optional[ThreadChain]:
+    return _current_chain.get()
+
+
+def record_response_id(response_id: Optional[str]) -> None:
+    """Remember the upstream id of the answer that was just received."""
+    chain = _current_chain.get()
+    if chain is not None and response_id:
+        chain.response_id = response_id
+
+
+def record_response_folder(folder_id: Optional[str]) -> None:
+    """Remember the folder that stores the answer just received (after record_response_id)."""
+    chain = _current_chain.get()
+    if chain is not None and chain.response_id and folder_id:
+        chain.folder_id = folder_id
+
+
+def chain_for_reply(
+    history: List[EmailMessage], request: EmailGenerationRequest, recipient_name: Optional[str] = None
+) -> Optional[ThreadChain]:
+    """Chain of the next reply in a thread (``history`` excludes the letter being answered).
+
+    Continues from the last outgoing letter's upstream answer if it is recent
+    enough; otherwise starts a new stored conversation with the full prompt.
+    None if chaining is disabled.
+    """
+    settings = get_settings()
+    if not settings.llm_thread_chaining_enabled:
+        return None
+    last_outgoing = next(
+        (i for i in range(len(history) - 1, -1, -1) if history[i].message_type == "outgoing"), None
+    )
+    if last_outgoing is None or not history[last_outgoing].llm_response_id:
+        return ThreadChain()
+
+    previous = history[last_outgoing]
+    created_at = previous.created_at
+    if created_at is not None:
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        if datetime.now(timezone.utc) - created_at > timedelta(hours=settings.llm_thread_chain_max_age_hours):
+            print(f"[CHAIN] Ответ {previous.llm_response_id} старше {settings.llm_thread_chain_max_age_hours:g} ч: отправляем всю историю")
+            return ThreadChain()
+
+    # Письма, пришедшие после предыдущего ответа, модель ещё не видела
+    new_history = ThreadService.format_thread_history(history[last_outgoing + 1:]) or None
+    return ThreadChain(
+        previous_response_id=previous.llm_response_id,
+        folder_id=previous.llm_folder_id,
+        followup_messages=build_followup_messages(request, new_history=new_history, recipient_name=recipient_name),
+    )
@@ -0,0 +1,141 @@
+"""Pool of Yandex API key / folder pairs, each with its own quota."""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+from ..config import get_settings
+
+
+@dataclass(frozen=True)
+class YandexCredential:
+    """One API key and the folder its quota belongs to."""
+
+    api_key: str
+    folder_id: str
+    weight: float = 1.0
+
+
+class _CredentialState:
+    def __init__(self) -> None:
+        self.in_flight = 0
+        self.failures = 0
+        self.cooldown_until = 0.0
+
+
+class CredentialPool:
+    """Balances calls across credentials and keeps unhealthy ones aside.
+
+    ``least_loaded`` prefers the credential with the fewest in-flight calls per
+    unit of weight; ``weighted`` picks randomly in proportion to the weights.
+    After a 429, or after ``max_failures`` consecutive upstream failures, a
+    credential cools down and is only used when every credential is cooling down.
+    """
+
+    LEAST_LOADED = "least_loaded"
+    WEIGHTED = "weighted"
+
+    def __init__(
+        self,
+        credentials: Sequence[YandexCredential],
+        strategy: str = LEAST_LOADED,
+        cooldown_seconds: float = 30.0,
+        max_failures: int = 3,
+    ) -> None:
+        if not credentials:
+            raise ValueError("CredentialPool needs at least one credential")
+        if strategy not in (self.LEAST_LOADED, self.WEIGHTED):
+            raise ValueError(f"Unknown credential strategy '{strategy}'")
+        self._credentials = list(credentials)
+        self._strategy = strategy
+        self._cooldown = cooldown_seconds
+        self._max_failures = max_failures
+        self._state = {credential: _CredentialState() for credential in self._credentials}
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> YandexCredential:
+        return self._credentials[0]
+
+    @property
+    def folder_ids(self) -> list[str]:
+        return [credential.folder_id for credential in self._credentials]
+
+    def for_folder(self, folder_id: str) -> Optional[YandexCredential]:
+        return next((c for c in self._credentials if c.folder_id == folder_id), None)
+
+    def candidates(self) -> list[YandexCredential]:
+        """Credentials in order of preference; cooling-down ones last."""
+        now = time.monotonic()
+        with self._lock:
+            if self._strategy == self.WEIGHTED:
+                # Weighted random permutation (Efraimidis–Spirakis)
+                key = {c: random.random() ** (1.0 / max(c.weight, 1e-6)) for c in self._credentials}
+                ordered = sorted(self._credentials, key=lambda c: -key[c])
+            else:
+                ordered = sorted(
+                    self._credentials,
+                    key=lambda c: self._state[c].in_flight / max(c.weight, 1e-6),
+                )
+            ready = [c for c in ordered if self._state[c].cooldown_until <= now]
+            cooling = sorted(
+                (c for c in ordered if self._state[c].cooldown_until > now),
+                key=lambda c: self._state[c].cooldown_until,
+            )
+        return ready + cooling
+
+    def has_ready(self) -> bool:
+        """True if some credential is not cooling down."""
+        now = time.monotonic()
+        with self._lock:
+            return any(state.cooldown_until <= now for state in self._state.values())
+
+    def start(self, credential: YandexCredential) -> None:
+        with self._lock:
+            self._state[credential].in_flight += 1
+
+    def finish(self, credential: YandexCredential, failed: Optional[bool] = False) -> None:
+        """Release the credential; ``failed=None`` (cancelled call) leaves its health unchanged."""
+        with self._lock:
+            state = self._state[credential]
+            state.in_flight = max(0, state.in_flight - 1)
+            if failed is None:
+                return
+            if not failed:
+                state.failures = 0
+                return
+            state.failures += 1
+            if state.failures < self._max_failures:
+                return
+            state.failures = 0
+            state.cooldown_until = time.monotonic() + self._cooldown
+        print(f"[CREDENTIALS] Folder {credential.folder_id}: {self._max_failures} failures in a row, cooling down")
+
+    def cool_down(self, credential: YandexCredential, seconds: Optional[float] = None) -> None:
+        """Take the credential out of rotation (e.g. after a 429 with Retry-After)."""
+        seconds = self._cooldown if seconds is None else seconds
+        with self._lock:
+            state = self._state[credential]
+            state.cooldown_until = max(state.cooldown_until, time.monotonic() + seconds)
+        print(f"[CREDENTIALS] Folder {credential.folder_id}: cooling down for {seconds:.1f}s")
+
+
+# Singleton instance
+_credential_pool = None
+
+def get_credential_pool() -> CredentialPool:
+    """Get the process-wide pool of credentials from YANDEX_CREDENTIALS (or the single key/folder)."""
+    global _credential_pool
+    if _credential_pool is None:
+        settings = get_settings()
+        _credential_pool = CredentialPool(
+            [YandexCredential(api_key, folder_id, weight) for api_key, folder_id, weight in settings.yandex_credentials],
+            strategy=settings.llm_credential_strategy,
+            cooldown_seconds=settings.llm_credential_cooldown_seconds,
+            max_failures=settings.llm_credential_max_failures,
+        )
+    return _credential_pool
@@ -2,7 +2,7 @@
 
 from __future__ import annotations
 
-import json
+import asyncio
 import re
 import traceback
 from datetime import datetime, timedelta
@@ -10,22 +10,219 @@ from typing import Any, Dict, List, Optional, Tuple, cast
 
 from pydantic import ValidationError
 
+from ..config import get_settings
 from ..models import (
     EmailParameters,
     DetailedEmailAnalysis,
     ExtractedInfo,
     EmailCategory,
+    EmailGenerationRequest,
+    EmailGenerationResponse,
 )
+from .batch_generation import is_batch_eligible
 from .department_detector import detect_department_by_keywords
 from .category_detector import hybrid_category_detection, detect_category_by_keywords
-from .yandex_gpt_client import YandexGPTService
+from .latency_budget import Deadline, LatencyBudgetExceeded, run_within
+from .llm_backends import LLMService, get_llm_service
+from .micro_batcher import MicroBatcher
+from .model_router import get_model_router
+from .prompt_builder import build_messages, estimate_messages_tokens
+from .single_flight import get_single_flight
+from .structured_output import json_array_format, json_object_format, json_schema_format, repair_json
+from .yandex_gpt_client import (
+    AsyncYandexGPTService,
+    _cache_generation,
+    _finalize_letter,
+    _generation_cache_args,
+    _local_signature,
+    output_token_cap,
+)
+
+
+# Модель заполняет только эти поля; отдел, дедлайн и SLA вычисляются локально
+_DETAILED_ANALYSIS_FORMAT = json_schema_format(
+    "detailed_email_analysis", DetailedEmailAnalysis, ("category", "parameters", "extracted_info")
+)
+_PACKED_ANALYSIS_FORMAT = json_array_format("detailed_email_analysis_batch", _DETAILED_ANALYSIS_FORMAT)
+# Анализ и черновик ответа одним вызовом: {"analysis": {...}, "draft": {"subject": ..., "body": ...}}
+_ANALYSIS_AND_DRAFT_FORMAT = json_object_format(
+    "analysis_and_draft",
+    {"analysis": _DETAILED_ANALYSIS_FORMAT, "draft": json_schema_format("letter_draft", EmailGenerationResponse)},
+)
+
+
+# Общая часть промпта анализа: одна и та же для каждого письма и для пакета писем
+_ANALYSIS_STRUCTURE = """{
+  "category": "information_request",
+  "parameters": {
+    "tone": "formal",
+    "purpose": "response",
+    "length": "medium",
+    "audience": "client",
+    "urgency": "normal",
+    "address_style": "vy",
+    "include_formal_greetings": true,
+    "include_greeting_and_signoff": true,
+    "include_corporate_phrases": true
+  },
+  "extracted_info": {
+    "request_essence": "Краткое описание сути запроса и ожиданий отправителя",
+    "contact_info": "Извлеченные контактные данные, если есть",
+    "regulatory_references": ["Ссылка на нормативный акт 1", "Ссылка на нормативный акт 2"],
+    "requirements": ["Требование 1", "Требование 2"],
+    "legal_risks": ["Потенциальный риск 1", "Потенциальный риск 2"]
+  }
+}"""
+
+_ANALYSIS_RULES = """КРИТИЧЕСКИ ВАЖНО - Определение категории (category):
+- "complaint" - Официальная жалоба или претензия:
+  * Содержит фразы: "нарушение", "требуем", "претензия", "жалоба", "недовольство", "грубое нарушение"
+  * Упоминает нарушения условий договора, некачественное обслуживание, неправомерные действия
+  * Требует разъяснений, возврата средств, компенсации
+  * Примеры: "нарушение условий договора", "требуем возврата средств", "претензия по качеству услуг"
+- "notification" - Используй ТОЛЬКО если письмо явно является уведомлением или информированием:
+  * Содержит фразы: "уведомляем", "информируем", "доводим до сведения", "ответ не требуется"
+  * Сообщает об изменениях, новых требованиях, обновлениях без запроса действий
+  * Примеры: уведомления регулятора об изменениях нормативов, информирование о новых процедурах
+- "regulatory_request" - Требования от надзорных органов (Банк России, ЦБ РФ) с нормативными основаниями, требующие действий
+- "information_request" - Запрос информации/документов (справки, выписки, подтверждающие документы)
+- "partnership_proposal" - Партнёрское предложение (коммерческие предложения, запросы на сотрудничество)
+- "approval_request" - Запрос на согласование (необходимость утверждения документов, условий сделок)
+- "other" - Прочее (используй только если ни одна категория не подходит)
+
+Параметры (parameters):
+- tone: "formal" | "neutral" | "friendly"
+  * Для жалоб и претензий используй "formal"
+- purpose: "response" | "proposal" | "notification" | "refusal"
+  * Если category = "notification", то purpose должен быть "notification"
+  * Если category = "complaint", то purpose должен быть "response" (это ответ на жалобу/претензию)
+  * Для жалоб и претензий всегда используй "response"
+- length: "short" | "medium" | "long"
+- audience: "colleague" | "manager" | "client" | "partner" | "regulator"
+  * КРИТИЧЕСКИ ВАЖНО - Различие между "client" и "partner":
+    - "client" - Клиент банка: физическое или юридическое лицо, которое ПОЛУЧАЕТ УСЛУГИ банка:
+      * Использует банковские продукты: кредиты, вклады, счета, карты, переводы
+      * Обращается за обслуживанием, консультациями, справками
+      * Имеет договорные отношения клиент-банк (клиент платит за услуги)
+      * Примеры: запросы о кредите, открытие вклада, проблемы с картой, жалобы на обслуживание
+    - "partner" - Бизнес-партнер: компания, с которой банк СОТРУДНИЧАЕТ НА РАВНЫХ:
+      * Совместные проекты, интеграции, партнерские программы
+      * B2B отношения, API интеграции, белый label решения
+      * Коммерческие предложения о сотрудничестве, партнерстве
+      * Примеры: предложения о партнерстве, запросы на интеграцию API, совместные маркетинговые программы
+  * "regulator" - Если письмо от Банка России, ЦБ РФ, регулятора - используй "regulator"
+  * "colleague" - Внутренняя переписка между сотрудниками банка
+  * "manager" - Вышестоящее руководство
+- urgency: "low" | "normal" | "high"
+  * Если в письме указан конкретный дедлайн или фразы "немедленно", "срочно" - используй "high"
+  * Для жалоб обычно "high" или "normal" в зависимости от тональности
+- address_style: "vy" | "ty" | "full_name"
+
+Извлеченная информация (extracted_info):
+- request_essence: ОБЯЗАТЕЛЬНО заполни! Краткое описание сути письма:
+  * Для уведомлений: опиши, о чем уведомляют и какие действия требуются (если требуются)
+  * Для запросов: опиши суть запроса и ожидания отправителя
+  * Для жалоб: опиши суть претензии
+  * Будь конкретным и информативным (2-3 предложения)
+- contact_info: Извлеченные контактные данные, реквизиты (если есть)
+- regulatory_references: Массив ссылок на упомянутые нормативные акты (если есть)
+  * Примеры: "Указание Банка России №58-У", "Федеральный закон №...", "Методические рекомендации №..."
+- requirements: Массив требований и ожиданий отправителя (если есть)
+  * Для уведомлений: какие действия требуются (например, "внести изменения в системы до 01.01.2026")
+- legal_risks: Массив потенциальных юридических рисков и ограничений (если есть)
+
+Важно:
+- Если информации нет, используй null для опциональных полей или пустые массивы []
+- Будь точным и конкретным в извлечении информации
+- Для legal_risks укажи только реальные потенциальные проблемы
+- request_essence ВСЕГДА должен быть заполнен - это критически важно для оператора
+"""
+
+_ANALYSIS_SYSTEM_PROMPT = (
+    "Ты эксперт по анализу деловой корреспонденции банка. "
+    "Отвечай только валидным JSON без дополнительных комментариев."
+)
+
+
+def _build_packed_messages(letters: List[Tuple[str, str]], company_context: str) -> list[dict[str, str]]:
+    """Один промпт для нескольких писем: общая инструкция передаётся один раз."""
+    numbered = "\n\n".join(
+        f"Письмо {number}:\nТема: {subject}\nТекст: {body}"
+        for number, (subject, body) in enumerate(letters, start=1)
+    )
+    analysis_prompt = f"""Проанализируй каждое из {len(letters)} входящих писем и выполни комплексный анализ каждого письма отдельно.
+
+Контекст компании: {company_context}
+
+{numbered}
+
+Верни ТОЛЬКО валидный JSON вида {{"results": [...]}}: по одному объекту на каждое письмо,
+в поле "index" — номер письма, остальные поля — со следующей структурой:
+{_ANALYSIS_STRUCTURE}
+
+{_ANALYSIS_RULES}"""
+    return [
+        {"role": "system", "content": _ANALYSIS_SYSTEM_PROMPT},
+        {"role": "user", "content": analysis_prompt},
+    ]
+
+
+def _split_packed_answer(raw_json: Any, count: int) -> list[Optional[Dict[str, Any]]]:
+    """Раскладывает ответ на пакет по номерам писем; None — письма нет в ответе."""
+    try:
+        data = repair_json(raw_json)
+    except ValueError as e:
+        print(f"[MICRO-BATCH] Ответ на пакет не разобран: {e}")
+        return [None] * count
+    entries = data.get("results") if isinstance(data, dict) else data
+    by_index: Dict[int, Dict[str, Any]] = {}
+    for entry in entries if isinstance(entries, list) else []:
+        index = entry.get("index") if isinstance(entry, dict) else None
+        if isinstance(index, int) and 1 <= index <= count:
+            by_index.setdefault(index, entry)
+    return [by_index.get(number) for number in range(1, count + 1)]
+
+
+async def _analyze_packed(key: Any, letters: List[Tuple[str, str]]) -> list[Optional[Dict[str, Any]]]:
+    """Анализирует пакет писем одним вызовом модели (обработчик MicroBatcher)."""
+    service, company_context = key
+    if len(letters) == 1:
+        return [None]  # одиночное письмо дешевле анализировать обычным промптом
+    messages = _build_packed_messages(letters, company_context)
+    cap = output_token_cap("analysis")
+    raw_json = await service._make_request(
+        messages,
+        temperature=0.3,
+        response_format=_PACKED_ANALYSIS_FORMAT,
+        model_tier=get_model_router().for_analysis(estimate_messages_tokens(messages)),
+        max_output_tokens=cap * len(letters) if cap else None,
+    )
+    results = _split_packed_answer(raw_json, len(letters))
+    parsed = sum(result is not None for result in results)
+    print(f"[MICRO-BATCH] Пакет из {len(letters)} писем: разобрано {parsed}")
+    return results
+
+
+# Singleton instance
+_analysis_batcher = None
+
+def _get_analysis_batcher() -> MicroBatcher:
+    global _analysis_batcher
+    if _analysis_batcher is None:
+        settings = get_settings()
+        _analysis_batcher = MicroBatcher(
+            _analyze_packed,
+            window_seconds=settings.analysis_batch_window_ms / 1000.0,
+            max_size=settings.analysis_batch_max_size,
+        )
+    return _analysis_batcher
 
 
 class EmailAnalyzer:
     """Сервис для расширенного анализа входящих писем."""
 
-    def __init__(self, yandex_service: YandexGPTService | None = None):
-        self.yandex_service = yandex_service or YandexGPTService()
+    def __init__(self, async_service: LLMService | AsyncYandexGPTService | None = None):
+        self.async_service = async_service or get_llm_service()
 
     def _extract_contact_info(self, text: str) -> str | None:
         """Извлекает контактные данные из текста."""
@@ -239,25 +436,10 @@ class EmailAnalyzer:
         # Дефолтное значение
         return 5
 
-    def analyze_email_detailed(
+    def _build_detailed_messages(
         self, subject: str, body: str, company_context: str
-    ) -> DetailedEmailAnalysis:
-        """
-        Выполняет расширенный анализ входящего письма согласно ТЗ.
-        Использует кэширование для ускорения повторных запросов.
-        """
-        # Try to get from cache
-        from .cache_service import get_cache_service
-        cache = get_cache_service()
-        
-        if cache.is_enabled():
-            cached_result = cache.get_analysis(subject, body, company_context)
-            if cached_result:
-                try:
-                    return DetailedEmailAnalysis(**cached_result)
-                except Exception as e:
-                    print(f"[CACHE] Error deserializing cached analysis: {e}")
-        
+    ) -> list[dict[str, str]]:
+        """Формирует промпт расширенного анализа."""
         analysis_prompt = f"""Проанализируй входящее письмо и выполни комплексный анализ.
 
 Входящее письмо:
@@ -266,286 +448,411 @@ class EmailAnalyzer:
 Контекст компании: {company_context}
 
 Верни ТОЛЬКО валидный JSON со следующей структурой:
-{{
-  "category": "information_request",
-  "parameters": {{
-    "tone": "formal",
-    "purpose": "response",
-    "length": "medium",
-    "audience": "client",
-    "urgency": "normal",
-    "address_style": "vy",
-    "include_formal_greetings": true,
-    "include_greeting_and_signoff": true,
-    "include_corporate_phrases": true
-  }},
-  "extracted_info": {{
-    "request_essence": "Краткое описание сути запроса и ожиданий отправителя",
-    "contact_info": "Извлеченные контактные данные, если есть",
-    "regulatory_references": ["Ссылка на нормативный акт 1", "Ссылка на нормативный акт 2"],
-    "requirements": ["Требование 1", "Требование 2"],
-    "legal_risks": ["Потенциальный риск 1", "Потенциальный риск 2"]
-  }}
-}}
+{_ANALYSIS_STRUCTURE}
 
-КРИТИЧЕСКИ ВАЖНО - Определение категории (category):
-- "complaint" - Официальная жалоба или претензия:
-  * Содержит фразы: "нарушение", "требуем", "претензия", "жалоба", "недовольство", "грубое нарушение"
-  * Упоминает нарушения условий договора, некачественное обслуживание, неправомерные действия
-  * Требует разъяснений, возврата средств, компенсации
-  * Примеры: "нарушение условий договора", "требуем возврата средств", "претензия по качеству услуг"
-- "notification" - Используй ТОЛЬКО если письмо явно является уведомлением или информированием:
-  * Содержит фразы: "уведомляем", "информируем", "доводим до сведения", "ответ не требуется"
-  * Сообщает об изменениях, новых требованиях, обновлениях без запроса действий
-  * Примеры: уведомления регулятора об изменениях нормативов, информирование о новых процедурах
-- "regulatory_request" - Требования от надзорных органов (Банк России, ЦБ РФ) с нормативными основаниями, требующие действий
-- "information_request" - Запрос информации/документов (справки, выписки, подтверждающие документы)
-- "partnership_proposal" - Партнёрское предложение (коммерческие предложения, запросы на сотрудничество)
-- "approval_request" - Запрос на согласование (необходимость утверждения документов, условий сделок)
-- "other" - Прочее (используй только если ни одна категория не подходит)
+{_ANALYSIS_RULES}"""
+        return [
+            {"role": "system", "content": _ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": analysis_prompt},
+        ]
 
-Параметры (parameters):
-- tone: "formal" | "neutral" | "friendly"
-  * Для жалоб и претензий используй "formal"
-- purpose: "response" | "proposal" | "notification" | "refusal"
-  * Если category = "notification", то purpose должен быть "notification"
-  * Если category = "complaint", то purpose должен быть "response" (это ответ на жалобу/претензию)
-  * Для жалоб и претензий всегда используй "response"
-- length: "short" | "medium" | "long"
-- audience: "colleague" | "manager" | "client" | "partner" | "regulator"
-  * КРИТИЧЕСКИ ВАЖНО - Различие между "client" и "partner":
-    - "client" - Клиент банка: физическое или юридическое лицо, которое ПОЛУЧАЕТ УСЛУГИ банка:
-      * Использует банковские продукты: кредиты, вклады, счета, карты, переводы
-      * Обращается за обслуживанием, консультациями, справками
-      * Имеет договорные отношения клиент-банк (клиент платит за услуги)
-      * Примеры: запросы о кредите, открытие вклада, проблемы с картой, жалобы на обслуживание
-    - "partner" - Бизнес-партнер: компания, с которой банк СОТРУДНИЧАЕТ НА РАВНЫХ:
-      * Совместные проекты, интеграции, партнерские программы
-      * B2B отношения, API интеграции, белый label решения
-      * Коммерческие предложения о сотрудничестве, партнерстве
-      * Примеры: предложения о партнерстве, запросы на интеграцию API, совместные маркетинговые программы
-  * "regulator" - Если письмо от Банка России, ЦБ РФ, регулятора - используй "regulator"
-  * "colleague" - Внутренняя переписка между сотрудниками банка
-  * "manager" - Вышестоящее руководство
-- urgency: "low" | "normal" | "high"
-  * Если в письме указан конкретный дедлайн или фразы "немедленно", "срочно" - используй "high"
-  * Для жалоб обычно "high" или "normal" в зависимости от тональности
-- address_style: "vy" | "ty" | "full_name"
+    def _analysis_from_raw(self, raw_json: Any, subject: str, body: str) -> DetailedEmailAnalysis:
+        """Разбирает ответ модели и дополняет его локальными эвристиками."""
+        # Ремонт JSON на месте (markdown, обрезанный ответ, лишние запятые) вместо повторного вызова модели
+        try:
+            analysis_dict = repair_json(raw_json)
+        except ValueError as e:
+            print(f"Ошибка парсинга JSON: {e}")
+            print(f"Сырой ответ: {str(raw_json)[:500]}...")
+            raise ValueError(f"Не удалось распарсить JSON ответ от ИИ: {e}")
+        if not isinstance(analysis_dict, dict):
+            raise ValueError("Ответ ИИ не является JSON-объектом")
 
-Извлеченная информация (extracted_info):
-- request_essence: ОБЯЗАТЕЛЬНО заполни! Краткое описание сути письма:
-  * Для уведомлений: опиши, о чем уведомляют и какие действия требуются (если требуются)
-  * Для запросов: опиши суть запроса и ожидания отправителя
-  * Для жалоб: опиши суть претензии
-  * Будь конкретным и информативным (2-3 предложения)
-- contact_info: Извлеченные контактные данные, реквизиты (если есть)
-- regulatory_references: Массив ссылок на упомянутые нормативные акты (если есть)
-  * Примеры: "Указание Банка России №58-У", "Федеральный закон №...", "Методические рекомендации №..."
-- requirements: Массив требований и ожиданий отправителя (если есть)
-  * Для уведомлений: какие действия требуются (например, "внести изменения в системы до 01.01.2026")
-- legal_risks: Массив потенциальных юридических рисков и ограничений (если есть)
+        return self._analysis_from_dict(analysis_dict, subject, body)
 
-Важно:
-- Если информации нет, используй null для опциональных полей или пустые массивы []
-- Будь точным и конкретным в извлечении информации
-- Для legal_risks укажи только реальные потенциальные проблемы
-- request_essence ВСЕГДА должен быть заполнен - это критически важно для оператора
-"""
+    def _analysis_from_dict(self, analysis_dict: Dict[str, Any], subject: str, body: str) -> DetailedEmailAnalysis:
+        """Валидирует JSON анализа и вычисляет категорию, отдел, дедлайн и SLA."""
+        # Валидация обязательных полей
+        if "category" not in analysis_dict:
+            raise ValueError("Отсутствует поле category в ответе")
+        if "parameters" not in analysis_dict:
+            raise ValueError("Отсутствует поле parameters в ответе")
+        if "extracted_info" not in analysis_dict:
+            raise ValueError("Отсутствует поле extracted_info в ответе")
+
+        # Гибридное определение категории: ИИ + взвешенные ключевые слова
+        ai_category_str = analysis_dict.get("category", "other")
+        # Валидация категории
+        valid_categories = ["information_request", "complaint", "regulatory_request", 
+                          "partnership_proposal", "approval_request", "notification", "other"]
+        if ai_category_str not in valid_categories:
+            print(f"Неизвестная категория от ИИ: {ai_category_str}, используем 'other'")
+            ai_category_str = "other"
+
+        ai_category: EmailCategory = ai_category_str  # type: ignore
 
         try:
-            raw_json = self.yandex_service._make_request(
-                [
-                    {
-                        "role": "system",
-                        "content": (
-                            "Ты эксперт по анализу деловой корреспонденции банка. "
-                            "Отвечай только валидным JSON без дополнительных комментариев."
-                        ),
-                    },
-                    {"role": "user", "content": analysis_prompt},
-                ],
-                temperature=0.3,
-            )
+            final_category = hybrid_category_detection(ai_category, subject, body)
+        except Exception as e:
+            print(f"Ошибка гибридного определения категории: {e}")
+            final_category = ai_category
+
+        # Обновляем категорию в словаре, если она изменилась
+        if final_category != ai_category:
+            analysis_dict["category"] = final_category
+            print(f"Категория скорректирована: {ai_category} -> {final_category}")
+
+        # Убеждаемся, что request_essence заполнен
+        extracted_info_dict = analysis_dict.get("extracted_info", {})
+        if not isinstance(extracted_info_dict, dict):
+            extracted_info_dict = {}
 
-            if isinstance(raw_json, str):
-                raw_json = raw_json.strip()
-                # Убираем markdown code blocks если есть
-                if raw_json.startswith("```"):
-                    raw_json = re.sub(r"^```(?:json)?\n", "", raw_json)
-                    raw_json = re.sub(r"\n```$", "", raw_json)
-                    raw_json = raw_json.strip()
+        if not extracted_info_dict.get("request_essence") or not extracted_info_dict.get("request_essence", "").strip():
+            # Генерируем суть запроса на основе категории и текста
+            if final_category == "notification":
+                extracted_info_dict["request_essence"] = f"Уведомление: {subject}. Требуется ознакомление и учет информации."
             else:
-                raw_json = str(raw_json).strip()
+                extracted_info_dict["request_essence"] = f"Запрос по теме: {subject}. Требуется обработка и ответ."
 
-            # Пытаемся найти JSON в тексте, если он обернут в текст
-            json_match = re.search(r'\{.*\}', raw_json, re.DOTALL)
-            if json_match:
-                raw_json = json_match.group(0)
+        # Убеждаемся, что все опциональные поля имеют правильный тип
+        if "regulatory_references" not in extracted_info_dict or not isinstance(extracted_info_dict.get("regulatory_references"), list):
+            extracted_info_dict["regulatory_references"] = []
+        if "requirements" not in extracted_info_dict or not isinstance(extracted_info_dict.get("requirements"), list):
+            extracted_info_dict["requirements"] = []
+        if "legal_risks" not in extracted_info_dict or not isinstance(extracted_info_dict.get("legal_risks"), list):
+            extracted_info_dict["legal_risks"] = []
 
+        # Определяем отдел
+        department = detect_department_by_keywords(subject, body)
+
+        # Извлекаем дедлайн из текста
+        extracted_deadline = self._extract_deadline_from_text(f"{subject} {body}")
+
+        # Параметры с умолчаниями модели: пропущенное поле не должно стоить второго вызова ИИ
+        params_dict = analysis_dict.get("parameters")
+        if not isinstance(params_dict, dict):
+            raise ValueError("Поле parameters в ответе не является объектом")
+        email_params = EmailParameters(**params_dict)
+
+        # Вычисляем SLA
+        category = final_category
+        sla_days = self._calculate_sla_days(category, email_params.urgency, email_params.audience, body, subject)
+
+        # Дополняем контактную информацию если не извлечена ИИ
+        if not extracted_info_dict.get("contact_info"):
+            contact_info = self._extract_contact_info(f"{subject} {body}")
+            if contact_info:
+                extracted_info_dict["contact_info"] = contact_info
+
+        try:
+            # Валидация и создание extracted_info
+            extracted_info_obj = ExtractedInfo(**extracted_info_dict)
+
+            return DetailedEmailAnalysis(
+                category=category,  # type: ignore
+                parameters=email_params,
+                extracted_info=extracted_info_obj,
+                department=department,
+                estimated_sla_days=sla_days,
+                extracted_deadline_days=extracted_deadline,
+                batch_eligible=is_batch_eligible(category, email_params.urgency, sla_days),
+            )
+        except Exception as e:
+            print(f"Ошибка создания DetailedEmailAnalysis: {e}")
+            print(f"Параметры: {analysis_dict.get('parameters')}")
+            print(f"Extracted info: {extracted_info_dict}")
+            import traceback
+            traceback.print_exc()
+            raise
+
+    def _fallback_analysis(
+        self, subject: str, body: str, basic_params: EmailParameters
+    ) -> DetailedEmailAnalysis:
+        """Анализ на основе ключевых слов и базовых параметров, если расширенный анализ не удался."""
+        # Используем гибридный подход: взвешенные ключевые слова + базовый анализ ИИ
+        keyword_category, keyword_confidence = detect_category_by_keywords(subject, body)
+
+        # Определяем финальную категорию
+        # Если ключевые слова дают высокую уверенность, используем их
+        if keyword_confidence >= 0.3:
+            final_category = keyword_category
+        else:
+            # Пытаемся определить по purpose из базового анализа
+            purpose_to_category = {
+                "notification": "notification",
+                "response": "information_request",
+                "proposal": "partnership_proposal",
+                "refusal": "complaint",
+            }
+            final_category = purpose_to_category.get(basic_params.purpose, "other")
+
+        department = detect_department_by_keywords(subject, body)
+        sla_days = self._calculate_sla_days(final_category, basic_params.urgency, basic_params.audience, body, subject)
+
+        # Извлекаем дедлайн из текста
+        extracted_deadline = self._extract_deadline_from_text(f"{subject} {body}")
+
+        # Генерируем базовую суть запроса
+        if final_category == "notification":
+            request_essence = f"Уведомление: {subject}. Требуется ознакомление с информацией."
+        elif final_category == "regulatory_request":
+            request_essence = f"Регуляторный запрос: {subject}. Требуется выполнение требований регулятора."
+        elif final_category == "complaint":
+            request_essence = f"Жалоба/претензия: {subject}. Требуется рассмотрение и ответ."
+        else:
+            request_essence = f"Запрос по теме: {subject}. Требуется обработка и ответ."
+
+        return DetailedEmailAnalysis(
+            category=final_category,  # type: ignore
+            parameters=basic_params,
+            extracted_info=ExtractedInfo(
+                request_essence=request_essence
+            ),
+            department=department,
+            estimated_sla_days=sla_days,
+            extracted_deadline_days=extracted_deadline,
+            batch_eligible=is_batch_eligible(final_category, basic_params.urgency, sla_days),
+        )
+
+    def _keyword_parameters(self, subject: str, body: str) -> EmailParameters:
+        """Параметры ответа без модели: значения по умолчанию, срочность по дедлайну из текста."""
+        deadline_days = self._extract_deadline_from_text(f"{subject} {body}")
+        urgency = "high" if deadline_days is not None and deadline_days <= 2 else "normal"
+        return EmailParameters(urgency=urgency)
+
+    def _degraded_analysis(self, subject: str, body: str) -> DetailedEmailAnalysis:
+        """Анализ только по ключевым словам, когда модель не успела ответить в бюджет запроса."""
+        result = self._fallback_analysis(subject, body, self._keyword_parameters(subject, body))
+        result.degraded = True
+        return result
+
+    def _get_cached_analysis(self, cache, subject: str, body: str, company_context: str) -> DetailedEmailAnalysis | None:
+        if not cache.is_enabled():
+            return None
+        cached_result = cache.get_analysis(subject, body, company_context)
+        if cached_result:
             try:
-                analysis_dict = json.loads(raw_json)
-            except json.JSONDecodeError as e:
-                print(f"Ошибка парсинга JSON: {e}")
-                print(f"Сырой ответ: {raw_json[:500]}...")
-                raise ValueError(f"Не удалось распарсить JSON ответ от ИИ: {e}")
-            
-            # Валидация обязательных полей
-            if "category" not in analysis_dict:
-                raise ValueError("Отсутствует поле category в ответе")
-            if "parameters" not in analysis_dict:
-                raise ValueError("Отсутствует поле parameters в ответе")
-            if "extracted_info" not in analysis_dict:
-                raise ValueError("Отсутствует поле extracted_info в ответе")
-            
-            # Гибридное определение категории: ИИ + взвешенные ключевые слова
-            ai_category_str = analysis_dict.get("category", "other")
-            # Валидация категории
-            valid_categories = ["information_request", "complaint", "regulatory_request", 
-                              "partnership_proposal", "approval_request", "notification", "other"]
-            if ai_category_str not in valid_categories:
-                print(f"Неизвестная категория от ИИ: {ai_category_str}, используем 'other'")
-                ai_category_str = "other"
-            
-            ai_category: EmailCategory = ai_category_str  # type: ignore
-            
-            try:
-                final_category = hybrid_category_detection(ai_category, subject, body)
+                return DetailedEmailAnalysis(**cached_result)
             except Exception as e:
-                print(f"Ошибка гибридного определения категории: {e}")
-                final_category = ai_category
-            
-            # Обновляем категорию в словаре, если она изменилась
-            if final_category != ai_category:
-                analysis_dict["category"] = final_category
-                print(f"Категория скорректирована: {ai_category} -> {final_category}")
-            
-            # Убеждаемся, что request_essence заполнен
-            extracted_info_dict = analysis_dict.get("extracted_info", {})
-            if not isinstance(extracted_info_dict, dict):
-                extracted_info_dict = {}
-            
-            if not extracted_info_dict.get("request_essence") or not extracted_info_dict.get("request_essence", "").strip():
-                # Генерируем суть запроса на основе категории и текста
-                if final_category == "notification":
-                    extracted_info_dict["request_essence"] = f"Уведомление: {subject}. Требуется ознакомление и учет информации."
-                else:
-                    extracted_info_dict["request_essence"] = f"Запрос по теме: {subject}. Требуется обработка и ответ."
-            
-            # Убеждаемся, что все опциональные поля имеют правильный тип
-            if "regulatory_references" not in extracted_info_dict or not isinstance(extracted_info_dict.get("regulatory_references"), list):
-                extracted_info_dict["regulatory_references"] = []
-            if "requirements" not in extracted_info_dict or not isinstance(extracted_info_dict.get("requirements"), list):
-                extracted_info_dict["requirements"] = []
-            if "legal_risks" not in extracted_info_dict or not isinstance(extracted_info_dict.get("legal_risks"), list):
-                extracted_info_dict["legal_risks"] = []
-
-            # Определяем отдел
-            department = detect_department_by_keywords(subject, body)
-
-            # Извлекаем дедлайн из текста
-            extracted_deadline = self._extract_deadline_from_text(f"{subject} {body}")
-            
-            # Вычисляем SLA
-            category = final_category
-            urgency = analysis_dict["parameters"]["urgency"]
-            audience = analysis_dict["parameters"]["audience"]
-            sla_days = self._calculate_sla_days(category, urgency, audience, body, subject)
-
-            # Дополняем контактную информацию если не извлечена ИИ
-            if not extracted_info_dict.get("contact_info"):
-                contact_info = self._extract_contact_info(f"{subject} {body}")
-                if contact_info:
-                    extracted_info_dict["contact_info"] = contact_info
+                print(f"[CACHE] Error deserializing cached analysis: {e}")
+        return None
+
+    def _cache_analysis(self, cache, subject: str, body: str, company_context: str, result: DetailedEmailAnalysis) -> None:
+        if not cache.is_enabled():
+            return
+        try:
+            cache.set_analysis(
+                subject,
+                body,
+                company_context,
+                result.model_dump()
+            )
+        except Exception as e:
+            print(f"[CACHE] Error caching analysis result: {e}")
+
+    async def analyze_email_detailed_async(
+        self, subject: str, body: str, company_context: str, deadline: Deadline | None = None
+    ) -> DetailedEmailAnalysis:
+        """Расширенный анализ входящего письма согласно ТЗ (с кэшем).
+
+        Если задан deadline и модель не успевает, возвращает анализ по ключевым словам (degraded).
+        """
+        from .cache_service import get_cache_service
+        cache = get_cache_service()
+
+        # Клиент Redis синхронный: чтение и запись кэша не держат event loop
+        cached = await asyncio.to_thread(self._get_cached_analysis, cache, subject, body, company_context)
+        if cached:
+            return cached
+
+        async def compute(call_deadline: Deadline | None) -> DetailedEmailAnalysis:
+            return await self._analyze_detailed_uncached_async(cache, subject, body, company_context, call_deadline)
+
+        if not get_settings().single_flight_enabled:
+            pending = compute(deadline)
+        else:
+            # Одинаковые письма, открытые несколькими операторами, анализируются один раз.
+            # Общий вызов идёт без дедлайна и дописывает результат в кэш, даже если
+            # этот вызывающий уже получил ответ по ключевым словам.
+            pending = get_single_flight().run(
+                cache.analysis_key(subject, body, company_context),
+                lambda: compute(None),
+                lambda: self._get_cached_analysis(cache, subject, body, company_context),
+            )
+
+        try:
+            return await run_within(deadline, pending)
+        except LatencyBudgetExceeded as e:
+            print(f"[ANALYZER] {e}: возвращаем анализ по ключевым словам")
+            return self._degraded_analysis(subject, body)
+
+    async def _analyze_batched(self, subject: str, body: str, company_context: str) -> DetailedEmailAnalysis | None:
+        """Анализ в общем пакете с другими письмами; None — письмо надо анализировать отдельно."""
+        try:
+            analysis_dict = await _get_analysis_batcher().submit((self.async_service, company_context), (subject, body))
+        except Exception as e:
+            # Сбой общего вызова не повод для упрощённого анализа: каждое письмо получает обычный промпт
+            print(f"[MICRO-BATCH] Пакетный вызов не удался ({e}), анализируем отдельно")
+            return None
+        if analysis_dict is None:
+            return None
+        try:
+            return self._analysis_from_dict(dict(analysis_dict), subject, body)
+        except ValueError as e:
+            print(f"[MICRO-BATCH] Анализ письма из пакета не прошёл проверку ({e}), анализируем отдельно")
+            return None
 
+    async def _analyze_detailed_uncached_async(
+        self, cache, subject: str, body: str, company_context: str, deadline: Deadline | None = None
+    ) -> DetailedEmailAnalysis:
+        try:
+            if get_settings().analysis_batch_enabled:
+                result = await self._analyze_batched(subject, body, company_context)
+                if result is not None:
+                    await asyncio.to_thread(self._cache_analysis, cache, subject, body, company_context, result)
+                    return result
+
+            messages = self._build_detailed_messages(subject, body, company_context)
+            router = get_model_router()
+            tier = router.for_analysis(estimate_messages_tokens(messages))
+            raw_json = await self.async_service._make_request(
+                messages,
+                temperature=0.3,
+                response_format=_DETAILED_ANALYSIS_FORMAT,
+                deadline=deadline,
+                model_tier=tier,
+                max_output_tokens=output_token_cap("analysis"),
+            )
             try:
-                # Валидация и создание параметров
-                params_dict = analysis_dict.get("parameters", {})
-                email_params = EmailParameters(**params_dict)
-                
-                # Валидация и создание extracted_info
-                extracted_info_obj = ExtractedInfo(**extracted_info_dict)
-                
-                result = DetailedEmailAnalysis(
-                    category=category,  # type: ignore
-                    parameters=email_params,
-                    extracted_info=extracted_info_obj,
-                    department=department,
-                    estimated_sla_days=sla_days,
-                    extracted_deadline_days=extracted_deadline,
+                result = self._analysis_from_raw(raw_json, subject, body)
+            except ValueError as e:
+                escalate = router.escalation_tier(tier)
+                if escalate is None:
+                    raise
+                print(f"[ROUTER] Модель '{tier}' вернула некорректный анализ ({e}), повторяем на '{escalate}'")
+                raw_json = await self.async_service._make_request(
+                    messages,
+                    temperature=0.3,
+                    response_format=_DETAILED_ANALYSIS_FORMAT,
+                    deadline=deadline,
+                    model_tier=escalate,
+                    max_output_tokens=output_token_cap("analysis"),
                 )
-                
-                # Cache the result
-                if cache.is_enabled():
-                    try:
-                        cache.set_analysis(
-                            subject,
-                            body,
-                            company_context,
-                            result.model_dump()
-                        )
-                    except Exception as e:
-                        print(f"[CACHE] Error caching analysis result: {e}")
-                
-                return result
-            except Exception as e:
-                print(f"Ошибка создания DetailedEmailAnalysis: {e}")
-                print(f"Параметры: {analysis_dict.get('parameters')}")
-                print(f"Extracted info: {extracted_info_dict}")
-                import traceback
-                traceback.print_exc()
-                raise
+                result = self._analysis_from_raw(raw_json, subject, body)
+            await asyncio.to_thread(self._cache_analysis, cache, subject, body, company_context, result)
+            return result
 
         except Exception as e:
             print(f"Ошибка расширенного анализа: {e}")
             import traceback
             traceback.print_exc()
-            
-            # Используем гибридный подход: взвешенные ключевые слова + базовый анализ ИИ
-            keyword_category, keyword_confidence = detect_category_by_keywords(subject, body)
-            
-            # Fallback на базовый анализ
-            basic_params = self.yandex_service.analyze_email_parameters(
+
+            if deadline is not None:
+                return self._degraded_analysis(subject, body)
+            if isinstance(e, ValueError):
+                return self._fallback_analysis(subject, body, self._keyword_parameters(subject, body))
+
+            basic_params = await self.async_service.analyze_email_parameters(
                 subject, body, company_context
             )
-            
-            # Определяем финальную категорию
-            # Если ключевые слова дают высокую уверенность, используем их
-            if keyword_confidence >= 0.3:
-                final_category = keyword_category
-            else:
-                # Пытаемся определить по purpose из базового анализа
-                purpose_to_category = {
-                    "notification": "notification",
-                    "response": "information_request",
-                    "proposal": "partnership_proposal",
-                    "refusal": "complaint",
-                }
-                final_category = purpose_to_category.get(basic_params.purpose, "other")
-            
-            department = detect_department_by_keywords(subject, body)
-            sla_days = self._calculate_sla_days(final_category, basic_params.urgency, basic_params.audience, body, subject)
-            
-            # Извлекаем дедлайн из текста
-            extracted_deadline = self._extract_deadline_from_text(f"{subject} {body}")
-            
-            # Генерируем базовую суть запроса
-            if final_category == "notification":
-                request_essence = f"Уведомление: {subject}. Требуется ознакомление с информацией."
-            elif final_category == "regulatory_request":
-                request_essence = f"Регуляторный запрос: {subject}. Требуется выполнение требований регулятора."
-            elif final_category == "complaint":
-                request_essence = f"Жалоба/претензия: {subject}. Требуется рассмотрение и ответ."
-            else:
-                request_essence = f"Запрос по теме: {subject}. Требуется обработка и ответ."
+            return self._fallback_analysis(subject, body, basic_params)
 
-            return DetailedEmailAnalysis(
-                category=final_category,  # type: ignore
-                parameters=basic_params,
-                extracted_info=ExtractedInfo(
-                    request_essence=request_essence
-                ),
-                department=department,
-                estimated_sla_days=sla_days,
-                extracted_deadline_days=extracted_deadline,
+    def _build_analysis_and_draft_messages(
+        self, payload: EmailGenerationRequest, thread_history: str | None, recipient_name: str | None
+    ) -> list[dict[str, str]]:
+        """Промпт «анализ + черновик»: письмо и контекст передаются один раз, в части про черновик."""
+        parameters_text = "определи сам по результатам анализа (поле analysis.parameters)"
+        if payload.parameters.extra_directives:
+            parameters_text += "\n- Доп. указания: " + "; ".join(payload.parameters.extra_directives)
+        local_signature = _local_signature(payload)
+        letter_prompt = build_messages(
+            payload,
+            thread_history=thread_history,
+            recipient_name=recipient_name,
+            parameters_text=parameters_text,
+            local_signature=local_signature,
+        )[-1]["content"]
+        body_text = "текст письма без подписи" if local_signature else "текст письма с подписью"
+        prompt = f"""Выполни две задачи по одному входящему письму и верни ОДИН JSON-объект вида
+{{"analysis": {{...}}, "draft": {{"subject": "...", "body": "..."}}}}.
+
+Задача 1 — анализ письма (поле "analysis") со следующей структурой:
+{_ANALYSIS_STRUCTURE}
+
+{_ANALYSIS_RULES}
+
+Задача 2 — черновик ответа (поле "draft"). Тон, длину, стиль обращения и остальные параметры письма
+бери из analysis.parameters. Тему ответа помести в "subject", {body_text} — в "body";
+строки-заголовки темы и тела из правил ниже в ответ не добавляй.
+
+{letter_prompt}"""
+        return [
+            {"role": "system", "content": _ANALYSIS_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ]
+
+    @staticmethod
+    def _draft_request(
+        payload: EmailGenerationRequest, analysis: DetailedEmailAnalysis, recipient_name: str | None
+    ) -> EmailGenerationRequest:
+        """Запрос генерации с параметрами из анализа (директивы переписки сохраняются)."""
+        parameters = analysis.parameters.model_copy(update={"extra_directives": payload.parameters.extra_directives})
+        if parameters.address_style == "full_name" and not recipient_name:
+            parameters.address_style = "vy"
+        return payload.model_copy(update={"parameters": parameters})
+
+    async def analyze_and_draft_async(
+        self,
+        payload: EmailGenerationRequest,
+        thread_history: str | None = None,
+        recipient_name: str | None = None,
+        deadline: Deadline | None = None,
+    ) -> Tuple[DetailedEmailAnalysis, EmailGenerationResponse]:
+        """Расширенный анализ и черновик ответа одним вызовом модели.
+
+        Категория, отдел, SLA и подпись по-прежнему вычисляются локально. Оба
+        результата попадают в кэш, так что последующие /analyze-detailed и
+        /generate с предложенными параметрами отвечают из кэша. Если ответ не
+        разобрать, выполняются обычные два вызова.
+        """
+        from .cache_service import get_cache_service
+        cache = get_cache_service()
+        subject, body = payload.source_subject.strip(), payload.source_body.strip()
+        company_context = (payload.company_context or "").strip()
+
+        messages = self._build_analysis_and_draft_messages(payload, thread_history, recipient_name)
+        analysis_cap, letter_cap = output_token_cap("analysis"), output_token_cap("letter", "long")
+        raw_json = await self.async_service._make_request(
+            messages,
+            temperature=0.3,
+            response_format=_ANALYSIS_AND_DRAFT_FORMAT,
+            deadline=deadline,
+            model_tier=get_model_router().for_generation(None, estimate_messages_tokens(messages)),
+            max_output_tokens=analysis_cap + letter_cap if analysis_cap and letter_cap else None,
+        )
+        try:
+            combined = repair_json(raw_json)
+            if not isinstance(combined, dict) or not isinstance(combined.get("analysis"), dict):
+                raise ValueError("В ответе нет объекта analysis")
+            draft = combined.get("draft")
+            if not isinstance(draft, dict) or not str(draft.get("body") or "").strip():
+                raise ValueError("В ответе нет черновика")
+            analysis = self._analysis_from_dict(combined["analysis"], subject, body)
+        except ValueError as e:
+            print(f"[ANALYZE+DRAFT] Ответ не разобран ({e}): анализ и генерация отдельными вызовами")
+            analysis = await self.analyze_email_detailed_async(subject, body, company_context, deadline)
+            draft_request = self._draft_request(payload, analysis, recipient_name)
+            letter = await self.async_service.generate_letter(
+                draft_request, thread_history=thread_history, recipient_name=recipient_name, deadline=deadline
             )
+            return analysis, letter
 
+        draft_request = self._draft_request(payload, analysis, recipient_name)
+        raw_text = f"Тема: {draft.get('subject') or ''}\nТело:\n{draft['body']}"
+        letter = _finalize_letter(draft_request, raw_text)
+        await asyncio.to_thread(self._cache_analysis, cache, subject, body, company_context, analysis)
+        if cache.is_enabled():
+            await asyncio.to_thread(
+                _cache_generation, cache, _generation_cache_args(draft_request, thread_history), raw_text
+            )
+        return analysis, letter
@@ -0,0 +1,94 @@
+"""Process-wide HTTP connection pool for upstream LLM calls."""
+
+from __future__ import annotations
+
+from urllib.parse import urlsplit
+
+import httpx
+
+from ..config import Settings, get_settings
+
+
+_async_client: httpx.AsyncClient | None = None
+
+
+def _http2_available(settings: Settings) -> bool:
+    """HTTP/2 needs the optional ``h2`` package (``httpx[http2]``)."""
+    if not settings.http2_enabled:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        print("[HTTP] Package 'h2' is not installed, falling back to HTTP/1.1")
+        return False
+    return True
+
+
+def _build_limits(settings: Settings) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry,
+    )
+
+
+def _client_options(settings: Settings) -> dict:
+    return {
+        "http2": _http2_available(settings),
+        "limits": _build_limits(settings),
+        "timeout": httpx.Timeout(90.0, connect=15.0, read=60.0),
+        "verify": True,
+        "follow_redirects": True,
+    }
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}/"
+
+
+def _warmup_urls(settings: Settings) -> list[str]:
+    """Hosts of the configured network backends (the local backend needs none)."""
+    urls = {
+        "yandex_responses": settings.yandex_responses_url,
+        "yandex_completion": settings.yandex_completion_url,
+    }
+    return [_origin(urls[name]) for name in settings.llm_backends if name in urls]
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the shared asyncio client, creating it on first use.
+
+    The client is bound to the event loop that first uses it, so it should be
+    created from the application startup hook (see ``init_async_http_client``).
+    """
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(**_client_options(get_settings()))
+    return _async_client
+
+
+async def warm_up_async_http_client() -> None:
+    """Open a connection from the asyncio pool to each LLM host."""
+    client = get_async_http_client()
+    for url in _warmup_urls(get_settings()):
+        try:
+            response = await client.head(url, timeout=httpx.Timeout(5.0))
+            print(f"[HTTP] Async connection pool warmed up: {url} ({response.http_version})")
+        except Exception as e:
+            print(f"[HTTP] Async warm-up request to {url} failed: {e}")
+
+
+async def init_async_http_client() -> None:
+    """Create the shared asyncio client inside the running event loop."""
+    get_async_http_client()
+    if get_settings().http_warmup_enabled:
+        await warm_up_async_http_client()
+
+
+async def close_async_http_client() -> None:
+    """Close the shared asyncio client."""
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
@@ -0,0 +1,59 @@
+"""Per-request latency budget (X-Latency-Budget-Ms) shared by the analyzer and the LLM client."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LatencyBudgetExceeded(RuntimeError):
+    """The caller's latency budget ran out before the LLM answered."""
+
+    def __init__(self, budget_ms: int) -> None:
+        super().__init__(f"Модель не ответила в пределах бюджета {budget_ms} мс")
+        self.budget_ms = budget_ms
+
+
+@dataclass(frozen=True)
+class Deadline:
+    """Absolute point (time.monotonic) by which the caller needs an answer."""
+
+    expires_at: float
+    budget_ms: int
+
+    @classmethod
+    def from_budget_ms(cls, budget_ms: int) -> "Deadline":
+        return cls(expires_at=time.monotonic() + budget_ms / 1000.0, budget_ms=budget_ms)
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def check(self) -> None:
+        """Raise LatencyBudgetExceeded if the deadline has passed."""
+        if self.expired():
+            raise LatencyBudgetExceeded(self.budget_ms)
+
+
+def resolve_deadline(*budgets_ms: Optional[int]) -> Optional[Deadline]:
+    """Deadline from the first budget given (request field, then header); None if there is none."""
+    for budget_ms in budgets_ms:
+        if budget_ms is not None and budget_ms > 0:
+            return Deadline.from_budget_ms(budget_ms)
+    return None
+
+
+async def run_within(deadline: Optional[Deadline], awaitable: Awaitable[T]) -> T:
+    """Await the result, raising LatencyBudgetExceeded once the deadline passes."""
+    if deadline is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, timeout=max(0.0, deadline.remaining()))
+    except asyncio.TimeoutError:
+        raise LatencyBudgetExceeded(deadline.budget_ms) from None
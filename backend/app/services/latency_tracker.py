@@ -0,0 +1,44 @@
+"""Rolling window of upstream call latencies."""
+
+from __future__ import annotations
+
+import threading
+from collections import deque
+from typing import Optional
+
+
+class LatencyTracker:
+    """Keeps the last ``window`` successful call durations and answers percentile queries."""
+
+    def __init__(self, window: int = 200, min_samples: int = 20) -> None:
+        self._samples: deque[float] = deque(maxlen=window)
+        self._min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    @property
+    def count(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Return the q-th percentile (0..100), or None until enough samples are collected."""
+        with self._lock:
+            if len(self._samples) < self._min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * len(ordered))) - 1))
+        return ordered[index]
+
+
+# Trackers per upstream
+_trackers: dict[str, LatencyTracker] = {}
+
+def get_latency_tracker(name: str) -> LatencyTracker:
+    """Get the shared latency tracker for an upstream."""
+    tracker = _trackers.get(name)
+    if tracker is None:
+        tracker = _trackers.setdefault(name, LatencyTracker())
+    return tracker
@@ -0,0 +1,169 @@
+"""Pluggable LLM backends and the failover chain the API talks to."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, Optional, Protocol, Sequence
+
+from ..config import get_settings
+from .latency_budget import Deadline, LatencyBudgetExceeded
+from .local_llm_backend import LocalLLMBackend
+from .yandex_gpt_client import AsyncLetterOperations, AsyncYandexCompletionService, get_async_yandex_service
+
+
+class LLMBackend(Protocol):
+    """What the letter and analysis code needs from a model provider."""
+
+    @property
+    def name(self) -> str: ...
+
+    def available(self) -> bool:
+        """False if the backend is known to be unhealthy right now (e.g. circuit open)."""
+        ...
+
+    async def complete(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        response_format: dict | None = None,
+        deadline: Deadline | None = None,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ) -> str: ...
+
+    def stream(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ) -> AsyncIterator[str]: ...
+
+
+class FailoverBackend:
+    """Tries backends in order and moves on when one fails or is too slow.
+
+    Backends whose circuit breaker is open are skipped (if all are unhealthy,
+    all are tried anyway). A call that raises, or that takes longer than
+    ``attempt_timeout_seconds`` on any but the last backend, falls through to
+    the next one. Streams fail over only before the first delta was sent.
+    """
+
+    name = "failover"
+
+    def __init__(self, backends: Sequence[LLMBackend], attempt_timeout_seconds: float = 0.0) -> None:
+        if not backends:
+            raise ValueError("FailoverBackend needs at least one backend")
+        self._backends = list(backends)
+        self._attempt_timeout = attempt_timeout_seconds
+
+    def available(self) -> bool:
+        return any(backend.available() for backend in self._backends)
+
+    def _candidates(self) -> list[LLMBackend]:
+        return [backend for backend in self._backends if backend.available()] or list(self._backends)
+
+    async def complete(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        response_format: dict | None = None,
+        deadline: Deadline | None = None,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ) -> str:
+        candidates = self._candidates()
+        last_error: Optional[Exception] = None
+        for index, backend in enumerate(candidates):
+            if deadline is not None:
+                deadline.check()
+            call = backend.complete(messages, temperature, response_format, deadline, model_tier, max_output_tokens)
+            try:
+                if self._attempt_timeout and index < len(candidates) - 1:
+                    return await asyncio.wait_for(call, timeout=self._attempt_timeout)
+                return await call
+            except LatencyBudgetExceeded:
+                raise
+            except asyncio.TimeoutError:
+                last_error = RuntimeError(f"{backend.name}: нет ответа за {self._attempt_timeout:.0f} сек")
+            except Exception as e:
+                last_error = e
+            print(f"[FAILOVER] {backend.name} не ответил ({last_error}), пробуем следующий бэкенд")
+        raise last_error
+
+    async def stream(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ):
+        last_error: Optional[Exception] = None
+        for backend in self._candidates():
+            started = False
+            try:
+                async for delta in backend.stream(messages, temperature, model_tier, max_output_tokens):
+                    started = True
+                    yield delta
+                return
+            except Exception as e:
+                if started:
+                    raise
+                last_error = e
+                print(f"[FAILOVER] {backend.name} не начал поток ({e}), пробуем следующий бэкенд")
+        raise last_error
+
+
+class LLMService(AsyncLetterOperations):
+    """Letter generation and analysis on top of any LLMBackend (normally the failover chain)."""
+
+    def __init__(self, backend: LLMBackend) -> None:
+        self.backend = backend
+
+    async def _make_request(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        response_format: dict | None = None,
+        deadline: Deadline | None = None,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ) -> str:
+        return await self.backend.complete(messages, temperature, response_format, deadline, model_tier, max_output_tokens)
+
+    def _stream_request(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ):
+        return self.backend.stream(messages, temperature, model_tier, max_output_tokens)
+
+
+def build_backend(name: str) -> LLMBackend:
+    """Create (or reuse) the backend registered under ``name`` in LLM_BACKENDS."""
+    settings = get_settings()
+    if name == "yandex_responses":
+        return get_async_yandex_service()
+    if name == "yandex_completion":
+        return AsyncYandexCompletionService()
+    if name == "local":
+        return LocalLLMBackend(latency_seconds=settings.llm_local_latency_ms / 1000.0)
+    raise ValueError(f"Unknown LLM backend '{name}' in LLM_BACKENDS")
+
+
+# Singleton instance
+_llm_service = None
+
+def get_llm_service() -> LLMService:
+    """Get singleton LLM service over the backends configured in LLM_BACKENDS."""
+    global _llm_service
+    if _llm_service is None:
+        settings = get_settings()
+        backends = [build_backend(name) for name in settings.llm_backends]
+        backend = backends[0] if len(backends) == 1 else FailoverBackend(
+            backends, attempt_timeout_seconds=settings.llm_failover_attempt_timeout_seconds
+        )
+        _llm_service = LLMService(backend)
+    return _llm_service
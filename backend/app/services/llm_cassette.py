@@ -0,0 +1,115 @@
+"""Record/replay of upstream LLM traffic ("cassettes") for profiling the Python side."""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Optional
+
+from ..config import get_settings
+
+OFF = "off"
+RECORD = "record"
+REPLAY = "replay"
+
+# gpt://<folder>/<model>: the folder depends on the credential the call happened to use
+_FOLDER = re.compile(r"^gpt://[^/]+/")
+
+
+def payload_key(upstream: str, payload: dict) -> str:
+    """Hash of a request payload; the folder of the model URI is left out, so any credential matches."""
+    normalized = dict(payload)
+    for field in ("model", "modelUri"):
+        if isinstance(normalized.get(field), str):
+            normalized[field] = _FOLDER.sub("gpt://", normalized[field])
+    raw = json.dumps([upstream, normalized], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CassetteMiss(RuntimeError):
+    """Replay mode got a request that was never recorded."""
+
+
+class LLMCassette:
+    """Upstream answers keyed by payload hash, stored as JSON lines (gzip if the path ends in .gz).
+
+    In ``record`` mode every successful answer is appended to the file: the
+    response body for regular calls, the text deltas for streamed ones. In
+    ``replay`` mode calls are served from the file without touching the
+    network, so a day of traffic can be replayed through the whole pipeline
+    with the upstream latency taken out of the measurements.
+    """
+
+    def __init__(self, path: str, mode: str = REPLAY) -> None:
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown cassette mode '{mode}', expected '{RECORD}' or '{REPLAY}'")
+        self.path = path
+        self.mode = mode
+        self._entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+        elif mode == REPLAY:
+            print(f"[CASSETTE] Файл {path} не найден: все вызовы модели завершатся ошибкой")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == RECORD
+
+    def _open(self, mode: str):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self) -> None:
+        with self._open("r") as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries[entry["key"]] = entry
+        print(f"[CASSETTE] Загружено записей: {len(self._entries)} ({self.path})")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, upstream: str, payload: dict) -> dict:
+        """Recorded entry for the payload: ``response`` (JSON body) or ``deltas`` (streamed text)."""
+        key = payload_key(upstream, payload)
+        entry = self._entries.get(key)
+        if entry is None:
+            print(f"[CASSETTE] Нет записи для запроса {key[:12]} ({upstream})")
+            raise CassetteMiss(f"Запрос {key[:12]} к {upstream} не записан в {self.path}")
+        return entry
+
+    def record(self, upstream: str, payload: dict, latency_seconds: float, **answer: Any) -> None:
+        """Store ``response=...`` or ``deltas=[...]`` (and ``response_id``) for the payload."""
+        key = payload_key(upstream, payload)
+        entry = {"key": key, "upstream": upstream, "latency_ms": round(latency_seconds * 1000), **answer}
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = entry
+            with self._open("a") as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+
+# Singleton instance
+_cassette: Optional[LLMCassette] = None
+
+def get_llm_cassette() -> Optional[LLMCassette]:
+    """Cassette from LLM_CASSETTE_MODE / LLM_CASSETTE_PATH, or None when recording is off."""
+    global _cassette
+    settings = get_settings()
+    if settings.llm_cassette_mode == OFF:
+        return None
+    if _cassette is None or (_cassette.path, _cassette.mode) != (settings.llm_cassette_path, settings.llm_cassette_mode):
+        _cassette = LLMCassette(settings.llm_cassette_path, settings.llm_cassette_mode)
+    return _cassette
@@ -0,0 +1,45 @@
+"""Per-request accounting of time spent waiting for quota vs. waiting for the LLM."""
+
+from __future__ import annotations
+
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class LLMTimings:
+    """Accumulated LLM timings of one API request."""
+
+    queue_wait_seconds: float = 0.0
+    llm_seconds: float = 0.0
+    calls: int = 0
+
+
+_current_timings: ContextVar[Optional[LLMTimings]] = ContextVar("llm_timings", default=None)
+
+
+def start_request_timings() -> LLMTimings:
+    """Start accounting for the current request (called by the HTTP middleware)."""
+    timings = LLMTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[LLMTimings]:
+    return _current_timings.get()
+
+
+def record_queue_wait(seconds: float) -> None:
+    """Time a call spent in the rate limiter queue."""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.queue_wait_seconds += seconds
+
+
+def record_llm_call(seconds: float) -> None:
+    """Time a call spent talking to the upstream LLM."""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.llm_seconds += seconds
+        timings.calls += 1
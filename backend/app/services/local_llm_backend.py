@@ -0,0 +1,138 @@
+"""Deterministic offline LLM backend for CI, demos without credentials and load tests."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import re
+import time
+
+from .category_detector import detect_category_by_keywords
+from .department_detector import detect_department_by_keywords
+from .latency_budget import Deadline
+from .llm_metrics import record_llm_call
+
+_SUBJECT = re.compile(r"Тема:\s*(.+)")
+_BODY = re.compile(r"Текст:\s*(.+)")
+_PACKED_LETTER = re.compile(r"Письмо (\d+):\nТема:\s*(.+)\nТекст:\s*(.+)")
+_FRAGMENT = re.compile(r"\nФрагмент:\n(.*)\n\nУказание:", re.DOTALL)
+
+
+class LocalLLMBackend:
+    """Answers from templates without any network access.
+
+    The answer depends only on the prompt, so identical requests get identical
+    answers. The kind of answer is taken from the prompt: the detailed analysis
+    JSON, the parameters JSON, a rewritten fragment (returned unchanged) or a
+    letter in the "Тема:/Тело:" format.
+    ``latency_seconds`` simulates model latency for load tests.
+    """
+
+    name = "local"
+
+    def __init__(self, latency_seconds: float = 0.0) -> None:
+        self._latency = latency_seconds
+
+    def available(self) -> bool:
+        return True
+
+    async def complete(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        response_format: dict | None = None,
+        deadline: Deadline | None = None,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ) -> str:
+        started = time.monotonic()
+        if self._latency:
+            await asyncio.sleep(self._latency)
+        text = self.respond(messages)
+        record_llm_call(time.monotonic() - started)
+        return text
+
+    async def stream(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ):
+        text = await self.complete(messages, temperature)
+        for piece in re.findall(r"\S+\s*|\s+", text):
+            yield piece
+
+    def respond(self, messages: list[dict[str, str]]) -> str:
+        prompt = "\n".join(msg["content"] for msg in messages)
+        fragment = _FRAGMENT.search(prompt)
+        if fragment:
+            return fragment.group(1)  # переписывание фрагмента: возвращаем его без изменений
+        # Данные письма идут после инструкций, поэтому берём последнее вхождение
+        subjects = _SUBJECT.findall(prompt)
+        bodies = _BODY.findall(prompt)
+        subject = subjects[-1].strip() if subjects else ""
+        body = bodies[-1].strip() if bodies else ""
+
+        packed = _PACKED_LETTER.findall(prompt) if '"results"' in prompt else []
+        if packed:
+            # Пакет писем для анализа: по объекту на письмо с его номером
+            results = [
+                {"index": int(number), **self._detailed_analysis(letter_subject.strip(), letter_body.strip())}
+                for number, letter_subject, letter_body in packed
+            ]
+            return json.dumps({"results": results}, ensure_ascii=False)
+        if '"analysis"' in prompt and '"draft"' in prompt:
+            reply_subject, reply_body = self._letter_parts(subject, body)
+            return json.dumps(
+                {"analysis": self._detailed_analysis(subject, body), "draft": {"subject": reply_subject, "body": reply_body}},
+                ensure_ascii=False,
+            )
+        if '"extracted_info"' in prompt:
+            return json.dumps(self._detailed_analysis(subject, body), ensure_ascii=False)
+        if "JSON" in prompt:
+            return json.dumps(self._parameters(), ensure_ascii=False)
+        return self._letter(subject, body)
+
+    def _parameters(self) -> dict:
+        return {
+            "tone": "formal",
+            "purpose": "response",
+            "length": "medium",
+            "audience": "client",
+            "urgency": "normal",
+            "address_style": "vy",
+            "include_formal_greetings": True,
+            "include_greeting_and_signoff": True,
+            "include_corporate_phrases": True,
+        }
+
+    def _detailed_analysis(self, subject: str, body: str) -> dict:
+        category, _ = detect_category_by_keywords(subject, body)
+        return {
+            "category": category,
+            "parameters": self._parameters(),
+            "extracted_info": {
+                "request_essence": f"Обращение по теме «{subject}». Требуется обработка и ответ.",
+                "contact_info": None,
+                "regulatory_references": [],
+                "requirements": [],
+                "legal_risks": [],
+            },
+        }
+
+    def _letter_parts(self, subject: str, body: str) -> tuple[str, str]:
+        department = detect_department_by_keywords(subject, body)
+        return (
+            f"Ответ на обращение «{subject}»",
+            "Добрый день!\n\n"
+            f"Благодарим за обращение по теме «{subject}». "
+            "Ваш запрос будет рассмотрен в установленные сроки.\n"
+            f"Ответственное подразделение: {department}.\n\n"
+            "С уважением,\n"
+            "ПСБ",
+        )
+
+    def _letter(self, subject: str, body: str) -> str:
+        reply_subject, reply_body = self._letter_parts(subject, body)
+        return f"Тема: {reply_subject}\nТело: {reply_body}"
@@ -0,0 +1,77 @@
+"""Micro-batching: calls arriving within a short window are processed together."""
+
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, List, Sequence, Set, Tuple, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """Collects items per key and hands them to ``process`` as one batch.
+
+    A batch is flushed when ``max_size`` items are waiting or ``window_seconds``
+    after its first item, whichever comes first. ``process(key, items)``
+    returns one result per item, in order; its exception is raised to every
+    caller of the batch, and cancelling the batch cancels them. Only items with the same key (e.g. company context)
+    are packed together.
+    """
+
+    def __init__(
+        self,
+        process: Callable[[Hashable, Sequence[T]], Awaitable[Sequence[R]]],
+        window_seconds: float = 0.05,
+        max_size: int = 8,
+    ) -> None:
+        self._process = process
+        self._window = window_seconds
+        self._max_size = max(1, max_size)
+        self._pending: Dict[Hashable, List[Tuple[T, asyncio.Future]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        # The event loop keeps only weak references to tasks: hold running batches here
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, key: Hashable, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((item, future))
+        if len(batch) >= self._max_size:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self._window, self._flush, key)
+        # shield: if one caller disconnects, the batch still serves the others
+        return await asyncio.shield(future)
+
+    def _flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, None)
+        if batch:
+            task = asyncio.ensure_future(self._run(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, batch: List[Tuple[T, asyncio.Future]]) -> None:
+        try:
+            results = await self._process(key, [item for item, _ in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Batch of {len(batch)} items produced {len(results)} results")
+        except BaseException as e:
+            # Cancelled (e.g. at shutdown) or failed: no caller may be left waiting
+            for _, future in batch:
+                if future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
@@ -0,0 +1,83 @@
+"""Task-aware routing of LLM calls between a fast model and a large model."""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from ..config import get_settings
+
+FAST = "fast"
+LARGE = "large"
+MODEL_TIERS = (FAST, LARGE)
+
+
+class ModelRouter:
+    """Maps each task to a model tier; backends map tiers to concrete models.
+
+    Tiers instead of model names keep the rules valid for every backend in the
+    failover chain (Responses and completion APIs name their models differently).
+    """
+
+    def __init__(
+        self,
+        parameters_tier: str = FAST,
+        analysis_tier: str = LARGE,
+        generation_tier: str = LARGE,
+        short_generation_tier: str = LARGE,
+        fast_max_prompt_tokens: int = 3000,
+        escalate_invalid_json: bool = True,
+    ) -> None:
+        for tier in (parameters_tier, analysis_tier, generation_tier, short_generation_tier):
+            if tier not in MODEL_TIERS:
+                raise ValueError(f"Unknown model tier '{tier}', expected one of {MODEL_TIERS}")
+        self.parameters_tier = parameters_tier
+        self.analysis_tier = analysis_tier
+        self.generation_tier = generation_tier
+        self.short_generation_tier = short_generation_tier
+        self.fast_max_prompt_tokens = fast_max_prompt_tokens
+        self.escalate_invalid_json = escalate_invalid_json
+
+    @classmethod
+    def from_settings(cls) -> "ModelRouter":
+        settings = get_settings()
+        return cls(
+            parameters_tier=settings.llm_route_parameters,
+            analysis_tier=settings.llm_route_analysis,
+            generation_tier=settings.llm_route_generation,
+            short_generation_tier=settings.llm_route_generation_short,
+            fast_max_prompt_tokens=settings.llm_route_fast_max_prompt_tokens,
+            escalate_invalid_json=settings.llm_escalate_invalid_json,
+        )
+
+    def _fit(self, tier: str, prompt_tokens: int) -> str:
+        # A long thread or company context needs the large model's context window
+        if tier == FAST and prompt_tokens > self.fast_max_prompt_tokens:
+            return LARGE
+        return tier
+
+    def for_parameters(self, prompt_tokens: int = 0) -> str:
+        return self._fit(self.parameters_tier, prompt_tokens)
+
+    def for_analysis(self, prompt_tokens: int = 0) -> str:
+        return self._fit(self.analysis_tier, prompt_tokens)
+
+    def for_generation(self, length: Optional[str], prompt_tokens: int) -> str:
+        tier = self.short_generation_tier if length == "short" else self.generation_tier
+        return self._fit(tier, prompt_tokens)
+
+    def escalation_tier(self, tier: str) -> Optional[str]:
+        """Tier to retry with after the model returned unusable JSON, or None."""
+        if self.escalate_invalid_json and tier != LARGE:
+            return LARGE
+        return None
+
+
+# Singleton instance
+_model_router = None
+
+def get_model_router() -> ModelRouter:
+    """Get singleton model router configured from Settings."""
+    global _model_router
+    if _model_router is None:
+        _model_router = ModelRouter.from_settings()
+    return _model_router
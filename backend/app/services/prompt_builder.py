@@ -2,10 +2,25 @@
 
 from __future__ import annotations
 
-from textwrap import dedent
+import hashlib
+from dataclasses import dataclass, field
 from typing import List, Dict
 
-from ..models import EmailGenerationRequest, EmailParameters
+from ..models import DetailedEmailAnalysis, EmailGenerationRequest, EmailParameters
+
+
+# Грубая оценка для русского текста: ~3 символа на токен (с запасом для квот)
+CHARS_PER_TOKEN = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in text without calling a tokenizer."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def estimate_messages_tokens(messages: List[Dict[str, str]]) -> int:
+    """Estimate input tokens of a chat messages array."""
+    return sum(estimate_tokens(msg["content"]) for msg in messages)
 
 
 def _map_length(length: str) -> str:
@@ -16,6 +31,18 @@ def _map_length(length: str) -> str:
     }[length]
 
 
+# Output budget of a letter: sentences promised by _map_length plus subject, greeting and sign-off
+TOKENS_PER_SENTENCE = 45
+LETTER_OVERHEAD_TOKENS = 150
+OUTPUT_HEADROOM = 1.5
+
+
+def letter_output_tokens(length: str) -> int:
+    """max_output_tokens for a letter of the requested length."""
+    max_sentences = int(_map_length(length).split()[0].split("-")[-1])
+    return int((max_sentences * TOKENS_PER_SENTENCE + LETTER_OVERHEAD_TOKENS) * OUTPUT_HEADROOM)
+
+
 def _render_parameters(params: EmailParameters) -> str:
     directives = [
         f"Тон: {params.tone}",
@@ -33,8 +60,16 @@ def _render_parameters(params: EmailParameters) -> str:
     return "\n".join(f"- {item}" for item in directives)
 
 
-def _compose_context(req: EmailGenerationRequest, thread_history: str = None, recipient_name: str = None) -> str:
-    sections = [f"Постоянный корпоративный контекст:\n{req.company_context.strip()}"]
+def _compose_context(
+    req: EmailGenerationRequest,
+    thread_history: str = None,
+    recipient_name: str = None,
+    include_company_context: bool = True,
+    include_sender: bool = True,
+) -> str:
+    sections = []
+    if include_company_context:
+        sections.append(f"Постоянный корпоративный контекст:\n{req.company_context.strip()}")
 
     # Добавляем историю переписки, если она есть
     if thread_history:
@@ -73,56 +108,35 @@ def _compose_context(req: EmailGenerationRequest, thread_history: str = None, re
         sender_lines.append(f"- Горячая линия: {req.sender_hotline}")
     if req.sender_website:
         sender_lines.append(f"- Сайт: {req.sender_website}")
-    if sender_lines:
+    if sender_lines and include_sender:
         sections.append("Данные подписанта:\n" + "\n".join(sender_lines))
 
     return "\n\n".join(sections)
 
 
-def build_messages(req: EmailGenerationRequest, department: str = None, thread_history: str = None, recipient_name: str = None) -> List[Dict[str, str]]:
-    """Return chat messages array for AI model."""
-    params_section = _render_parameters(req.parameters)
-    context_block = _compose_context(req, thread_history=thread_history, recipient_name=recipient_name)
-    
-    prompt = dedent(
-        f"""Сгенерируй деловое письмо банка по требованиям ниже.
+def _render_analysis(analysis: DetailedEmailAnalysis) -> str:
+    info = analysis.extracted_info
+    lines = [
+        f"- Категория: {analysis.category}",
+        f"- Ответственное подразделение: {analysis.department}",
+        f"- Суть запроса: {info.request_essence}",
+    ]
+    if info.requirements:
+        lines.append("- Требования отправителя: " + "; ".join(info.requirements))
+    if analysis.extracted_deadline_days is not None:
+        lines.append(f"- Срок, указанный в письме: {analysis.extracted_deadline_days} раб. дн.")
+    lines.append(f"- Срок ответа по регламенту: {analysis.estimated_sla_days} раб. дн.")
+    return "Результаты анализа входящего письма:\n" + "\n".join(lines)
 
-        Входящее письмо:
-        Тема: {req.source_subject}
-Текст: {req.source_body}
 
-        {context_block}
+_SYSTEM_PROMPT = (
+    "Ты профессиональный автор деловой корреспонденции. "
+    "Всегда отвечай на русском языке."
+)
 
-Параметры: {params_section}
 
-Правила:
-1. СТРОГО соблюдай требуемую длину письма из параметра "Длина". Это КРИТИЧЕСКИ ВАЖНОЕ требование!
-   - Если указано "8-12 предложений" → письмо ДОЛЖНО содержать минимум 8 предложений, желательно 10-12. Разверни ответ, добавь детали, объяснения, примеры, дополнительную информацию.
-   - Если указано "5-8 предложений" → письмо ОБЯЗАТЕЛЬНО должно содержать от 5 до 8 предложений включительно. НЕ МЕНЬШЕ 5 предложений! Если получилось меньше - добавь детали, разверни мысли, добавь дополнительную информацию.
-   - Если указано "3-4 предложения" → письмо должно содержать 3-4 предложения, не больше.
-   Для длинных писем используй: детализацию, примеры, объяснение преимуществ, описание процесса, дополнительные предложения, контекст.
-   ВАЖНО: При подсчете предложений:
-   - НЕ считай точку в датах (например, "28.11.2025", "23.11.2025") за конец предложения. Точки в датах - это разделители чисел, а не знаки препинания.
-   - НЕ учитывай подпись (текст после "С уважением,") при подсчете предложений. Подпись добавляется автоматически и не входит в требуемую длину письма.
-   - ПЕРЕД отправкой ответа ПРОВЕРЬ количество предложений в основном тексте письма (до подписи). Если предложений меньше требуемого - ДОПОЛНИ письмо до нужного количества.
-   Предложение заканчивается только точкой, восклицательным или вопросительным знаком, которые стоят после пробела или в конце абзаца, но НЕ в датах и НЕ в подписи.
-2. Переформулируй факты, но не добавляй неподтверждённые данные.
-3. На вопросы отвечай пунктами.
-4. Если urgency=high, укажи срочность в тексте.
-5. Обращение к получателю (кто написал входящее письмо):
-   - НЕ используй имя/фамилию ОТПРАВИТЕЛЯ (из "Данные подписанта") в обращении!
-   - Если имя получателя указано в блоке "Имя получателя" → используй его в обращении: "Уважаемый [Имя] [Отчество/Фамилия]" или "Уважаемый [Имя]".
-   - Если имя получателя НЕ указано → используй только "Уважаемый"/"Уважаемые" без имени.
-   - Примеры: "Уважаемый Артем Евгеньевич" (если имя указано), "Уважаемый" (если имя не указано), "Уважаемый коллега" (если audience=colleague и имя не указано).
-   - НЕ используй плейсхолдеры "[Имя]" или "[Фамилия]" - используй реальное имя из блока "Имя получателя".
-6. НЕ копируй подпись из исходного письма в ответ.
-7. Формат ответа:
-          Тема: <краткая формулировка>
-          Тело:
-   <текст письма>
-   
-   
-7. Подпись в конце (обязательно, из "Данные подписанта"):
+# Правила оформления подписи (для режима, где подпись пишет модель)
+_SIGNATURE_RULES = """8. Подпись в конце (обязательно, из "Данные подписанта"):
    - Перед подписью ОБЯЗАТЕЛЬНО добавь ДВЕ пустые строки
    Точный формат подписи (строго соблюдай):
    
@@ -193,15 +207,166 @@ def build_messages(req: EmailGenerationRequest, department: str = None, thread_h
    - После сайта добавь одну пустую строку, затем маркер [LOGO] для логотипа банка
    - Если какое-то поле не указано в "Данные подписанта", пропусти его вместе с соответствующими пустыми строками после него
    - Используй ТОЧНО те значения, которые указаны в "Данные подписанта", не меняй их"""
-    ).strip()
+
+
+_LETTER_RULES = """Сгенерируй деловое письмо банка — ответ на входящее письмо из конца сообщения — по правилам ниже.
+
+Правила:
+1. СТРОГО соблюдай требуемую длину письма из параметра "Длина". Это КРИТИЧЕСКИ ВАЖНОЕ требование!
+   - Если указано "8-12 предложений" → письмо ДОЛЖНО содержать минимум 8 предложений, желательно 10-12. Разверни ответ, добавь детали, объяснения, примеры, дополнительную информацию.
+   - Если указано "5-8 предложений" → письмо ОБЯЗАТЕЛЬНО должно содержать от 5 до 8 предложений включительно. НЕ МЕНЬШЕ 5 предложений! Если получилось меньше - добавь детали, разверни мысли, добавь дополнительную информацию.
+   - Если указано "3-4 предложения" → письмо должно содержать 3-4 предложения, не больше.
+   Для длинных писем используй: детализацию, примеры, объяснение преимуществ, описание процесса, дополнительные предложения, контекст.
+   ВАЖНО: При подсчете предложений:
+   - НЕ считай точку в датах (например, "28.11.2025", "23.11.2025") за конец предложения. Точки в датах - это разделители чисел, а не знаки препинания.
+   - НЕ учитывай подпись (текст после "С уважением,") при подсчете предложений. Подпись добавляется автоматически и не входит в требуемую длину письма.
+   - ПЕРЕД отправкой ответа ПРОВЕРЬ количество предложений в основном тексте письма (до подписи). Если предложений меньше требуемого - ДОПОЛНИ письмо до нужного количества.
+   Предложение заканчивается только точкой, восклицательным или вопросительным знаком, которые стоят после пробела или в конце абзаца, но НЕ в датах и НЕ в подписи.
+2. Переформулируй факты, но не добавляй неподтверждённые данные.
+3. На вопросы отвечай пунктами.
+4. Если urgency=high, укажи срочность в тексте.
+5. Обращение к получателю (кто написал входящее письмо):
+{sender_rule}   - Если имя получателя указано в блоке "Имя получателя" → используй его в обращении: "Уважаемый [Имя] [Отчество/Фамилия]" или "Уважаемый [Имя]".
+   - Если имя получателя НЕ указано → используй только "Уважаемый"/"Уважаемые" без имени.
+   - Примеры: "Уважаемый Артем Евгеньевич" (если имя указано), "Уважаемый" (если имя не указано), "Уважаемый коллега" (если audience=colleague и имя не указано).
+   - НЕ используй плейсхолдеры "[Имя]" или "[Фамилия]" - используй реальное имя из блока "Имя получателя".
+6. НЕ копируй подпись из исходного письма в ответ.{signature_note}
+7. Ответ возвращай строго в формате:
+   Тема: <краткая формулировка>
+   Тело:
+   <текст письма>{signature_rules}"""
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    """Prompt compiled once at import: static instructions first, per-request data last.
+
+    Every request with the same template shares the prefix (system message and
+    instructions), so upstream prefix caching can reuse it. ``version`` is a
+    short hash of that prefix and goes into cache keys: editing the template
+    invalidates results generated with the old one.
+    """
+
+    name: str
+    system: str
+    instructions: str
+    version: str = field(init=False)
+
+    def __post_init__(self) -> None:
+        digest = hashlib.sha256(f"{self.system}\n{self.instructions}".encode("utf-8")).hexdigest()[:12]
+        object.__setattr__(self, "version", digest)
+
+    def render(self, data: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": f"{self.instructions}\n\n{data}"},
+        ]
+
+
+LETTER_TEMPLATE = PromptTemplate(
+    "letter",
+    _SYSTEM_PROMPT,
+    _LETTER_RULES.format(
+        sender_rule='   - НЕ используй имя/фамилию ОТПРАВИТЕЛЯ (из "Данные подписанта") в обращении!\n',
+        signature_note="",
+        signature_rules="\n\n" + _SIGNATURE_RULES,
+    ),
+)
+LETTER_LOCAL_SIGNATURE_TEMPLATE = PromptTemplate(
+    "letter_local_signature",
+    _SYSTEM_PROMPT,
+    _LETTER_RULES.format(
+        sender_rule="",
+        signature_note=" Свою подпись и «С уважением» тоже не пиши — подпись добавляется автоматически.",
+        signature_rules="",
+    ),
+)
+# Версия обоих шаблонов письма: входит в ключ кэша генерации (режим подписи на результат не влияет)
+LETTER_PROMPT_VERSION = hashlib.sha256(
+    f"{LETTER_TEMPLATE.version}:{LETTER_LOCAL_SIGNATURE_TEMPLATE.version}".encode("utf-8")
+).hexdigest()[:12]
+
+
+def letter_template(local_signature: bool = False) -> PromptTemplate:
+    return LETTER_LOCAL_SIGNATURE_TEMPLATE if local_signature else LETTER_TEMPLATE
+
+
+def build_messages(
+    req: EmailGenerationRequest,
+    thread_history: str = None,
+    recipient_name: str = None,
+    parameters_text: str = None,
+    analysis: DetailedEmailAnalysis = None,
+    local_signature: bool = False,
+) -> List[Dict[str, str]]:
+    """Return chat messages array for AI model.
+
+    The rules come from a precompiled template (letter_template); only the
+    per-letter data is rendered here, after the rules: context, parameters and
+    the incoming letter last. ``parameters_text`` replaces the rendered
+    ``req.parameters`` (e.g. when the model chooses the parameters itself in
+    the same call). ``analysis`` (from /analyze-detailed by analysis_id) adds
+    its category, department, deadlines and requirements to the context. With
+    ``local_signature`` the prompt has neither the sender block nor the
+    signature rules: the model writes the letter without a signature and
+    _attach_signature appends it afterwards.
+    """
+    params_section = parameters_text or _render_parameters(req.parameters)
+    sections = [
+        _compose_context(
+            req, thread_history=thread_history, recipient_name=recipient_name, include_sender=not local_signature
+        )
+    ]
+    if analysis is not None:
+        sections.append(_render_analysis(analysis))
+    sections.append(f"Параметры: {params_section}")
+    sections.append(f"Входящее письмо:\nТема: {req.source_subject}\nТекст: {req.source_body}")
+    return letter_template(local_signature).render("\n\n".join(sections))
+
+
+def build_section_messages(
+    subject: str, body: str, fragment: str, instruction: str, is_subject: bool = False
+) -> List[Dict[str, str]]:
+    """Short prompt rewriting one fragment of a ready draft.
+
+    Only the draft itself (without signature) is sent: no rules, corporate
+    context or incoming letter, and the answer is the new fragment alone.
+    """
+    what = "тему письма" if is_subject else "фрагмент письма"
+    prompt = (
+        f"Перепиши {what} по указанию, не меняя смысла остального письма и сохраняя его стиль.\n"
+        "Верни только новый текст фрагмента: без кавычек, пояснений и остального письма.\n\n"
+        f"Письмо:\nТема: {subject}\n{body}\n\n"
+        f"Фрагмент:\n{fragment}\n\n"
+        f"Указание: {instruction}"
+    )
     return [
-        {
-            "role": "system",
-            "content": (
-                "Ты профессиональный автор деловой корреспонденции. "
-                "Всегда отвечай на русском языке."
-            ),
-        },
+        {"role": "system", "content": _SYSTEM_PROMPT},
         {"role": "user", "content": prompt},
     ]
 
+
+def build_followup_messages(
+    req: EmailGenerationRequest, new_history: str = None, recipient_name: str = None
+) -> List[Dict[str, str]]:
+    """Messages continuing a stored conversation: only what is new since the previous answer.
+
+    Rules, corporate context and the earlier letters are already in the upstream
+    conversation (previous_response_id), so they are not sent again.
+    """
+    context_block = _compose_context(
+        req, thread_history=new_history, recipient_name=recipient_name, include_company_context=False
+    )
+    sections = [
+        "Продолжение той же переписки: пришло новое входящее письмо. "
+        "Сгенерируй ответ на него по тем же правилам и в том же формате (Тема: / Тело:), что и предыдущее письмо.",
+        f"Входящее письмо:\nТема: {req.source_subject}\nТекст: {req.source_body}",
+    ]
+    if context_block:
+        sections.append(context_block)
+    sections.append(f"Параметры: {_render_parameters(req.parameters)}")
+    return [
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "user", "content": "\n\n".join(sections)},
+    ]
+
@@ -0,0 +1,229 @@
+"""Token-bucket rate limiter for the Yandex folder quota, shared by all workers."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+from typing import Any, Optional
+
+from ..config import get_settings
+from .llm_metrics import record_queue_wait
+
+
+class RateLimitExceeded(RuntimeError):
+    """The quota would not free up within the allowed queue wait."""
+
+    def __init__(self, waited_seconds: float, retry_after_seconds: float) -> None:
+        super().__init__(
+            f"Квота YandexGPT исчерпана: ожидание в очереди {waited_seconds:.1f} сек, "
+            f"повторите через {retry_after_seconds:.1f} сек"
+        )
+        self.retry_after_seconds = retry_after_seconds
+
+
+# Two buckets (requests and tokens) are checked and debited atomically.
+# Returns 0 when both were debited, otherwise milliseconds until both can be.
+_TAKE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local wait = 0
+local state = {}
+for i = 1, 2 do
+    local rate = tonumber(ARGV[(i - 1) * 3 + 1])
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = tonumber(ARGV[(i - 1) * 3 + 3])
+    local tokens = capacity
+    if rate > 0 then
+        local data = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+        if data[1] then
+            tokens = math.min(capacity, tonumber(data[1]) + (now - tonumber(data[2])) * rate)
+        end
+        if tokens < cost then
+            wait = math.max(wait, math.ceil((cost - tokens) / rate))
+        end
+    end
+    state[i] = {rate, tokens, cost}
+end
+for i = 1, 2 do
+    local rate, tokens, cost = state[i][1], state[i][2], state[i][3]
+    if rate > 0 then
+        if wait == 0 then
+            tokens = tokens - cost
+        end
+        redis.call('HSET', KEYS[i], 'tokens', tokens, 'ts', now)
+        redis.call('PEXPIRE', KEYS[i], 600000)
+    end
+end
+return wait
+"""
+
+_DRAIN_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+redis.call('HSET', KEYS[1], 'tokens', 0, 'ts', now + tonumber(ARGV[1]))
+redis.call('PEXPIRE', KEYS[1], 600000)
+return 0
+"""
+
+
+class _LocalBucket:
+    """In-process token bucket used when Redis is not available."""
+
+    def __init__(self, rate_per_second: float, capacity: float) -> None:
+        self.rate = rate_per_second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_for(self, cost: float, now: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost: float) -> None:
+        if self.rate > 0:
+            self.tokens -= cost
+
+    def drain(self, now: float, penalty_seconds: float) -> None:
+        self.tokens = 0.0
+        self.updated = max(self.updated, now + penalty_seconds)
+
+
+class RateLimiter:
+    """Queues LLM calls so that the folder's RPS and token-per-minute quota is not exceeded.
+
+    With Redis the buckets live in Redis and are shared by every uvicorn
+    worker; otherwise each process keeps its own buckets. Callers wait in
+    the queue up to ``max_wait_seconds`` and then get RateLimitExceeded.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        requests_per_second: float,
+        burst: float,
+        tokens_per_minute: float = 0,
+        max_wait_seconds: float = 30.0,
+        redis_client: Any = None,
+    ) -> None:
+        self._keys = [f"bizmail:ratelimit:{name}:requests", f"bizmail:ratelimit:{name}:tokens"]
+        self._request_rate = requests_per_second
+        self._request_capacity = max(1.0, burst)
+        self._token_rate = tokens_per_minute / 60.0
+        # A minute of tokens may be spent at once
+        self._token_capacity = float(tokens_per_minute)
+        self._max_wait = max_wait_seconds
+        self._redis = redis_client
+        self._lock = threading.Lock()
+        self._requests = _LocalBucket(self._request_rate, self._request_capacity)
+        self._tokens = _LocalBucket(self._token_rate, self._token_capacity)
+
+    def _token_cost(self, tokens: int) -> float:
+        # A single request bigger than the whole bucket would wait forever
+        return float(min(tokens, self._token_capacity)) if self._token_capacity else 0.0
+
+    def _try_take(self, tokens: int) -> float:
+        """Debit one request and tokens; return 0 on success or seconds to wait."""
+        token_cost = self._token_cost(tokens)
+        if self._redis is not None:
+            try:
+                wait_ms = self._redis.eval(
+                    _TAKE_SCRIPT,
+                    2,
+                    *self._keys,
+                    self._request_rate / 1000.0, self._request_capacity, 1,
+                    self._token_rate / 1000.0, self._token_capacity, token_cost,
+                )
+                return int(wait_ms) / 1000.0
+            except Exception as e:
+                print(f"[RATE-LIMIT] Redis error, using local bucket: {e}")
+
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._requests.wait_for(1, now), self._tokens.wait_for(token_cost, now))
+            if wait == 0:
+                self._requests.take(1)
+                self._tokens.take(token_cost)
+            return wait
+
+    def _next_sleep(self, wait: float, started: float, max_wait: Optional[float]) -> float:
+        waited = time.monotonic() - started
+        limit = self._max_wait if max_wait is None else min(self._max_wait, max_wait)
+        if waited + wait > limit:
+            raise RateLimitExceeded(waited, wait)
+        # Re-check at least every second: other callers may have been served meanwhile
+        return min(wait, 1.0)
+
+    async def _take(self, tokens: int) -> float:
+        """_try_take without blocking the event loop: the Redis client is synchronous."""
+        if self._redis is None:
+            return self._try_take(tokens)
+        return await asyncio.to_thread(self._try_take, tokens)
+
+    async def try_acquire(self, tokens: int = 0) -> bool:
+        """Take quota only if it is available right now (never queues)."""
+        return await self._take(tokens) == 0
+
+    async def acquire(self, tokens: int = 0, max_wait_seconds: Optional[float] = None) -> float:
+        """Wait (without blocking the event loop) for quota; return queue wait in seconds.
+
+        max_wait_seconds shortens the configured queue wait (e.g. to the caller's deadline).
+        """
+        started = time.monotonic()
+        while True:
+            wait = await self._take(tokens)
+            if wait == 0:
+                break
+            await asyncio.sleep(self._next_sleep(wait, started, max_wait_seconds))
+        waited = time.monotonic() - started
+        record_queue_wait(waited)
+        return waited
+
+    async def drain(self, retry_after_seconds: float = 1.0) -> None:
+        """Upstream answered 429: empty the request bucket so callers queue instead of failing."""
+        if self._redis is None:
+            self._drain(retry_after_seconds)
+        else:
+            await asyncio.to_thread(self._drain, retry_after_seconds)
+
+    def _drain(self, retry_after_seconds: float) -> None:
+        if self._redis is not None:
+            try:
+                self._redis.eval(_DRAIN_SCRIPT, 1, self._keys[0], int(retry_after_seconds * 1000))
+                return
+            except Exception as e:
+                print(f"[RATE-LIMIT] Redis error while draining bucket: {e}")
+        with self._lock:
+            self._requests.drain(time.monotonic(), retry_after_seconds)
+
+
+# Limiters per quota owner (folder)
+_limiters: dict[str, RateLimiter] = {}
+
+def get_rate_limiter(folder_id: str) -> Optional[RateLimiter]:
+    """Get the shared limiter for a Yandex folder, or None if rate limiting is disabled."""
+    settings = get_settings()
+    if not settings.llm_rate_limit_enabled:
+        return None
+    limiter = _limiters.get(folder_id)
+    if limiter is None:
+        from .cache_service import get_cache_service
+        limiter = RateLimiter(
+            name=folder_id,
+            requests_per_second=settings.llm_rate_limit_rps,
+            burst=settings.llm_rate_limit_burst,
+            tokens_per_minute=settings.llm_rate_limit_tokens_per_minute,
+            max_wait_seconds=settings.llm_rate_limit_max_wait_seconds,
+            redis_client=get_cache_service().client,
+        )
+        _limiters[folder_id] = limiter
+    return limiter
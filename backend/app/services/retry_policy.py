@@ -0,0 +1,156 @@
+"""Retry policy for upstream LLM calls: adaptive timeouts, backoff, Retry-After and budget."""
+
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import httpx
+
+from ..config import get_settings
+from .latency_budget import Deadline
+from .latency_tracker import LatencyTracker
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+def is_ssl_error(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return "ssl" in error_str or "eof" in error_str or "protocol" in error_str
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta-seconds or HTTP date) into seconds."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass
+class RetryState:
+    """Progress of one logical request across its attempts."""
+
+    started: float = field(default_factory=time.monotonic)
+    attempts: int = 0
+    deadline: Optional[Deadline] = None
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+
+class RetryPolicy:
+    """Decides timeouts and whether/when to retry a failed upstream call.
+
+    - read timeouts follow the rolling latency histogram (percentile x
+      multiplier, clamped to [min, max]) instead of a fixed 60 s;
+    - transport errors, SSL errors, 429 and 5xx are retried;
+    - the delay is exponential backoff with full jitter, but never shorter
+      than the upstream's Retry-After;
+    - attempts stop when the total budget for the request (or the caller's
+      deadline, whichever is sooner) would be exceeded.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay_seconds: float = 0.5,
+        max_delay_seconds: float = 10.0,
+        budget_seconds: float = 120.0,
+        connect_timeout_seconds: float = 10.0,
+        min_read_timeout_seconds: float = 15.0,
+        max_read_timeout_seconds: float = 60.0,
+        timeout_percentile: float = 99.0,
+        timeout_multiplier: float = 2.0,
+        latency_tracker: Optional[LatencyTracker] = None,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay_seconds
+        self.max_delay = max_delay_seconds
+        self.budget = budget_seconds
+        self.connect_timeout = connect_timeout_seconds
+        self.min_read_timeout = min_read_timeout_seconds
+        self.max_read_timeout = max_read_timeout_seconds
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.latency_tracker = latency_tracker
+
+    @classmethod
+    def from_settings(cls, latency_tracker: Optional[LatencyTracker] = None) -> "RetryPolicy":
+        settings = get_settings()
+        return cls(
+            max_attempts=settings.llm_retry_max_attempts,
+            base_delay_seconds=settings.llm_retry_base_delay_seconds,
+            max_delay_seconds=settings.llm_retry_max_delay_seconds,
+            budget_seconds=settings.llm_retry_budget_seconds,
+            connect_timeout_seconds=settings.llm_connect_timeout_seconds,
+            min_read_timeout_seconds=settings.llm_read_timeout_min_seconds,
+            max_read_timeout_seconds=settings.llm_read_timeout_max_seconds,
+            timeout_percentile=settings.llm_timeout_percentile,
+            timeout_multiplier=settings.llm_timeout_multiplier,
+            latency_tracker=latency_tracker,
+        )
+
+    def start(self, deadline: Optional[Deadline] = None) -> RetryState:
+        return RetryState(deadline=deadline)
+
+    def remaining(self, state: RetryState) -> float:
+        remaining = self.budget - state.elapsed()
+        if state.deadline is not None:
+            remaining = min(remaining, state.deadline.remaining())
+        return remaining
+
+    def read_timeout(self) -> float:
+        observed = self.latency_tracker.percentile(self.timeout_percentile) if self.latency_tracker else None
+        if observed is None:
+            return self.max_read_timeout
+        return min(self.max_read_timeout, max(self.min_read_timeout, observed * self.timeout_multiplier))
+
+    def timeout(self, state: RetryState) -> httpx.Timeout:
+        """Timeouts for the next attempt, never beyond what is left of the budget."""
+        remaining = max(0.1, self.remaining(state))
+        read = min(self.read_timeout(), remaining)
+        return httpx.Timeout(remaining, connect=min(self.connect_timeout, remaining), read=read)
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in RETRYABLE_STATUS_CODES
+        if isinstance(error, httpx.TransportError):
+            return True
+        return isinstance(error, Exception) and not isinstance(error, RuntimeError) and is_ssl_error(error)
+
+    def next_delay(self, state: RetryState, error: BaseException, honor_retry_after: bool = True) -> Optional[float]:
+        """Record a failed attempt; return the delay before the next one, or None to give up.
+
+        ``honor_retry_after=False`` when the next attempt goes to another
+        credential, whose quota the Retry-After of this one does not concern.
+        """
+        state.attempts += 1
+        if state.attempts >= self.max_attempts or not self.is_retryable(error):
+            return None
+
+        backoff = min(self.max_delay, self.base_delay * (2 ** (state.attempts - 1)))
+        delay = random.uniform(0, backoff)  # full jitter: retries of many callers spread out
+        if honor_retry_after and isinstance(error, httpx.HTTPStatusError):
+            retry_after = parse_retry_after(error.response.headers.get("Retry-After"))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+
+        # The delay plus at least a short attempt must fit into the remaining budget
+        if delay + self.min_read_timeout > self.remaining(state):
+            return None
+        return delay
+
+    async def asleep(self, delay: float) -> None:
+        await asyncio.sleep(delay)
@@ -0,0 +1,97 @@
+"""Rewriting one fragment of a ready draft (a paragraph or the subject) with a short prompt."""
+
+from __future__ import annotations
+
+import re
+
+from ..config import get_settings
+from ..models import SectionRegenerationResponse
+from .latency_budget import Deadline
+from .model_router import get_model_router
+from .prompt_builder import build_section_messages, estimate_messages_tokens, estimate_tokens
+
+# Подпись, добавленная локально (_attach_signature), начинается с последней строки «С уважением»
+_SIGNATURE_LINE = re.compile(r"^[ \t]*С уважением", re.IGNORECASE | re.MULTILINE)
+_QUOTES = "\"'«»“”„"
+# Переписанный фрагмент может быть длиннее исходного («добавь срок», «разверни»)
+SECTION_OUTPUT_FACTOR = 3
+SECTION_MIN_OUTPUT_TOKENS = 100
+
+
+def signature_start(body: str) -> int:
+    """Offset where the signature of the draft starts (len(body) if there is none)."""
+    matches = list(_SIGNATURE_LINE.finditer(body))
+    return matches[-1].start() if matches else len(body)
+
+
+def _clean_fragment(text: str, is_subject: bool) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.strip("`").strip()
+    if is_subject:
+        text = re.sub(r"^Тема:\s*", "", text)
+        text = " ".join(text.split())
+    if len(text) > 1 and text[0] in _QUOTES and text[-1] in _QUOTES:
+        text = text[1:-1].strip()
+    return text
+
+
+def _section_output_cap(fragment: str) -> int | None:
+    if not get_settings().llm_output_caps_enabled:
+        return None
+    return max(SECTION_MIN_OUTPUT_TOKENS, estimate_tokens(fragment) * SECTION_OUTPUT_FACTOR)
+
+
+async def rewrite_section(
+    service,
+    subject: str,
+    body: str,
+    target: str,
+    start: int | None,
+    end: int | None,
+    instruction: str,
+    deadline: Deadline | None = None,
+) -> SectionRegenerationResponse:
+    """Rewrite ``body[start:end]`` (or the subject) by ``instruction``; the rest is kept as is.
+
+    ``service`` is anything with ``_make_request`` (LLMService). The span must
+    not reach into the signature. Whitespace around the span is preserved, so
+    everything outside the span stays byte-for-byte identical. Raises
+    ValueError for a bad span or an empty answer.
+    """
+    signature_at = signature_start(body)
+    letter_text = body[:signature_at].rstrip()
+    is_subject = target == "subject"
+    if is_subject:
+        fragment = subject
+    else:
+        if not 0 <= start < end <= len(body):
+            raise ValueError(f"Фрагмент {start}:{end} вне текста письма (длина {len(body)})")
+        if end > signature_at:
+            raise ValueError("Фрагмент захватывает подпись: подпись собирается локально и не переписывается")
+        fragment = body[start:end]
+        if not fragment.strip():
+            raise ValueError("Фрагмент пустой")
+
+    messages = build_section_messages(subject, letter_text, fragment.strip(), instruction, is_subject=is_subject)
+    raw_text = await service._make_request(
+        messages,
+        temperature=0.4,
+        deadline=deadline,
+        model_tier=get_model_router().for_generation("short", estimate_messages_tokens(messages)),
+        max_output_tokens=_section_output_cap(fragment),
+    )
+    new_fragment = _clean_fragment(raw_text, is_subject)
+    if not new_fragment:
+        raise ValueError("Модель вернула пустой фрагмент")
+
+    if is_subject:
+        return SectionRegenerationResponse(subject=new_fragment, body=body, start=0, end=len(new_fragment))
+
+    leading = fragment[: len(fragment) - len(fragment.lstrip())]
+    trailing = fragment[len(fragment.rstrip()):]
+    new_start = start + len(leading)
+    new_body = body[:new_start] + new_fragment + trailing + body[end:]
+    return SectionRegenerationResponse(
+        subject=subject, body=new_body, start=new_start, end=new_start + len(new_fragment)
+    )
@@ -0,0 +1,121 @@
+"""Single-flight coalescing of identical in-flight LLM calls."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+from ..config import get_settings
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and shares its result.
+
+    Inside a process, concurrent callers with the same key await one task.
+    Across uvicorn workers, a short-lived Redis lock marks the key as being
+    computed; other workers poll the cache until the result appears instead of
+    calling the LLM again. Keys are cache fingerprints from CacheService, so the
+    leader's cache write is exactly what the followers read. The Redis client
+    is synchronous, so lock and cache calls run in a worker thread.
+    """
+
+    def __init__(
+        self,
+        cache: Any = None,
+        lock_ttl_seconds: float = 120.0,
+        wait_timeout_seconds: float = 90.0,
+        poll_interval_seconds: float = 0.25,
+    ) -> None:
+        self._cache = cache
+        self._lock_ttl = lock_ttl_seconds
+        self._wait_timeout = wait_timeout_seconds
+        self._poll_interval = poll_interval_seconds
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    async def run(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[T]],
+        load_shared: Optional[Callable[[], Optional[T]]] = None,
+    ) -> T:
+        """Return compute() for key, joining an identical call that is already running.
+
+        load_shared reads the result another worker stored (normally a cache lookup).
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._lead(key, compute, load_shared))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _task: self._forget(key, _task))
+        else:
+            print(f"[SINGLE-FLIGHT] Joined in-flight call: {key}")
+        # shield: if this caller disconnects, the others still get the result
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved when no caller is left
+
+    def _distributed(self) -> bool:
+        return self._cache is not None and self._cache.is_enabled()
+
+    async def _lead(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[T]],
+        load_shared: Optional[Callable[[], Optional[T]]],
+    ) -> T:
+        if not self._distributed():
+            return await compute()
+
+        token = await asyncio.to_thread(self._cache.acquire_lock, key, self._lock_ttl)
+        if token is None and load_shared is not None:
+            shared = await self._wait_for_other_worker(key, load_shared)
+            if shared is not None:
+                return shared
+            token = await asyncio.to_thread(self._cache.acquire_lock, key, self._lock_ttl)
+
+        try:
+            return await compute()
+        finally:
+            if token is not None:
+                await asyncio.to_thread(self._cache.release_lock, key, token)
+
+    async def _wait_for_other_worker(
+        self, key: str, load_shared: Callable[[], Optional[T]]
+    ) -> Optional[T]:
+        """Poll for the result of another worker until its lock is released or we time out."""
+        print(f"[SINGLE-FLIGHT] Waiting for another worker: {key}")
+        deadline = time.monotonic() + self._wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self._poll_interval)
+            shared = await asyncio.to_thread(load_shared)
+            if shared is not None:
+                return shared
+            if not await asyncio.to_thread(self._cache.is_locked, key):
+                # The other worker finished without a cacheable result (or died)
+                return await asyncio.to_thread(load_shared)
+        print(f"[SINGLE-FLIGHT] Timed out waiting for another worker: {key}")
+        return None
+
+
+# Singleton instance
+_single_flight = None
+
+def get_single_flight() -> SingleFlight:
+    """Get singleton single-flight coordinator."""
+    global _single_flight
+    if _single_flight is None:
+        from .cache_service import get_cache_service
+        settings = get_settings()
+        _single_flight = SingleFlight(
+            cache=get_cache_service(),
+            lock_ttl_seconds=settings.single_flight_lock_ttl_seconds,
+            wait_timeout_seconds=settings.single_flight_wait_timeout_seconds,
+        )
+    return _single_flight
@@ -0,0 +1,174 @@
+"""Speculative drafts: the reply is generated right after the analysis, before it is asked for."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+from ..config import get_settings
+from ..models import DetailedEmailAnalysis, EmailGenerationRequest
+
+
+@dataclass
+class _Speculation:
+    generation_key: str
+    task: asyncio.Task
+    started: float = field(default_factory=time.monotonic)
+
+
+class SpeculativeDrafts:
+    """Background drafts for letters that were just analyzed, one per letter.
+
+    After /analyze-detailed the operator usually accepts the suggested
+    parameters and clicks "generate". The draft for exactly those parameters is
+    started in the background; /generate with the same parameters takes it
+    (awaiting the running call if needed) instead of calling the model. If the
+    operator changed anything, the speculation is cancelled and the draft is
+    discarded.
+
+    The stored draft is the raw model answer: the analysis does not know who
+    signs the letter, so the signature is attached from the /generate request.
+    """
+
+    def __init__(self, ttl_seconds: float = 900.0, max_entries: int = 1000) -> None:
+        self._ttl = ttl_seconds
+        self._max_entries = max_entries
+        self._entries: "OrderedDict[tuple, _Speculation]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def start(self, letter_key: tuple, generation_key: str, generate: Callable[[], Awaitable[str]]) -> None:
+        """Start generating the draft for ``generation_key`` unless it is already there."""
+        current = self._entries.pop(letter_key, None)
+        if current is not None:
+            if current.generation_key == generation_key and not self._expired(current):
+                self._entries[letter_key] = current
+                return
+            current.task.cancel()
+
+        task = asyncio.ensure_future(self._run(generation_key, generate))
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._entries[letter_key] = _Speculation(generation_key, task)
+        while len(self._entries) > self._max_entries:
+            _, oldest = self._entries.popitem(last=False)
+            oldest.task.cancel()
+
+    async def _run(self, generation_key: str, generate: Callable[[], Awaitable[str]]) -> str:
+        try:
+            text = await generate()
+        except asyncio.CancelledError:
+            print(f"[SPECULATIVE] Черновик отменён: {generation_key}")
+            raise
+        except Exception as e:
+            print(f"[SPECULATIVE] Черновик не сгенерирован: {e}")
+            raise
+        from .cache_service import get_cache_service
+        cache = get_cache_service()
+        if cache.is_enabled():
+            await asyncio.to_thread(cache.set_draft, generation_key, text, self._ttl)
+        return text
+
+    async def take(self, letter_key: tuple, generation_key: str) -> Optional[str]:
+        """Raw draft for the request, or None if it has to be generated as usual.
+
+        A speculation for the same letter with other parameters is cancelled.
+        """
+        speculation = self._entries.pop(letter_key, None)
+        if speculation is not None and (speculation.generation_key != generation_key or self._expired(speculation)):
+            print(f"[SPECULATIVE] Черновик отброшен (параметры изменены или он устарел): {speculation.generation_key}")
+            speculation.task.cancel()
+            speculation = None
+
+        if speculation is not None and not speculation.task.cancelled():
+            try:
+                text = await asyncio.shield(speculation.task)
+                print(f"[SPECULATIVE] Использован черновик: {generation_key}")
+                return text
+            except asyncio.CancelledError:
+                if not speculation.task.cancelled():
+                    raise  # отменили нас, а не черновик
+            except Exception:
+                pass
+
+        from .cache_service import get_cache_service
+        cache = get_cache_service()
+        if cache.is_enabled():
+            # черновик, начатый другим воркером (клиент Redis синхронный — не в event loop)
+            return await asyncio.to_thread(cache.get_draft, generation_key)
+        return None
+
+    def _expired(self, speculation: _Speculation) -> bool:
+        return time.monotonic() - speculation.started > self._ttl
+
+
+def letter_key(payload: EmailGenerationRequest) -> tuple:
+    """Identity of the letter being answered, independent of the reply parameters."""
+    return (payload.source_subject.strip(), payload.source_body.strip(), (payload.company_context or "").strip())
+
+
+def speculative_request(
+    subject: str, body: str, company_context: str, analysis: DetailedEmailAnalysis
+) -> tuple[EmailGenerationRequest, Optional[str]]:
+    """The /generate request the operator sends if they accept the analysis as is.
+
+    Mirrors the preparation in /generate for a letter without thread history:
+    the recipient is extracted from the letter and ``full_name`` falls back to
+    ``vy`` without one. Returns the request and the recipient name.
+    """
+    from .recipient_extractor import format_recipient_name
+
+    parameters = analysis.parameters.model_copy(deep=True)
+    recipient_name = format_recipient_name(subject, body)
+    if parameters.address_style == "full_name" and not recipient_name:
+        parameters.address_style = "vy"
+    request = EmailGenerationRequest(
+        source_subject=subject,
+        source_body=body,
+        company_context=company_context,
+        custom_prompt=f"Имя получателя (адресата): {recipient_name}" if recipient_name else None,
+        parameters=parameters,
+    )
+    return request, recipient_name
+
+
+async def speculate(
+    service, subject: str, body: str, company_context: str, analysis: DetailedEmailAnalysis
+) -> bool:
+    """Start the draft for an analysis result (SPECULATIVE_DRAFTS_ENABLED); True if started.
+
+    ``service`` is the LLM service /generate uses. The draft prompt includes
+    the analysis, so it is keyed with it and only /generate with this
+    analysis_id takes it. Degraded analyses (the model is slow or down) and
+    letters already answered in the cache are skipped.
+    """
+    if not get_settings().speculative_drafts_enabled or analysis.degraded:
+        return False
+    from .cache_service import get_cache_service
+    from .yandex_gpt_client import _cached_draft, _generation_cache_args
+
+    request, recipient_name = speculative_request(subject, body, company_context, analysis)
+    cache = get_cache_service()
+    cache_args = _generation_cache_args(request, None, analysis)
+    if cache.is_enabled() and await asyncio.to_thread(_cached_draft, cache, cache_args):
+        return False
+    get_speculative_drafts().start(
+        letter_key(request),
+        cache.generation_key(*cache_args),
+        lambda: service.draft_text(request, recipient_name=recipient_name, analysis=analysis),
+    )
+    return True
+
+
+# Singleton instance
+_speculative_drafts: Optional[SpeculativeDrafts] = None
+
+def get_speculative_drafts() -> SpeculativeDrafts:
+    """Get singleton registry of speculative drafts."""
+    global _speculative_drafts
+    if _speculative_drafts is None:
+        _speculative_drafts = SpeculativeDrafts(ttl_seconds=get_settings().speculative_draft_ttl_seconds)
+    return _speculative_drafts
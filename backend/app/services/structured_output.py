@@ -0,0 +1,161 @@
+"""Structured (JSON) answers of the model: response formats and tolerant parsing."""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Optional, Sequence
+
+from pydantic import BaseModel
+
+_FENCE = re.compile(r"```(?:json)?\s*\n?(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+_WORD = re.compile(r"\w+")
+_LITERALS = {"True": "true", "False": "false", "None": "null"}
+# After a closing quote of a JSON string only these characters may follow
+_AFTER_STRING = set(",:}]")
+
+
+def json_schema_format(name: str, model: type[BaseModel], fields: Optional[Sequence[str]] = None) -> dict:
+    """``response_format`` asking the model for JSON matching ``model`` (optionally only ``fields``)."""
+    schema = model.model_json_schema()
+    if fields:
+        schema["properties"] = {key: value for key, value in schema["properties"].items() if key in fields}
+        schema["required"] = list(fields)
+    return {"type": "json_schema", "name": name, "schema": schema}
+
+
+def json_array_format(name: str, item_format: dict, key: str = "results") -> dict:
+    """``response_format`` for ``{key: [item, ...]}``, each item numbered by an ``index`` field."""
+    item = dict(item_format["schema"])
+    defs = item.pop("$defs", None)
+    item["properties"] = {"index": {"type": "integer"}, **item.get("properties", {})}
+    item["required"] = ["index", *item.get("required", [])]
+    schema: dict = {"type": "object", "properties": {key: {"type": "array", "items": item}}, "required": [key]}
+    if defs:
+        schema["$defs"] = defs  # ссылки "#/$defs/..." остаются верными только от корня схемы
+    return {"type": "json_schema", "name": name, "schema": schema}
+
+
+def json_object_format(name: str, parts: dict[str, dict]) -> dict:
+    """``response_format`` for an object whose fields are other ``json_schema`` formats."""
+    defs: dict = {}
+    properties: dict = {}
+    for key, part in parts.items():
+        schema = dict(part["schema"])
+        defs.update(schema.pop("$defs", None) or {})
+        properties[key] = schema
+    schema = {"type": "object", "properties": properties, "required": list(parts)}
+    if defs:
+        schema["$defs"] = defs
+    return {"type": "json_schema", "name": name, "schema": schema}
+
+
+def repair_json(raw: Any) -> Any:
+    """Parse JSON from a model answer, fixing the usual defects locally.
+
+    Handles markdown fences, prose around the JSON, single quotes, Python
+    literals, trailing commas, raw newlines and unescaped quotes inside
+    strings, and answers cut off by the output limit. Raises ValueError if
+    nothing usable is left, so the caller can fall back without a second call.
+    """
+    text = str(raw).strip()
+    fenced = _FENCE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+
+    start = next((i for i, ch in enumerate(text) if ch in "{["), None)
+    if start is None:
+        raise ValueError("В ответе модели нет JSON")
+
+    repaired, closers = _rewrite(text[start:])
+    last_error: Optional[json.JSONDecodeError] = None
+    # Обрезанный ответ: дописываем пропущенное значение и закрываем скобки
+    for tail in ("", "null", ": null"):
+        try:
+            return json.loads(repaired + tail + closers)
+        except json.JSONDecodeError as e:
+            last_error = e
+    raise ValueError(f"Не удалось восстановить JSON ответа модели: {last_error}")
+
+
+def _drop_trailing_comma(out: list[str]) -> None:
+    i = len(out) - 1
+    while i >= 0 and out[i].isspace():
+        i -= 1
+    if i >= 0 and out[i] == ",":
+        del out[i]
+
+
+def _closes_string(text: str, i: int) -> bool:
+    rest = text[i + 1:].lstrip()
+    return not rest or rest[0] in _AFTER_STRING
+
+
+def _rewrite(text: str) -> tuple[str, str]:
+    """Normalize one JSON value; return it and the brackets still open at the end."""
+    out: list[str] = []
+    stack: list[str] = []
+    quote: Optional[str] = None
+    escaped = False
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if quote:
+            if escaped:
+                if ch == "'":
+                    out[-1] = "'"  # \' is not a JSON escape
+                else:
+                    out.append(ch)
+                escaped = False
+            elif ch == "\\":
+                out.append(ch)
+                escaped = True
+            elif ch == quote and _closes_string(text, i):
+                out.append('"')
+                quote = None
+            elif ch == '"':
+                out.append('\\"')
+            elif ch == "\n":
+                out.append("\\n")
+            elif ch == "\r":
+                out.append("\\r")
+            elif ch == "\t":
+                out.append("\\t")
+            else:
+                out.append(ch)
+            i += 1
+            continue
+
+        if ch in "\"'":
+            quote = ch
+            out.append('"')
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+            out.append(ch)
+        elif ch in "}]":
+            _drop_trailing_comma(out)
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if not stack:
+                break  # конец значения, дальше текст модели
+        elif ch.isalpha():
+            word = _WORD.match(text, i).group(0)
+            out.append(_LITERALS.get(word, word))
+            i += len(word)
+            continue
+        else:
+            out.append(ch)
+        i += 1
+
+    if quote:
+        out.append('"')
+    if stack:
+        while out and out[-1].isspace():
+            out.pop()
+        _drop_trailing_comma(out)
+    return "".join(out), "".join(reversed(stack))
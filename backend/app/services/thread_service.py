@@ -105,7 +105,9 @@ class ThreadService:
         body: str,
         sender_name: Optional[str] = None,
         sender_position: Optional[str] = None,
-        generation_time_seconds: Optional[float] = None
+        generation_time_seconds: Optional[float] = None,
+        llm_response_id: Optional[str] = None,
+        llm_folder_id: Optional[str] = None
     ) -> EmailMessage:
         """Add message to thread."""
         message = EmailMessage(
@@ -115,13 +117,20 @@ class ThreadService:
             body=body,
             sender_name=sender_name,
             sender_position=sender_position,
-            generation_time_seconds=generation_time_seconds
+            generation_time_seconds=generation_time_seconds,
+            llm_response_id=llm_response_id,
+            llm_folder_id=llm_folder_id
         )
         db.add(message)
         db.commit()
         db.refresh(message)
         return message
     
+    @staticmethod
+    def get_message(db: Session, message_id: int) -> Optional[EmailMessage]:
+        """Get message by ID."""
+        return db.query(EmailMessage).filter(EmailMessage.id == message_id).first()
+    
     @staticmethod
     def get_thread_history(db: Session, thread_id: int) -> List[EmailMessage]:
         """Get all messages in thread ordered by creation time."""
@@ -2,15 +2,41 @@
 
 from __future__ import annotations
 
+import asyncio
 import json
 import re
+import time
 
 import httpx
 
 from ..config import get_settings
-from ..models import EmailGenerationRequest, EmailGenerationResponse, EmailParameters
-from .prompt_builder import build_messages
-from .department_detector import detect_department_by_keywords, get_department_instruction
+from ..models import (
+    DetailedEmailAnalysis,
+    EmailGenerationRequest,
+    EmailGenerationResponse,
+    EmailParameters,
+    PromptPreviewResponse,
+)
+from .http_client import get_async_http_client
+from .circuit_breaker import CircuitBreaker, get_circuit_breaker
+from .conversation_chain import current_chain, record_response_folder, record_response_id
+from .credential_pool import CredentialPool, YandexCredential, get_credential_pool
+from .latency_budget import Deadline, LatencyBudgetExceeded, run_within
+from .latency_tracker import get_latency_tracker
+from .llm_cassette import CassetteMiss, get_llm_cassette
+from .model_router import FAST, get_model_router
+from .llm_metrics import record_llm_call
+from .prompt_builder import (
+    LETTER_PROMPT_VERSION,
+    build_messages,
+    estimate_messages_tokens,
+    letter_output_tokens,
+    letter_template,
+)
+from .rate_limiter import RateLimiter, RateLimitExceeded, get_rate_limiter
+from .retry_policy import RetryPolicy, RetryState, is_ssl_error, parse_retry_after
+from .single_flight import get_single_flight
+from .structured_output import json_schema_format, repair_json
 
 
 def _collapse_whitespace(value: str) -> str:
@@ -209,236 +235,213 @@ def _extract_subject_and_body(raw_text: str) -> tuple[str, str]:
     return subject, body
 
 
-class YandexGPTService:
-    """YandexGPT API client using Responses API."""
+def _has_sender_data(payload: EmailGenerationRequest) -> bool:
+    return bool(payload.sender_last_name or payload.sender_first_name or
+                payload.sender_position or payload.sender_email or
+                payload.sender_phone_work or payload.sender_phone_mobile)
 
-    def __init__(self, api_key: str | None = None, folder_id: str | None = None) -> None:
-        settings = get_settings()
-        self._api_key = api_key or settings.yandex_api_key
-        self._folder_id = folder_id or settings.yandex_folder_id
-        self._model = settings.yandex_model
-        self._api_url = "https://rest-assistant.api.cloud.yandex.net/v1/responses"
 
-    def _make_request(self, messages: list[dict[str, str]], temperature: float = 0.4, response_format: dict | None = None) -> str:
-        """Make request to YandexGPT Responses API."""
-        system_message = None
-        user_messages = []
+def _local_signature(payload: EmailGenerationRequest) -> bool:
+    """Промпт без данных подписанта и правил подписи: подпись целиком добавляет _attach_signature."""
+    return get_settings().prompt_local_signature and _has_sender_data(payload)
 
-        for msg in messages:
-            if msg["role"] == "system":
-                system_message = msg["content"]
-            else:
-                user_messages.append(msg["content"])
 
-        instructions = system_message or "Ты полезный ассистент."
-        input_text = "\n\n".join(user_messages)
+_SIGNATURE_LINE = re.compile(r'^(С уважением|С уважением,|С уважением:)', re.IGNORECASE)
+_ROUTING_LINE = re.compile(r'^направить в ', re.IGNORECASE)
+_HELD_PREFIXES = ("с уважением", "направить в ")
 
-        model_uri = f"gpt://{self._folder_id}/{self._model}"
-        
-        headers = {
-            "Authorization": f"Api-Key {self._api_key}",
-            "x-folder-id": self._folder_id,
-            "Content-Type": "application/json",
-        }
-        
-        payload = {
-            "model": model_uri,
-            "instructions": instructions,
-            "input": input_text,
-        }
-        
-        # Retry логика для обработки SSL ошибок
-        max_retries = 3
-        retry_delay = 2.0
-        
-        for attempt in range(max_retries):
-            try:
-                # Настройка клиента с улучшенной обработкой SSL и таймаутов
-                timeout = httpx.Timeout(90.0, connect=15.0, read=60.0)
-                with httpx.Client(
-                    timeout=timeout,
-                    verify=True,
-                    follow_redirects=True,
-                    limits=httpx.Limits(max_keepalive_connections=5, max_connections=10)
-                ) as client:
-                    response = client.post(self._api_url, headers=headers, json=payload)
-                    response.raise_for_status()
-                    result = response.json()
-                    
-                    if result.get("status") == "failed" or result.get("error"):
-                        error_msg = result.get("error", {}).get("message", "Unknown error")
-                        error_code = result.get("error", {}).get("code", "")
-                        if "Failed to get model" in error_msg or error_code == "model_call_error":
-                            raise RuntimeError(
-                                f"Модель '{self._model}' недоступна в вашем каталоге. "
-                                f"Проверьте:\n"
-                                f"1. Что модель активирована в консоли Яндекс.Облака\n"
-                                f"2. Что у вас есть доступ к модели в каталоге {self._folder_id}\n"
-                                f"3. Попробуйте другую модель, например: qwen3-235b-a22b-fp8/latest или yandexgpt/latest"
-                            )
-                        raise RuntimeError(f"YandexGPT API error: {error_msg}")
-                    
-                    output_text = result.get("output_text")
-                    if output_text:
-                        return output_text.strip()
-                    
-                    output = result.get("output")
-                    if output and isinstance(output, list):
-                        texts = []
-                        for msg in output:
-                            if isinstance(msg, dict) and "content" in msg:
-                                for content_item in msg["content"]:
-                                    if isinstance(content_item, dict) and "text" in content_item:
-                                        texts.append(content_item["text"])
-                        if texts:
-                            return "\n".join(texts).strip()
-                    
-                    text = result.get("text")
-                    if text:
-                        return str(text).strip()
-                    
-                    raise RuntimeError(f"Empty response from YandexGPT API. Full response: {result}")
-                    
-            except (httpx.ConnectError, httpx.ReadTimeout, httpx.ConnectTimeout) as e:
-                if attempt < max_retries - 1:
-                    import time
-                    print(f"[YandexGPT] Попытка {attempt + 1} не удалась: {e}. Повтор через {retry_delay} сек...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Экспоненциальная задержка
-                    continue
-                else:
-                    raise RuntimeError(f"YandexGPT API connection error после {max_retries} попыток: {e}")
-            except httpx.HTTPStatusError as e:
-                error_detail = ""
-                try:
-                    error_detail = e.response.json()
-                except:
-                    error_detail = e.response.text
-                raise RuntimeError(f"YandexGPT API HTTP error {e.response.status_code}: {error_detail}") from e
-            except Exception as e:
-                # Проверяем, является ли это SSL ошибкой
-                error_str = str(e).lower()
-                if "ssl" in error_str or "eof" in error_str or "protocol" in error_str:
-                    if attempt < max_retries - 1:
-                        import time
-                        print(f"[YandexGPT] SSL ошибка на попытке {attempt + 1}: {e}. Повтор через {retry_delay} сек...")
-                        time.sleep(retry_delay)
-                        retry_delay *= 2
-                        continue
-                    else:
-                        raise RuntimeError(
-                            f"YandexGPT API SSL error после {max_retries} попыток: {e}. "
-                            f"Возможные причины: проблемы с сетью, прокси или SSL сертификатами."
-                        ) from e
-                raise RuntimeError(f"YandexGPT API error: {e}") from e
-
-    def generate_letter(self, payload: EmailGenerationRequest, thread_history: str = None, recipient_name: str = None) -> EmailGenerationResponse:
-        """Генерирует письмо на основе запроса. Использует кэширование для ускорения."""
-        import hashlib
-        import json
-        
-        # Try to get from cache
-        from .cache_service import get_cache_service
-        cache = get_cache_service()
-        
-        # Create hash of parameters for cache key
-        params_dict = payload.parameters.model_dump() if payload.parameters else {}
-        params_hash = hashlib.sha256(
-            json.dumps(params_dict, sort_keys=True).encode('utf-8')
-        ).hexdigest()[:16]
-        
-        # Check cache
-        if cache.is_enabled():
-            cached_result = cache.get_generation(
-                payload.source_subject,
-                payload.source_body,
-                payload.company_context or "",
-                params_hash,
-                thread_history,
-                payload.parameters.extra_directives if payload.parameters else None,
-                payload.custom_prompt
-            )
-            if cached_result:
-                return EmailGenerationResponse(**cached_result)
-        
-        # Определяем отдел банка на основе содержания письма
-        department = detect_department_by_keywords(
-            payload.source_subject,
-            payload.source_body
+
+class _LetterStreamParser:
+    """Инкрементальная версия _extract_subject_and_body для потока токенов.
+
+    Принимает куски текста модели и возвращает события ("subject", текст) и
+    ("delta", текст). Строки "Направить в ..." выбрасываются, ведущие и
+    висячие пустые строки не отдаются, а если подпись собирается локально,
+    всё, начиная с "С уважением", отбрасывается.
+    """
+
+    def __init__(self, cut_signature: bool) -> None:
+        self._cut_signature = cut_signature
+        self._in_body = False
+        self._stopped = False
+        self._line = ""
+        self._line_emitted = 0
+        self._pending_blank_lines = 0
+        self._body_started = False
+        self.subject: str | None = None
+
+    def feed(self, chunk: str) -> list[tuple[str, str]]:
+        events: list[tuple[str, str]] = []
+        if self._stopped:
+            return events
+        self._line += chunk
+        while "\n" in self._line and not self._stopped:
+            line, self._line = self._line.split("\n", 1)
+            self._complete_line(line, events)
+            self._line_emitted = 0
+        if not self._stopped and self._in_body:
+            self._emit_partial(events)
+        return events
+
+    def finish(self) -> list[tuple[str, str]]:
+        events: list[tuple[str, str]] = []
+        if not self._stopped and self._line:
+            self._complete_line(self._line, events)
+        self._line = ""
+        self._stopped = True
+        return events
+
+    def _complete_line(self, line: str, events: list[tuple[str, str]]) -> None:
+        stripped = line.strip()
+        if not self._in_body:
+            if not stripped:
+                return
+            if stripped.startswith("Тема:") and self.subject is None:
+                self.subject = _collapse_whitespace(stripped[len("Тема:"):])
+                events.append(("subject", self.subject))
+                return
+            self._in_body = True
+            if stripped.startswith("Тело:"):
+                line = stripped[len("Тело:"):]
+                if not line.strip():
+                    return
+        if self._is_held_line(line):
+            return
+        self._emit_partial(events, line=line, final=True)
+        self._line_emitted = 0
+
+    def _is_held_line(self, line: str) -> bool:
+        stripped = line.strip()
+        if _ROUTING_LINE.match(stripped):
+            return True
+        if self._cut_signature and _SIGNATURE_LINE.match(stripped):
+            self._stopped = True
+            return True
+        return False
+
+    def _emit_partial(self, events: list[tuple[str, str]], line: str | None = None, final: bool = False) -> None:
+        text = self._line if line is None else line
+        cleaned = re.sub(r"\s+", " ", text.strip())
+        if not final and cleaned.lower().startswith(_HELD_PREFIXES):
+            return
+        if not final and any(prefix.startswith(cleaned.lower()) for prefix in _HELD_PREFIXES):
+            # Возможно, это начало подписи или строки маршрутизации: ждём продолжения
+            return
+        if not cleaned:
+            if final and self._body_started:
+                self._pending_blank_lines += 1
+            return
+
+        piece = cleaned[self._line_emitted:]
+        if self._line_emitted == 0 and self._body_started:
+            piece = "\n" * (1 + self._pending_blank_lines) + piece
+            self._pending_blank_lines = 0
+        if piece:
+            events.append(("delta", piece))
+        self._body_started = True
+        self._line_emitted = len(cleaned)
+
+
+def _attach_signature(payload: EmailGenerationRequest, body: str) -> str:
+    """Заменяет подпись, написанную моделью, на подпись из данных отправителя."""
+    if not _has_sender_data(payload):
+        return body
+
+    # Удаляем существующую подпись из body, если она есть
+    signature_pattern = re.compile(r'^\s*(С уважением|С уважением,|С уважением:)', re.IGNORECASE | re.MULTILINE)
+
+    lines = body.split('\n')
+    last_signature_idx = None
+
+    # Ищем подпись с конца
+    for i in range(len(lines) - 1, -1, -1):
+        if signature_pattern.match(lines[i].strip()):
+            last_signature_idx = i
+            break
+
+    # Удаляем старую подпись, если найдена
+    if last_signature_idx is not None:
+        # Удаляем подпись и все пустые строки перед ней (но оставляем хотя бы одну, если есть текст)
+        body_lines = lines[:last_signature_idx]
+        # Убираем пустые строки в конце перед подписью
+        while body_lines and not body_lines[-1].strip():
+            body_lines.pop()
+        body = '\n'.join(body_lines).rstrip()
+
+    # Формируем подпись
+    signature = _build_signature(payload)
+
+    # Вставляем подпись внутрь основного текста письма
+    # Убираем лишние пробелы и пустые строки в конце основного текста
+    body = body.rstrip()
+
+    # Добавляем подпись как часть основного текста письма
+    if body.strip():
+        # Гарантируем ровно две пустые строки перед подписью для разделения
+        return body.rstrip() + "\n\n" + signature
+    return signature
+
+
+def _finalize_letter(payload: EmailGenerationRequest, raw_text: str) -> EmailGenerationResponse:
+    """Превращает сырой ответ модели в тему и тело письма с подписью."""
+    subject, body = _extract_subject_and_body(raw_text)
+    return EmailGenerationResponse(subject=subject, body=_attach_signature(payload, body))
+
+
+def _generation_cache_args(
+    payload: EmailGenerationRequest, thread_history: str | None, analysis: DetailedEmailAnalysis | None = None
+) -> tuple:
+    """Аргументы ключа кэша генерации (порядок как в CacheService.get_generation).
+
+    Результаты анализа (analysis_id) входят в промпт, поэтому и в ключ.
+    """
+    import hashlib
+
+    # Create hash of parameters for cache key (with the prompt version: a new template means new letters)
+    params_dict = payload.parameters.model_dump() if payload.parameters else {}
+    params_dict["prompt_version"] = LETTER_PROMPT_VERSION
+    if analysis is not None:
+        params_dict["analysis"] = analysis.model_dump(mode="json", exclude={"analysis_id"})
+    params_hash = hashlib.sha256(
+        json.dumps(params_dict, sort_keys=True).encode('utf-8')
+    ).hexdigest()[:16]
+    return (
+        payload.source_subject,
+        payload.source_body,
+        payload.company_context or "",
+        params_hash,
+        thread_history,
+        payload.parameters.extra_directives if payload.parameters else None,
+        payload.custom_prompt,
+    )
+
+
+def _cached_draft(cache, cache_args: tuple) -> str | None:
+    """Сырой ответ модели из кэша генерации: подпись добавляет каждый вызывающий сам."""
+    cached = cache.get_generation(*cache_args)
+    return cached.get("draft") if isinstance(cached, dict) else None
+
+
+def _cache_generation(cache, cache_args: tuple, raw_text: str) -> None:
+    """Кэширует ответ модели без подписи: ключ не зависит от данных подписанта."""
+    subject, body, context, params_hash, thread_history, extra_directives, custom_prompt = cache_args
+    try:
+        cache.set_generation(
+            subject,
+            body,
+            context,
+            params_hash,
+            {"draft": raw_text},
+            thread_history,
+            extra_directives,
+            custom_prompt
         )
-        
-        # Формируем промпт с информацией об отделе и историей переписки
-        messages = build_messages(payload, department=department, thread_history=thread_history, recipient_name=recipient_name)
-        raw_text = self._make_request(messages, temperature=0.4)
-        subject, body = _extract_subject_and_body(raw_text)
-
-        # Вставляем подпись внутрь основного текста письма
-        if (payload.sender_last_name or payload.sender_first_name or 
-            payload.sender_position or payload.sender_email or 
-            payload.sender_phone_work or payload.sender_phone_mobile):
-            # Удаляем существующую подпись из body, если она есть
-            signature_pattern = re.compile(r'^\s*(С уважением|С уважением,|С уважением:)', re.IGNORECASE | re.MULTILINE)
-            
-            lines = body.split('\n')
-            last_signature_idx = None
-            
-            # Ищем подпись с конца
-            for i in range(len(lines) - 1, -1, -1):
-                if signature_pattern.match(lines[i].strip()):
-                    last_signature_idx = i
-                    break
-            
-            # Удаляем старую подпись, если найдена
-            if last_signature_idx is not None:
-                # Удаляем подпись и все пустые строки перед ней (но оставляем хотя бы одну, если есть текст)
-                body_lines = lines[:last_signature_idx]
-                # Убираем пустые строки в конце перед подписью
-                while body_lines and not body_lines[-1].strip():
-                    body_lines.pop()
-                body = '\n'.join(body_lines).rstrip()
-            
-            # Формируем подпись
-            signature = _build_signature(payload)
-            
-            # Вставляем подпись внутрь основного текста письма
-            # Убираем лишние пробелы и пустые строки в конце основного текста
-            body = body.rstrip()
-            
-            # Добавляем подпись как часть основного текста письма
-            if body.strip():
-                # Гарантируем ровно две пустые строки перед подписью для разделения
-                # Убираем все пустые строки в конце и добавляем ровно две
-                body = body.rstrip() + "\n\n" + signature
-            else:
-                body = signature
+    except Exception as e:
+        print(f"[CACHE] Error caching generation result: {e}")
 
-        result = EmailGenerationResponse(subject=subject, body=body)
-        
-        # Cache the result
-        if cache.is_enabled():
-            try:
-                cache.set_generation(
-                    payload.source_subject,
-                    payload.source_body,
-                    payload.company_context or "",
-                    params_hash,
-                    result.model_dump(),
-                    thread_history,
-                    payload.parameters.extra_directives if payload.parameters else None,
-                    payload.custom_prompt
-                )
-            except Exception as e:
-                print(f"[CACHE] Error caching generation result: {e}")
-        
-        return result
 
-    def analyze_email_parameters(
-        self, subject: str, body: str, company_context: str
-    ) -> EmailParameters:
-        """
-        Анализирует входящее письмо и определяет оптимальные параметры для ответа.
-        """
-        analysis_prompt = f"""Проанализируй входящее письмо и определи оптимальные параметры для ответа.
+def _build_parameters_messages(subject: str, body: str, company_context: str) -> list[dict[str, str]]:
+    analysis_prompt = f"""Проанализируй входящее письмо и определи оптимальные параметры для ответа.
 
 Входящее письмо:
 Тема: {subject}
@@ -468,39 +471,974 @@ class YandexGPTService:
 - urgency: "low" | "normal" | "high"
 - address_style: "vy" | "ty" | "full_name"
 """
+    return [
+        {
+            "role": "system",
+            "content": "Ты эксперт по деловой переписке. Отвечай только валидным JSON.",
+        },
+        {"role": "user", "content": analysis_prompt},
+    ]
+
+
+_PARAMETERS_FORMAT = json_schema_format("email_parameters", EmailParameters)
+
+
+def _parse_parameters(raw_json) -> EmailParameters:
+    params_dict = repair_json(raw_json)
+    if not isinstance(params_dict, dict):
+        raise ValueError(f"Ожидался JSON-объект параметров, получено: {type(params_dict).__name__}")
+    return EmailParameters(**params_dict)
+
+
+def _generation_tier(payload: EmailGenerationRequest, messages: list[dict[str, str]]) -> str:
+    """Model tier for a letter: by requested length and by prompt size."""
+    length = payload.parameters.length if payload.parameters else None
+    return get_model_router().for_generation(length, estimate_messages_tokens(messages))
+
+
+def output_token_cap(task: str, length: str | None = None) -> int | None:
+    """max_output_tokens for a task: "letter" (by length), "analysis" or "parameters"; None if caps are off."""
+    settings = get_settings()
+    if not settings.llm_output_caps_enabled:
+        return None
+    if task == "analysis":
+        return settings.llm_max_output_tokens_analysis
+    if task == "parameters":
+        return settings.llm_max_output_tokens_parameters
+    return letter_output_tokens(length or "medium")
+
+
+def _letter_output_cap(payload: EmailGenerationRequest) -> int | None:
+    return output_token_cap("letter", payload.parameters.length if payload.parameters else None)
+
+
+_THINK_BLOCK = re.compile(r"^\s*<think>.*?(?:</think>|$)\s*", re.DOTALL)
+
+
+def _strip_reasoning(text: str) -> str:
+    """Drop a leading <think>...</think> block (Qwen3 reasoning) from the answer."""
+    return _THINK_BLOCK.sub("", text, count=1)
+
+
+async def _skip_reasoning(deltas):
+    """Stream counterpart of _strip_reasoning: hold output until it is clear there is no think block."""
+    buffer = ""
+    passthrough = False
+    async for delta in deltas:
+        if passthrough:
+            yield delta
+            continue
+        buffer += delta
+        stripped = buffer.lstrip()
+        if stripped.startswith("<think>"):
+            end = stripped.find("</think>")
+            if end == -1:
+                continue
+            rest = stripped[end + len("</think>"):].lstrip()
+        elif "<think>".startswith(stripped):
+            continue
+        else:
+            rest = buffer
+        passthrough = True
+        if rest:
+            yield rest
+    if not passthrough and buffer and not buffer.lstrip().startswith("<think>"):
+        yield buffer
 
+
+def _default_parameters() -> EmailParameters:
+    return EmailParameters(
+        tone="formal",
+        purpose="response",
+        length="medium",
+        audience="colleague",
+        urgency="normal",
+        address_style="vy",
+        include_formal_greetings=True,
+        include_greeting_and_signoff=True,
+        include_corporate_phrases=True,
+    )
+
+
+def _is_upstream_failure(error: Exception) -> bool:
+    """Errors that say the upstream is unhealthy (not quota or a bad request)."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (httpx.TransportError, RuntimeError)) and not isinstance(error, CassetteMiss)
+
+
+async def _iter_sse_events(response: httpx.Response):
+    """Разбирает поток server-sent events Responses API в JSON-события."""
+    data_lines: list[str] = []
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            data_lines.append(line[len("data:"):].strip())
+            continue
+        if line.strip() or not data_lines:
+            continue
+        data = "\n".join(data_lines)
+        data_lines = []
+        if data == "[DONE]":
+            return
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            print(f"[YandexGPT] Некорректное событие потока: {data[:200]}")
+    if data_lines and data_lines != ["[DONE]"]:
         try:
-            raw_json = self._make_request(
-                [
-                    {
-                        "role": "system",
-                        "content": "Ты эксперт по деловой переписке. Отвечай только валидным JSON.",
-                    },
-                    {"role": "user", "content": analysis_prompt},
-                ],
-                temperature=0.3,
-                response_format={"type": "json_object"},
+            yield json.loads("\n".join(data_lines))
+        except json.JSONDecodeError:
+            pass
+
+
+class AsyncLetterOperations:
+    """Письма и анализ параметров поверх ``_make_request``/``_stream_request``.
+
+    Общая часть AsyncYandexGPTService и LLMService (цепочки бэкендов): подклассу
+    достаточно реализовать эти два примитива.
+    """
+
+    def letter_messages(
+        self,
+        payload: EmailGenerationRequest,
+        thread_history: str = None,
+        recipient_name: str = None,
+        analysis: DetailedEmailAnalysis | None = None,
+    ) -> list[dict[str, str]]:
+        """Промпт генерации письма (тот же для /generate, потока и черновика заранее)."""
+        return build_messages(
+            payload,
+            thread_history=thread_history,
+            recipient_name=recipient_name,
+            analysis=analysis,
+            local_signature=_local_signature(payload),
+        )
+
+    def preview_letter(
+        self,
+        payload: EmailGenerationRequest,
+        thread_history: str = None,
+        recipient_name: str = None,
+        analysis: DetailedEmailAnalysis | None = None,
+    ) -> PromptPreviewResponse:
+        """Промпт, оценка токенов и выбранная модель — без вызова модели."""
+        messages = self.letter_messages(payload, thread_history, recipient_name, analysis)
+        template = letter_template(_local_signature(payload))
+        return PromptPreviewResponse(
+            template=template.name,
+            template_version=template.version,
+            messages=messages,
+            estimated_input_tokens=estimate_messages_tokens(messages),
+            max_output_tokens=_letter_output_cap(payload),
+            model_tier=_generation_tier(payload, messages),
+        )
+
+    async def stream_letter(
+        self,
+        payload: EmailGenerationRequest,
+        thread_history: str = None,
+        recipient_name: str = None,
+        analysis: DetailedEmailAnalysis | None = None,
+    ):
+        """Генерирует письмо потоком событий ``(event, data)``.
+
+        События: ``subject`` как только тема разобрана, ``delta`` с очищенными
+        кусками тела, ``signature`` с локально собранной подписью и ``done`` с
+        итоговым письмом (тем же, что вернул бы generate_letter).
+        """
+        from .cache_service import get_cache_service
+        cache = get_cache_service()
+        cache_args = _generation_cache_args(payload, thread_history, analysis)
+
+        # Клиент Redis синхронный: чтение и запись кэша не держат event loop
+        cached_draft = await asyncio.to_thread(_cached_draft, cache, cache_args) if cache.is_enabled() else None
+        if cached_draft is not None:
+            cached_result = _finalize_letter(payload, cached_draft)
+            yield "subject", {"subject": cached_result.subject}
+            yield "delta", {"text": cached_result.body}
+            yield "done", cached_result.model_dump()
+            return
+
+        messages = self.letter_messages(payload, thread_history, recipient_name, analysis)
+
+        local_signature = _has_sender_data(payload)
+        parser = _LetterStreamParser(cut_signature=local_signature)
+        raw_parts: list[str] = []
+        async for chunk in self._stream_request(
+            messages,
+            temperature=0.4,
+            model_tier=_generation_tier(payload, messages),
+            max_output_tokens=_letter_output_cap(payload),
+        ):
+            raw_parts.append(chunk)
+            for event, text in parser.feed(chunk):
+                yield event, ({"subject": text} if event == "subject" else {"text": text})
+        for event, text in parser.finish():
+            yield event, ({"subject": text} if event == "subject" else {"text": text})
+
+        raw_text = "".join(raw_parts)
+        result = _finalize_letter(payload, raw_text)
+        if parser.subject is None:
+            yield "subject", {"subject": result.subject}
+        if local_signature:
+            yield "signature", {"text": "\n\n" + _build_signature(payload)}
+
+        if cache.is_enabled():
+            await asyncio.to_thread(_cache_generation, cache, cache_args, raw_text)
+
+        yield "done", result.model_dump()
+
+    async def generate_letter(
+        self,
+        payload: EmailGenerationRequest,
+        thread_history: str = None,
+        recipient_name: str = None,
+        deadline: Deadline | None = None,
+        analysis: DetailedEmailAnalysis | None = None,
+    ) -> EmailGenerationResponse:
+        """Генерирует письмо на основе запроса. Использует кэширование для ускорения.
+
+        ``analysis`` — результат /analyze-detailed (по analysis_id): отдел берётся
+        из него, а категория, сроки и требования добавляются в промпт.
+        Если задан deadline и модель не успевает, поднимается LatencyBudgetExceeded.
+        """
+        from .cache_service import get_cache_service
+        cache = get_cache_service()
+        cache_args = _generation_cache_args(payload, thread_history, analysis)
+
+        cached_draft = await asyncio.to_thread(_cached_draft, cache, cache_args) if cache.is_enabled() else None
+        if cached_draft is not None:
+            return _finalize_letter(payload, cached_draft)
+
+        async def compute(call_deadline: Deadline | None) -> str:
+            raw_text = None
+            if get_settings().speculative_drafts_enabled:
+                from .speculative_drafts import get_speculative_drafts, letter_key
+                raw_text = await get_speculative_drafts().take(letter_key(payload), cache.generation_key(*cache_args))
+            if raw_text is None:
+                raw_text = await self.draft_text(payload, thread_history, recipient_name, call_deadline, analysis)
+
+            if cache.is_enabled():
+                await asyncio.to_thread(_cache_generation, cache, cache_args, raw_text)
+            return raw_text
+
+        # Ответ в цепочке переписки должен получить свой response_id, а присоединившиеся
+        # к общему вызову получают только текст: такие запросы не объединяем.
+        if not get_settings().single_flight_enabled or current_chain() is not None:
+            return _finalize_letter(payload, await compute(deadline))
+
+        # Одинаковые запросы (двойной клик, массовая жалоба) ждут первый вызов модели.
+        # Общим является только ответ модели без подписи: ключ не включает данные
+        # подписанта, поэтому подпись каждый вызывающий добавляет из своего запроса.
+        # Общий вызов идёт без дедлайна: у присоединившихся может быть бюджет больше,
+        # а результат попадёт в кэш даже если этот вызывающий уже получил отказ.
+        raw_text = await run_within(deadline, get_single_flight().run(
+            cache.generation_key(*cache_args), lambda: compute(None), lambda: _cached_draft(cache, cache_args)
+        ))
+        return _finalize_letter(payload, raw_text)
+
+    async def draft_text(
+        self,
+        payload: EmailGenerationRequest,
+        thread_history: str = None,
+        recipient_name: str = None,
+        deadline: Deadline | None = None,
+        analysis: DetailedEmailAnalysis | None = None,
+    ) -> str:
+        """Сырой ответ модели на запрос генерации (без кэша и подписи)."""
+        messages = self.letter_messages(payload, thread_history, recipient_name, analysis)
+        return await self._make_request(
+            messages,
+            temperature=0.4,
+            deadline=deadline,
+            model_tier=_generation_tier(payload, messages),
+            max_output_tokens=_letter_output_cap(payload),
+        )
+
+    async def analyze_email_parameters(
+        self, subject: str, body: str, company_context: str, deadline: Deadline | None = None
+    ) -> EmailParameters:
+        """Анализирует входящее письмо и определяет оптимальные параметры для ответа."""
+        try:
+            messages = _build_parameters_messages(subject, body, company_context)
+            router = get_model_router()
+            tier = router.for_parameters(estimate_messages_tokens(messages))
+
+            async def ask(model_tier: str) -> str:
+                return await self._make_request(
+                    messages,
+                    temperature=0.3,
+                    response_format=_PARAMETERS_FORMAT,
+                    deadline=deadline,
+                    model_tier=model_tier,
+                    max_output_tokens=output_token_cap("parameters"),
+                )
+
+            raw_json = await ask(tier)
+            try:
+                return _parse_parameters(raw_json)
+            except (ValueError, TypeError) as e:
+                escalate = router.escalation_tier(tier)
+                if escalate is None:
+                    raise
+                print(f"[ROUTER] Модель '{tier}' вернула некорректный JSON ({e}), повторяем на '{escalate}'")
+                return _parse_parameters(await ask(escalate))
+
+        except Exception as e:
+            print(f"Ошибка анализа параметров: {e}")
+            return _default_parameters()
+
+
+class _YandexGPTBase:
+    """Общая часть клиентов Responses и completion API: payload, квоты и разбор ответа."""
+
+    upstream_name = "yandex_responses"
+    # Responses API keeps answers server-side: a thread reply can continue from previous_response_id
+    supports_chaining = True
+
+    def __init__(
+        self,
+        api_key: str | None = None,
+        folder_id: str | None = None,
+        retry_policy: RetryPolicy | None = None,
+        credential_pool: CredentialPool | None = None,
+    ) -> None:
+        settings = get_settings()
+        if api_key or folder_id:
+            credential_pool = CredentialPool(
+                [YandexCredential(api_key or settings.yandex_api_key, folder_id or settings.yandex_folder_id)]
             )
+        self._credentials = credential_pool or get_credential_pool()
+        self._model = settings.yandex_model
+        self._fast_model = settings.yandex_fast_model
+        self._api_url = settings.yandex_responses_url
+        self._retry_policy = retry_policy or RetryPolicy.from_settings(get_latency_tracker(self.upstream_name))
+
+    @property
+    def credentials(self) -> CredentialPool:
+        return self._credentials
+
+    def _headers(self, credential: YandexCredential) -> dict[str, str]:
+        return {
+            "Authorization": f"Api-Key {credential.api_key}",
+            "x-folder-id": credential.folder_id,
+            "Content-Type": "application/json",
+        }
+
+    def _model_for(self, model_tier: str | None) -> str:
+        """Concrete model of this upstream for a routing tier (large by default)."""
+        return self._fast_model if model_tier == FAST else self._model
+
+    def _build_request(
+        self,
+        messages: list[dict[str, str]],
+        model_tier: str | None = None,
+        credential: YandexCredential | None = None,
+        temperature: float | None = None,
+        response_format: dict | None = None,
+        max_output_tokens: int | None = None,
+    ) -> tuple[dict[str, str], dict]:
+        """Return headers and JSON payload for the Responses API."""
+        credential = credential or self._credentials.primary
+        chain = current_chain()
+        if chain is not None and chain.continues:
+            # Правила и история уже в сохранённом разговоре: отправляем только новое письмо
+            messages = chain.followup_messages
+        system_message = None
+        user_messages = []
 
-            if isinstance(raw_json, str):
-                raw_json = raw_json.strip()
+        for msg in messages:
+            if msg["role"] == "system":
+                system_message = msg["content"]
             else:
-                raw_json = str(raw_json).strip()
-            
-            params_dict = json.loads(raw_json)
-            return EmailParameters(**params_dict)
+                user_messages.append(msg["content"])
+
+        instructions = system_message or "Ты полезный ассистент."
+        input_text = "\n\n".join(user_messages)
+
+        model = self._model_for(model_tier)
+        if get_settings().llm_suppress_reasoning and model.startswith("qwen3"):
+            # Без рассуждений вслух: время ответа зависит от письма, а не от «мыслей» модели
+            instructions += "\n/no_think"
+        model_uri = f"gpt://{credential.folder_id}/{model}"
+
+        headers = self._headers(credential)
+
+        payload = {
+            "model": model_uri,
+            "instructions": instructions,
+            "input": input_text,
+        }
+        if temperature is not None:
+            payload["temperature"] = temperature
+        if max_output_tokens:
+            payload["max_output_tokens"] = max_output_tokens
+        if response_format:
+            # {"type": "json_object"} или {"type": "json_schema", "name": ..., "schema": ...}
+            payload["text"] = {"format": response_format}
+        if chain is not None:
+            payload["store"] = True
+            if chain.continues:
+                payload["previous_response_id"] = chain.previous_response_id
+        return headers, payload
+
+    def _parse_response(self, result: dict) -> str:
+        """Extract output text from a Responses API result."""
+        if result.get("status") == "failed" or result.get("error"):
+            error_msg = result.get("error", {}).get("message", "Unknown error")
+            error_code = result.get("error", {}).get("code", "")
+            if "Failed to get model" in error_msg or error_code == "model_call_error":
+                raise RuntimeError(
+                    f"Модель '{self._model}' недоступна в вашем каталоге. "
+                    f"Проверьте:\n"
+                    f"1. Что модель активирована в консоли Яндекс.Облака\n"
+                    f"2. Что у вас есть доступ к модели в каталоге {', '.join(self._credentials.folder_ids)}\n"
+                    f"3. Попробуйте другую модель, например: qwen3-235b-a22b-fp8/latest или yandexgpt/latest"
+                )
+            raise RuntimeError(f"YandexGPT API error: {error_msg}")
+
+        record_response_id(result.get("id"))
+        if result.get("status") == "incomplete":
+            reason = (result.get("incomplete_details") or {}).get("reason", "unknown")
+            print(f"[YandexGPT] Ответ обрезан ({reason}): возвращаем то, что модель успела написать")
+
+        output_text = result.get("output_text")
+        if output_text:
+            return _strip_reasoning(output_text).strip()
+
+        output = result.get("output")
+        if output and isinstance(output, list):
+            texts = []
+            for msg in output:
+                if isinstance(msg, dict) and "content" in msg:
+                    for content_item in msg["content"]:
+                        if isinstance(content_item, dict) and "text" in content_item:
+                            texts.append(content_item["text"])
+            if texts:
+                return _strip_reasoning("\n".join(texts)).strip()
+
+        text = result.get("text")
+        if text:
+            return _strip_reasoning(str(text)).strip()
+
+        raise RuntimeError(f"Empty response from YandexGPT API. Full response: {result}")
+
+    def _circuit_breaker(self) -> CircuitBreaker | None:
+        if not get_settings().circuit_breaker_enabled:
+            return None
+        return get_circuit_breaker(self.upstream_name)
+
+    def _record_outcome(
+        self,
+        breaker: CircuitBreaker | None,
+        duration: float,
+        error: Exception | None = None,
+        complete: bool = True,
+    ) -> None:
+        """Feed the circuit breaker and latency histogram with the result of one call.
+
+        Only complete answers go to the histogram: it sets the hedge delay and
+        the read timeout. Streaming reports time to first token (complete=False)
+        to the breaker alone.
+        """
+        if error is None and complete:
+            get_latency_tracker(self.upstream_name).record(duration)
+        if breaker is None:
+            return
+        if error is not None and _is_upstream_failure(error):
+            breaker.record_failure(duration)
+        else:
+            breaker.record_success(duration)
+
+    def _request_cost(self, messages: list[dict[str, str]], max_output_tokens: int | None = None) -> int:
+        """Tokens a call is charged against the quota before the answer is known."""
+        expected_output = get_settings().llm_expected_output_tokens
+        if max_output_tokens:
+            expected_output = min(expected_output, max_output_tokens)
+        return estimate_messages_tokens(messages) + expected_output
+
+    async def _pick_credential(self, cost: int) -> tuple[YandexCredential, RateLimiter | None, bool]:
+        """Preferred credential whose folder quota has room right now.
+
+        Returns the credential, its folder limiter and whether the quota was
+        already taken; if no folder has room, the caller queues on the best one.
+        A continued conversation is pinned to the folder that stores it.
+        """
+        pinned = self._chain_credential()
+        candidates = [pinned] if pinned is not None else self._credentials.candidates()
+        for credential in candidates:
+            limiter = get_rate_limiter(credential.folder_id)
+            if limiter is None or await limiter.try_acquire(cost):
+                return credential, limiter, True
+        return candidates[0], get_rate_limiter(candidates[0].folder_id), False
+
+    def _chain_credential(self) -> YandexCredential | None:
+        """Credential of the folder holding the continued conversation, if the pool has it."""
+        chain = current_chain()
+        if not self.supports_chaining or chain is None or not chain.continues or not chain.folder_id:
+            return None
+        return self._credentials.for_folder(chain.folder_id)
+
+    async def _finish_credential(self, credential: YandexCredential, error: Exception | None = None) -> None:
+        """Update the health of the credential after one attempt."""
+        self._credentials.finish(credential, failed=error is not None and _is_upstream_failure(error))
+        if isinstance(error, httpx.HTTPStatusError):
+            await self._on_rate_limited(error, credential)
 
+    async def _on_rate_limited(self, e: httpx.HTTPStatusError, credential: YandexCredential) -> None:
+        """Upstream 429: back off this folder's limiter and rest the credential so retries go elsewhere."""
+        if e.response.status_code != 429:
+            return
+        retry_after = parse_retry_after(e.response.headers.get("Retry-After"))
+        limiter = get_rate_limiter(credential.folder_id)
+        if limiter is not None:
+            await limiter.drain(retry_after if retry_after is not None else 1.0)
+        self._credentials.cool_down(credential, retry_after)
+
+    def _chain_expired(self, e: Exception) -> bool:
+        """True if the upstream rejected previous_response_id: the next attempt resends the full history."""
+        chain = current_chain()
+        if not self.supports_chaining or chain is None or not chain.continues:
+            return False
+        if not isinstance(e, httpx.HTTPStatusError) or e.response.status_code not in (400, 404):
+            return False
+        chain.expired = True
+        print(
+            f"[CHAIN] Ответ {chain.previous_response_id} недоступен (HTTP {e.response.status_code}): "
+            f"отправляем всю историю переписки"
+        )
+        return True
+
+    def _http_error(self, e: httpx.HTTPStatusError) -> RuntimeError:
+        error_detail = ""
+        try:
+            error_detail = e.response.json()
+        except:
+            error_detail = e.response.text
+        return RuntimeError(f"YandexGPT API HTTP error {e.response.status_code}: {error_detail}")
+
+    def _retry_delay(self, state: RetryState, e: Exception) -> float:
+        """Delay before the next attempt, or raise the final error if the policy gives up."""
+        # После 429 следующая попытка уйдёт в другой каталог, если он свободен: его Retry-After не касается
+        other_folder = (
+            isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429 and self._credentials.has_ready()
+        )
+        delay = self._retry_policy.next_delay(state, e, honor_retry_after=not other_folder)
+        if delay is not None:
+            reason = f"HTTP {e.response.status_code}" if isinstance(e, httpx.HTTPStatusError) else e
+            print(f"[YandexGPT] Попытка {state.attempts} не удалась: {reason}. Повтор через {delay:.1f} сек...")
+            return delay
+        if state.deadline is not None and (
+            state.deadline.expired() or (isinstance(e, httpx.TimeoutException) and state.deadline.remaining() < 1.0)
+        ):
+            # Таймаут попытки был урезан бюджетом вызывающей стороны
+            raise LatencyBudgetExceeded(state.deadline.budget_ms) from e
+        if isinstance(e, httpx.HTTPStatusError):
+            raise self._http_error(e) from e
+        if isinstance(e, httpx.TransportError):
+            raise RuntimeError(f"YandexGPT API connection error после {state.attempts} попыток: {e}") from e
+        if isinstance(e, RuntimeError):
+            raise e
+        if is_ssl_error(e):
+            raise RuntimeError(
+                f"YandexGPT API SSL error после {state.attempts} попыток: {e}. "
+                f"Возможные причины: проблемы с сетью, прокси или SSL сертификатами."
+            ) from e
+        raise RuntimeError(f"YandexGPT API error: {e}") from e
+
+
+class AsyncYandexGPTService(AsyncLetterOperations, _YandexGPTBase):
+    """Asyncio YandexGPT client: не держит поток воркера на время ответа модели."""
+
+    async def _make_request(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        response_format: dict | None = None,
+        deadline: Deadline | None = None,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ) -> str:
+        """Make request to YandexGPT Responses API (within the caller's deadline, if given)."""
+        entry = self._replay_entry(messages, model_tier, temperature, response_format, max_output_tokens)
+        if entry is not None:
+            return self._parse_response(entry["response"])
+        cost = self._request_cost(messages, max_output_tokens)
+
+        breaker = self._circuit_breaker()
+
+        state = self._retry_policy.start(deadline)
+        while True:
+            if deadline is not None:
+                deadline.check()
+            if breaker is not None:
+                breaker.before_call()
+            credential, limiter, acquired = await self._pick_credential(cost)
+            if limiter is not None and not acquired:
+                # Квоты нет ни в одном каталоге: ждём в очереди, не блокируя event loop
+                try:
+                    await limiter.acquire(cost, deadline.remaining() if deadline else None)
+                except RateLimitExceeded as e:
+                    # Квота освободится уже после дедлайна: исчерпан бюджет вызывающего (504), а не квота (429)
+                    if deadline is not None and deadline.remaining() <= e.retry_after_seconds:
+                        raise LatencyBudgetExceeded(deadline.budget_ms) from e
+                    raise
+            headers, payload = self._build_request(
+                messages, model_tier, credential, temperature, response_format, max_output_tokens
+            )
+            self._credentials.start(credential)
+            try:
+                text = await self._send(headers, payload, breaker, limiter, cost, self._retry_policy.timeout(state))
+            except asyncio.CancelledError:
+                self._credentials.finish(credential, failed=None)
+                raise
+            except Exception as e:
+                await self._finish_credential(credential, e)
+                if self._chain_expired(e):
+                    continue
+                await self._retry_policy.asleep(self._retry_delay(state, e))
+                continue
+            await self._finish_credential(credential)
+            record_response_folder(credential.folder_id)
+            return text
+
+    def _replay_entry(
+        self,
+        messages: list[dict[str, str]],
+        model_tier: str | None,
+        temperature: float | None,
+        response_format: dict | None,
+        max_output_tokens: int | None,
+        stream: bool = False,
+    ) -> dict | None:
+        """Recorded answer in cassette replay mode, None otherwise.
+
+        Checked before the breaker, the credential pool and the rate limiter:
+        a replayed profile must not wait on quota or be rejected by an open
+        breaker. The folder is not part of the key, so the primary credential
+        builds the payload.
+        """
+        cassette = get_llm_cassette()
+        if cassette is None or not cassette.replaying:
+            return None
+        _headers, payload = self._build_request(
+            messages, model_tier, self._credentials.primary, temperature, response_format, max_output_tokens
+        )
+        if stream:
+            self._enable_streaming(payload)
+        return cassette.lookup(self.upstream_name, payload)
+
+    async def _send(
+        self,
+        headers: dict[str, str],
+        payload: dict,
+        breaker: CircuitBreaker | None,
+        limiter: RateLimiter | None,
+        cost: int,
+        timeout: httpx.Timeout,
+    ) -> str:
+        """One attempt: POST (possibly hedged) to the Responses API and parse the answer."""
+        cassette = get_llm_cassette()
+        started = time.monotonic()
+        try:
+            response = await self._post_hedged(headers, payload, limiter, cost, timeout)
+            response.raise_for_status()
+            result = response.json()
+            text = self._parse_response(result)
+            if cassette is not None:
+                # Дописывание в файл (gzip) — блокирующее, не держим им event loop
+                await asyncio.to_thread(
+                    cassette.record, self.upstream_name, payload, time.monotonic() - started, response=result
+                )
+        except asyncio.CancelledError:
+            # Вызывающий ушёл (дедлайн, failover): это не ошибка апстрима
+            if breaker is not None:
+                breaker.record_cancelled()
+            raise
         except Exception as e:
-            print(f"Ошибка анализа параметров: {e}")
-            return EmailParameters(
-                tone="formal",
-                purpose="response",
-                length="medium",
-                audience="colleague",
-                urgency="normal",
-                address_style="vy",
-                include_formal_greetings=True,
-                include_greeting_and_signoff=True,
-                include_corporate_phrases=True,
+            self._record_outcome(breaker, time.monotonic() - started, e)
+            raise
+        finally:
+            record_llm_call(time.monotonic() - started)
+        self._record_outcome(breaker, time.monotonic() - started)
+        return text
+
+    def _hedge_delay(self) -> float | None:
+        """Observed latency percentile after which a second request is sent, if hedging is on."""
+        settings = get_settings()
+        if not settings.llm_hedging_enabled:
+            return None
+        return get_latency_tracker(self.upstream_name).percentile(settings.llm_hedge_percentile)
+
+    async def _post_hedged(
+        self,
+        headers: dict[str, str],
+        payload: dict,
+        limiter: RateLimiter | None,
+        cost: int,
+        timeout: httpx.Timeout,
+    ) -> httpx.Response:
+        """POST the payload; if it is slower than the observed p95, race a second copy."""
+        client = get_async_http_client()
+
+        def post():
+            return asyncio.ensure_future(
+                client.post(self._api_url, headers=headers, json=payload, timeout=timeout)
             )
 
+        delay = self._hedge_delay()
+        if delay is None:
+            return await client.post(self._api_url, headers=headers, json=payload, timeout=timeout)
+
+        tasks = {post()}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            # Хедж тратит квоту, поэтому отправляем его только при свободной квоте
+            if not done and (limiter is None or await limiter.try_acquire(cost)):
+                print(f"[YandexGPT] Нет ответа за {delay:.1f} сек (p{get_settings().llm_hedge_percentile:g}), отправляем хедж-запрос")
+                tasks.add(post())
+
+            error: BaseException | None = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    @property
+    def name(self) -> str:
+        return self.upstream_name
+
+    def available(self) -> bool:
+        """False while the circuit breaker of this upstream is open."""
+        breaker = self._circuit_breaker()
+        return breaker is None or breaker.state != CircuitBreaker.OPEN
+
+    async def complete(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        response_format: dict | None = None,
+        deadline: Deadline | None = None,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ) -> str:
+        """LLMBackend.complete: one answer with retries, rate limiting and the circuit breaker."""
+        return await self._make_request(messages, temperature, response_format, deadline, model_tier, max_output_tokens)
+
+    def stream(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ):
+        """LLMBackend.stream: output text deltas."""
+        return self._stream_request(messages, temperature, model_tier, max_output_tokens)
+
+    def _enable_streaming(self, payload: dict) -> None:
+        payload["stream"] = True
+
+    async def _iter_output_deltas(self, response: httpx.Response):
+        """Text deltas from a streamed Responses API answer (server-sent events)."""
+        async for event in _iter_sse_events(response):
+            event_type = event.get("type", "")
+            if event_type == "response.output_text.delta":
+                delta = event.get("delta")
+                if delta:
+                    yield delta
+            elif event_type in ("response.failed", "error"):
+                error = event.get("error") or event.get("response", {}).get("error") or {}
+                raise RuntimeError(f"YandexGPT API error: {error.get('message', 'Unknown error')}")
+            elif event_type == "response.completed":
+                record_response_id((event.get("response") or {}).get("id"))
+                return
+
+    async def _stream_request(
+        self,
+        messages: list[dict[str, str]],
+        temperature: float = 0.4,
+        model_tier: str | None = None,
+        max_output_tokens: int | None = None,
+    ):
+        """Stream output text deltas from the upstream (``stream: true``)."""
+        entry = self._replay_entry(messages, model_tier, temperature, None, max_output_tokens, stream=True)
+        if entry is not None:
+            record_response_id(entry.get("response_id"))
+            for delta in entry["deltas"]:
+                yield delta
+            return
+        breaker = self._circuit_breaker()
+        if breaker is not None:
+            breaker.before_call()
+        cost = self._request_cost(messages, max_output_tokens)
+        credential, limiter, acquired = await self._pick_credential(cost)
+        if limiter is not None and not acquired:
+            await limiter.acquire(cost)
+
+        headers, payload = self._build_request(messages, model_tier, credential, temperature, None, max_output_tokens)
+        self._enable_streaming(payload)
+        cassette = get_llm_cassette()
+        recorded: list[str] = []
+        self._credentials.start(credential)
+        error: Exception | None = None
+        cancelled = False
+        resend_unchained = False
+
+        client = get_async_http_client()
+        started = time.monotonic()
+        first_token_at: float | None = None
+        try:
+            async with client.stream(
+                "POST", self._api_url, headers=headers, json=payload,
+                timeout=self._retry_policy.timeout(self._retry_policy.start()),
+            ) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                async for delta in _skip_reasoning(self._iter_output_deltas(response)):
+                    if first_token_at is None:
+                        # Здоровье апстрима при стриминге меряем по времени до первого токена
+                        first_token_at = time.monotonic()
+                        self._record_outcome(breaker, first_token_at - started, complete=False)
+                    recorded.append(delta)
+                    yield delta
+            record_response_folder(credential.folder_id)
+            if cassette is not None:
+                chain = current_chain()
+                await asyncio.to_thread(
+                    cassette.record, self.upstream_name, payload, time.monotonic() - started,
+                    deltas=recorded, response_id=chain.response_id if chain else None,
+                )
+        except (asyncio.CancelledError, GeneratorExit):
+            cancelled = True
+            if first_token_at is None and breaker is not None:
+                breaker.record_cancelled()
+            raise
+        except httpx.HTTPStatusError as e:
+            error = e
+            if first_token_at is None:
+                self._record_outcome(breaker, time.monotonic() - started, e)
+            resend_unchained = first_token_at is None and self._chain_expired(e)
+            if not resend_unchained:
+                raise self._http_error(e) from e
+        except (httpx.TransportError, httpx.StreamError, RuntimeError) as e:
+            error = e
+            if first_token_at is None:
+                self._record_outcome(breaker, time.monotonic() - started, e)
+            if isinstance(e, RuntimeError):
+                raise
+            raise RuntimeError(f"YandexGPT API stream error: {e}") from e
+        finally:
+            if cancelled:
+                self._credentials.finish(credential, failed=None)
+            else:
+                await self._finish_credential(credential, error)
+            record_llm_call(time.monotonic() - started)
+        if resend_unchained:
+            async for delta in self._stream_request(messages, temperature, model_tier, max_output_tokens):
+                yield delta
+
+
+class _YandexCompletionMixin:
+    """Формат Foundation Models completion API вместо Responses API.
+
+    Другой хост и другая модель: запасной путь, если Responses API деградировал.
+    Свой circuit breaker и гистограмма задержек (upstream_name).
+    """
+
+    upstream_name = "yandex_completion"
+    supports_chaining = False
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        settings = get_settings()
+        self._model = settings.yandex_completion_model
+        self._fast_model = settings.yandex_completion_fast_model
+        self._api_url = settings.yandex_completion_url
+
+    def _build_request(
+        self,
+        messages: list[dict[str, str]],
+        model_tier: str | None = None,
+        credential: YandexCredential | None = None,
+        temperature: float | None = None,
+        response_format: dict | None = None,
+        max_output_tokens: int | None = None,
+    ) -> tuple[dict[str, str], dict]:
+        """Return headers and JSON payload for the completion API."""
+        credential = credential or self._credentials.primary
+        headers = self._headers(credential)
+        payload = {
+            "modelUri": f"gpt://{credential.folder_id}/{self._model_for(model_tier)}",
+            "completionOptions": {"stream": False},
+            "messages": [{"role": msg["role"], "text": msg["content"]} for msg in messages],
+        }
+        if temperature is not None:
+            payload["completionOptions"]["temperature"] = temperature
+        if max_output_tokens:
+            payload["completionOptions"]["maxTokens"] = max_output_tokens
+        if response_format and response_format.get("type") == "json_schema":
+            payload["jsonSchema"] = {"schema": response_format["schema"]}
+        elif response_format:
+            payload["jsonObject"] = True
+        return headers, payload
+
+    def _parse_response(self, result: dict) -> str:
+        """Extract the text of the first alternative."""
+        if result.get("error"):
+            raise RuntimeError(f"YandexGPT completion API error: {result['error'].get('message', 'Unknown error')}")
+        alternatives = (result.get("result") or {}).get("alternatives") or []
+        if alternatives:
+            if alternatives[0].get("status") == "ALTERNATIVE_STATUS_TRUNCATED_FINAL":
+                print("[YandexGPT] Ответ completion обрезан по maxTokens")
+            text = (alternatives[0].get("message") or {}).get("text")
+            if text:
+                return text.strip()
+        raise RuntimeError(f"Empty response from YandexGPT completion API. Full response: {result}")
+
+    def _enable_streaming(self, payload: dict) -> None:
+        payload["completionOptions"]["stream"] = True
+
+    async def _iter_output_deltas(self, response: httpx.Response):
+        """Deltas from a streamed completion: each JSON line carries the whole text so far."""
+        emitted = ""
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"[YandexGPT] Некорректная строка потока completion: {line[:200]}")
+                continue
+            if result.get("error"):
+                raise RuntimeError(f"YandexGPT completion API error: {result['error'].get('message', 'Unknown error')}")
+            alternatives = (result.get("result") or {}).get("alternatives") or []
+            if not alternatives:
+                continue
+            text = (alternatives[0].get("message") or {}).get("text") or ""
+            if text.startswith(emitted) and len(text) > len(emitted):
+                yield text[len(emitted):]
+                emitted = text
+            if alternatives[0].get("status") in ("ALTERNATIVE_STATUS_FINAL", "ALTERNATIVE_STATUS_TRUNCATED_FINAL"):
+                return
+
+
+class AsyncYandexCompletionService(_YandexCompletionMixin, AsyncYandexGPTService):
+    """Asyncio YandexGPT client over the Foundation Models completion API."""
+
+
+# Singleton instance
+_async_yandex_service = None
+
+def get_async_yandex_service() -> AsyncYandexGPTService:
+    """Get singleton asyncio YandexGPT service instance."""
+    global _async_yandex_service
+    if _async_yandex_service is None:
+        _async_yandex_service = AsyncYandexGPTService()
+    return _async_yandex_service
@@ -0,0 +1 @@
+"""Local stand-ins for Yandex Cloud APIs, for tests and load runs without credentials."""
@@ -0,0 +1,80 @@
+"""Stand-in for the asynchronous completion API (completionAsync + operations).
+
+Run:  uvicorn backend.mock_upstream.operations:app --port 8090
+Then: YANDEX_COMPLETION_ASYNC_URL=http://localhost:8090/foundationModels/v1/completionAsync
+      YANDEX_OPERATIONS_URL=http://localhost:8090/operations
+
+Answers come from LocalLLMBackend, so they are deterministic. An operation is
+done ``MOCK_OPERATION_SECONDS`` after it was started.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import Body, FastAPI, Header
+from fastapi.responses import JSONResponse
+
+from ..app.services.local_llm_backend import LocalLLMBackend
+
+
+def create_app(complete_after_seconds: float = 0.0, fail_operations: bool = False) -> FastAPI:
+    """Build the stand-in; ``fail_operations`` makes every operation finish with an error."""
+    app = FastAPI(title="Yandex operations stand-in")
+    operations: dict[str, dict] = {}
+    backend = LocalLLMBackend()
+
+    @app.post("/foundationModels/v1/completionAsync")
+    async def completion_async(
+        payload: dict = Body(...),
+        authorization: Optional[str] = Header(None),
+    ):
+        if not authorization:
+            return JSONResponse(status_code=401, content={"code": 16, "message": "Unauthenticated"})
+        operation_id = uuid.uuid4().hex
+        operations[operation_id] = {
+            "started": time.monotonic(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "messages": [{"role": msg["role"], "content": msg["text"]} for msg in payload.get("messages", [])],
+        }
+        return _operation(operation_id, operations[operation_id], done=False)
+
+    @app.get("/operations/{operation_id}")
+    async def get_operation(operation_id: str):
+        operation = operations.get(operation_id)
+        if operation is None:
+            return JSONResponse(status_code=404, content={"code": 5, "message": f"Operation {operation_id} not found"})
+        if time.monotonic() - operation["started"] < complete_after_seconds:
+            return _operation(operation_id, operation, done=False)
+        body = _operation(operation_id, operation, done=True)
+        if fail_operations:
+            body["error"] = {"code": 13, "message": "Internal error"}
+            return body
+        text = backend.respond(operation["messages"])
+        body["response"] = {
+            "@type": "type.googleapis.com/yandex.cloud.ai.foundation_models.v1.CompletionResponse",
+            "alternatives": [{"message": {"role": "assistant", "text": text}, "status": "ALTERNATIVE_STATUS_FINAL"}],
+            "modelVersion": "stand-in",
+        }
+        return body
+
+    return app
+
+
+def _operation(operation_id: str, operation: dict, done: bool) -> dict:
+    return {
+        "id": operation_id,
+        "description": "Async GPT Completion",
+        "createdAt": operation["created_at"],
+        "createdBy": "stand-in",
+        "modifiedAt": datetime.now(timezone.utc).isoformat(),
+        "done": done,
+        "metadata": None,
+    }
+
+
+app = create_app(complete_after_seconds=float(os.getenv("MOCK_OPERATION_SECONDS", "2")))
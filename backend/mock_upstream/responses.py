@@ -0,0 +1,283 @@
+"""Stand-in for the YandexGPT Responses API (``POST /v1/responses``) for load tests.
+
+Run:  uvicorn backend.mock_upstream.responses:app --port 8091
+Then: YANDEX_RESPONSES_URL=http://localhost:8091/v1/responses
+
+Answers come from LocalLLMBackend (or MOCK_ANALYSIS_FILE for analysis calls),
+so a load run is reproducible and free. Behaviour is set by environment:
+
+- MOCK_LATENCY: latency before the answer (or the first streamed delta),
+  ``fixed:S``, ``uniform:MIN:MAX``, ``normal:MEAN:STD`` or
+  ``lognormal:MEDIAN:SIGMA`` (seconds); default ``lognormal:0.8:0.5``;
+- MOCK_TOKEN_DELAY_MS: pause between streamed deltas;
+- MOCK_ERROR_RATE / MOCK_RATE_LIMIT_RATE: share of calls answered with 500 /
+  429 (with Retry-After: MOCK_RETRY_AFTER_SECONDS); MOCK_FAILED_RATE: share of
+  calls answered 200 with ``status: failed`` and an error payload;
+- MOCK_OUTPUT_SHAPE: ``output_text``, ``output`` (``output[].content[].text``)
+  or ``mixed``;
+- MOCK_SEED: seed of the random generator.
+
+Stored answers can be continued with ``previous_response_id``; an unknown id
+is answered with 404 like an expired one upstream.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import Body, FastAPI, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from ..app.services.local_llm_backend import LocalLLMBackend
+from ..app.services.prompt_builder import estimate_tokens
+
+OUTPUT_SHAPES = ("output_text", "output", "mixed")
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    """Random latency in seconds; ``parse("lognormal:0.8:0.5")`` and friends."""
+
+    kind: str = "fixed"
+    a: float = 0.0
+    b: float = 0.0
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal")
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, *params = spec.strip().split(":")
+        if kind not in cls.KINDS:
+            raise ValueError(f"Unknown latency distribution '{kind}', expected one of {', '.join(cls.KINDS)}")
+        values = [float(value) for value in params] + [0.0, 0.0]
+        return cls(kind, values[0], values[1])
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "uniform":
+            value = rng.uniform(self.a, self.b)
+        elif self.kind == "normal":
+            value = rng.gauss(self.a, self.b)
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(math.log(self.a), self.b) if self.a > 0 else 0.0
+        else:
+            value = self.a
+        return max(0.0, value)
+
+
+@dataclass
+class MockStats:
+    """Counters exposed at ``GET /stats`` for checking a load run."""
+
+    requests: int = 0
+    streamed: int = 0
+    rate_limited: int = 0
+    errors: int = 0
+    failed: int = 0
+    incomplete: int = 0
+    chained: int = 0
+    latencies: list[float] = field(default_factory=list)
+
+    def as_dict(self) -> dict:
+        ordered = sorted(self.latencies)
+
+        def percentile(p: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 3)
+
+        return {
+            "requests": self.requests,
+            "streamed": self.streamed,
+            "rate_limited": self.rate_limited,
+            "errors": self.errors,
+            "failed": self.failed,
+            "incomplete": self.incomplete,
+            "chained": self.chained,
+            "latency_p50": percentile(50),
+            "latency_p95": percentile(95),
+        }
+
+
+def create_app(
+    latency: LatencyDistribution | str = "fixed:0",
+    token_delay_seconds: float = 0.0,
+    error_rate: float = 0.0,
+    rate_limit_rate: float = 0.0,
+    failed_rate: float = 0.0,
+    retry_after_seconds: float = 1.0,
+    output_shape: str = "output_text",
+    canned_analysis: Optional[dict] = None,
+    seed: Optional[int] = None,
+) -> FastAPI:
+    """Build the stand-in. Defaults answer instantly and never fail (for tests)."""
+    if isinstance(latency, str):
+        latency = LatencyDistribution.parse(latency)
+    if output_shape not in OUTPUT_SHAPES:
+        raise ValueError(f"Unknown output shape '{output_shape}', expected one of {', '.join(OUTPUT_SHAPES)}")
+    app = FastAPI(title="YandexGPT Responses API stand-in")
+    rng = random.Random(seed)
+    backend = LocalLLMBackend()
+    stored: dict[str, list[dict[str, str]]] = {}
+    stats = MockStats()
+    app.state.stats = stats
+
+    def answer_for(messages: list[dict[str, str]]) -> str:
+        if canned_analysis is not None and '"extracted_info"' in messages[-1]["content"]:
+            return json.dumps(canned_analysis, ensure_ascii=False)
+        return backend.respond(messages)
+
+    @app.post("/v1/responses")
+    async def create_response(
+        payload: dict = Body(...),
+        authorization: Optional[str] = Header(None),
+    ):
+        stats.requests += 1
+        if not authorization:
+            return JSONResponse(status_code=401, content={"error": {"code": "unauthenticated", "message": "Unauthenticated"}})
+
+        roll = rng.random()
+        if roll < rate_limit_rate:
+            stats.rate_limited += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"Retry-After": f"{retry_after_seconds:g}"},
+                content={"error": {"code": "rate_limit_exceeded", "message": "Too many requests"}},
+            )
+        if roll < rate_limit_rate + error_rate:
+            stats.errors += 1
+            return JSONResponse(status_code=500, content={"error": {"code": "internal", "message": "Internal error"}})
+
+        previous_id = payload.get("previous_response_id")
+        history: list[dict[str, str]] = []
+        if previous_id:
+            if previous_id not in stored:
+                return JSONResponse(
+                    status_code=404,
+                    content={"error": {"code": "not_found", "message": f"Response {previous_id} not found"}},
+                )
+            stats.chained += 1
+            history = stored[previous_id]
+
+        messages = [
+            {"role": "system", "content": payload.get("instructions") or ""},
+            {"role": "user", "content": str(payload.get("input") or "")},
+        ]
+        response_id = f"resp_{uuid.uuid4().hex}"
+        delay = latency.sample(rng)
+        stats.latencies.append(delay)
+
+        if roll < rate_limit_rate + error_rate + failed_rate:
+            stats.failed += 1
+            await asyncio.sleep(delay)
+            return {
+                "id": response_id,
+                "object": "response",
+                "status": "failed",
+                "error": {"code": "server_error", "message": "Model call failed"},
+                "output": [],
+            }
+
+        text = answer_for(messages)
+        status, text = _apply_output_limit(text, payload.get("max_output_tokens"))
+        if status == "incomplete":
+            stats.incomplete += 1
+        if payload.get("store", True):
+            stored[response_id] = history + messages + [{"role": "assistant", "content": text}]
+
+        if payload.get("stream"):
+            stats.streamed += 1
+            return StreamingResponse(
+                _stream_events(response_id, payload, text, status, delay, token_delay_seconds),
+                media_type="text/event-stream",
+            )
+
+        await asyncio.sleep(delay)
+        shape = output_shape if output_shape != "mixed" else rng.choice(OUTPUT_SHAPES[:2])
+        return _response_body(response_id, payload, text, status, shape)
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats.as_dict()
+
+    return app
+
+
+def _apply_output_limit(text: str, max_output_tokens: Optional[int]) -> tuple[str, str]:
+    """Cut the answer at max_output_tokens like the upstream does (status "incomplete")."""
+    if not max_output_tokens or estimate_tokens(text) <= max_output_tokens:
+        return "completed", text
+    return "incomplete", text[: max_output_tokens * 3]
+
+
+def _response_body(response_id: str, payload: dict, text: str, status: str, shape: str) -> dict:
+    body = {
+        "id": response_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": payload.get("model"),
+        "status": status,
+        "previous_response_id": payload.get("previous_response_id"),
+        "output": [
+            {
+                "type": "message",
+                "id": f"msg_{uuid.uuid4().hex}",
+                "role": "assistant",
+                "status": status,
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "usage": {
+            "input_tokens": estimate_tokens(str(payload.get("instructions") or "") + str(payload.get("input") or "")),
+            "output_tokens": estimate_tokens(text),
+        },
+    }
+    if status == "incomplete":
+        body["incomplete_details"] = {"reason": "max_output_tokens"}
+    if shape == "output_text":
+        body["output_text"] = text
+    return body
+
+
+async def _stream_events(
+    response_id: str, payload: dict, text: str, status: str, first_delay: float, token_delay: float
+):
+    def sse(event: dict) -> str:
+        return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    yield sse({"type": "response.created", "response": {"id": response_id, "status": "in_progress"}})
+    await asyncio.sleep(first_delay)
+    for piece in re.findall(r"\S+\s*|\s+", text):
+        yield sse({"type": "response.output_text.delta", "delta": piece})
+        if token_delay:
+            await asyncio.sleep(token_delay)
+    final = _response_body(response_id, payload, text, status, "output")
+    yield sse({"type": "response.completed" if status == "completed" else "response.incomplete", "response": final})
+
+
+def _load_canned_analysis(path: str) -> Optional[dict]:
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+
+app = create_app(
+    latency=os.getenv("MOCK_LATENCY", "lognormal:0.8:0.5"),
+    token_delay_seconds=float(os.getenv("MOCK_TOKEN_DELAY_MS", "20")) / 1000.0,
+    error_rate=float(os.getenv("MOCK_ERROR_RATE", "0")),
+    rate_limit_rate=float(os.getenv("MOCK_RATE_LIMIT_RATE", "0")),
+    failed_rate=float(os.getenv("MOCK_FAILED_RATE", "0")),
+    retry_after_seconds=float(os.getenv("MOCK_RETRY_AFTER_SECONDS", "1")),
+    output_shape=os.getenv("MOCK_OUTPUT_SHAPE", "mixed"),
+    canned_analysis=_load_canned_analysis(os.getenv("MOCK_ANALYSIS_FILE", "")),
+    seed=int(os.getenv("MOCK_SEED")) if os.getenv("MOCK_SEED") else None,
+)
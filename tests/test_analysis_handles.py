@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from pydantic import ValidationError
+
+from backend.app.api import routes
+from backend.app.models import DetailedEmailAnalysis, EmailGenerationRequest, EmailParameters, ExtractedInfo
+from backend.app.services import analysis_store
+from backend.app.services.analysis_store import AnalysisStore
+from backend.app.services.prompt_builder import build_messages
+
+SUBJECT = "Запрос выписки"
+BODY = "Добрый день, Артем Евгеньевич! Прошу в течение 3 рабочих дней предоставить выписку по счёту."
+
+
+def _analysis():
+    return DetailedEmailAnalysis(
+        category="information_request",
+        parameters=EmailParameters(length="short"),
+        extracted_info=ExtractedInfo(request_essence="Запрос выписки", requirements=["Выписка за квартал"]),
+        department="Отдел операционного обслуживания",
+        estimated_sla_days=3,
+        extracted_deadline_days=3,
+    )
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = AnalysisStore(cache=None, ttl_seconds=60)
+    monkeypatch.setattr(analysis_store, "_analysis_store", store)
+    return store
+
+
+def test_generate_request_by_analysis_id_reuses_the_analysis(store):
+    analysis_id = store.put(SUBJECT, BODY, "ПСБ", _analysis())
+
+    request, thread_history, recipient_name, chain, analysis = routes._prepare_generation(
+        EmailGenerationRequest(analysis_id=analysis_id), db=None
+    )
+    prompt = build_messages(request, recipient_name=recipient_name, analysis=analysis)[-1]["content"]
+
+    assert (request.source_subject, request.source_body, request.company_context) == (SUBJECT, BODY, "ПСБ")
+    assert recipient_name == "Артем Евгеньевич"
+    assert analysis.department == "Отдел операционного обслуживания"
+    assert "Отдел операционного обслуживания" in prompt
+    assert "Выписка за квартал" in prompt
+    assert "Срок, указанный в письме: 3" in prompt
+
+
+def test_unknown_analysis_id(store):
+    with pytest.raises(HTTPException) as error:
+        routes._prepare_generation(EmailGenerationRequest(analysis_id="missing"), db=None)
+    assert error.value.status_code == 404
+
+    # С письмом в запросе генерация идёт как без analysis_id
+    request, *_, analysis = routes._prepare_generation(
+        EmailGenerationRequest(analysis_id="missing", source_subject=SUBJECT, source_body=BODY, company_context="ПСБ"),
+        db=None,
+    )
+    assert analysis is None and request.source_subject == SUBJECT
+
+
+def test_expired_analysis_is_forgotten():
+    store = AnalysisStore(cache=None, ttl_seconds=0)
+    assert store.get(store.put(SUBJECT, BODY, "ПСБ", _analysis())) is None
+
+
+def test_letter_or_analysis_id_is_required():
+    with pytest.raises(ValidationError):
+        EmailGenerationRequest(company_context="ПСБ")
+
+
+class _Analyzer:
+    async_service = None
+
+    async def analyze_email_detailed_async(self, subject, body, company_context, deadline=None):
+        return _analysis()
+
+
+class _RecordingStore(AnalysisStore):
+    def __init__(self):
+        super().__init__(cache=None, ttl_seconds=60)
+        self.threads = []
+
+    def put(self, *args):
+        self.threads.append(threading.get_ident())
+        return super().put(*args)
+
+
+def test_analysis_is_stored_off_the_event_loop(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    store = _RecordingStore()
+    monkeypatch.setattr(analysis_store, "_analysis_store", store)
+    monkeypatch.setattr(routes, "_get_analyzer", lambda: _Analyzer())
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            response = await client.post(
+                "/api/emails/analyze-detailed",
+                json={"source_subject": SUBJECT, "source_body": BODY, "company_context": "ПСБ"},
+            )
+        return response, threading.get_ident()
+
+    response, loop_thread = asyncio.run(post())
+
+    assert store.get(response.json()["analysis_id"]).subject == SUBJECT
+    assert store.threads and loop_thread not in store.threads
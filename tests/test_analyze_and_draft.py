@@ -0,0 +1,70 @@
+import asyncio
+import json
+
+from backend.app.models import EmailGenerationRequest, EmailGenerationResponse
+from backend.app.services.email_analyzer import EmailAnalyzer
+
+ANALYSIS = {
+    "category": "complaint",
+    "parameters": {"tone": "formal", "audience": "client", "address_style": "full_name"},
+    "extracted_info": {"request_essence": "Жалоба на списание комиссии"},
+}
+
+
+class _CombinedService:
+    """Answers the analyze-and-draft prompt with ``answer``; records every call."""
+
+    def __init__(self, answer):
+        self.calls = []
+        self.letters = []
+        self._answer = answer
+
+    async def _make_request(self, messages, temperature=0.4, response_format=None, deadline=None, model_tier=None, max_output_tokens=None):
+        self.calls.append(response_format["name"] if response_format else None)
+        if response_format and response_format["name"] == "analysis_and_draft":
+            return self._answer
+        return json.dumps(ANALYSIS, ensure_ascii=False)
+
+    async def generate_letter(self, payload, thread_history=None, recipient_name=None, deadline=None):
+        self.letters.append(payload)
+        return EmailGenerationResponse(subject="Ответ", body="Отдельный черновик")
+
+
+def _run(monkeypatch, service):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("SINGLE_FLIGHT_ENABLED", "false")
+    request = EmailGenerationRequest(
+        source_subject="Жалоба на комиссию",
+        source_body="С моего счёта списали комиссию без предупреждения, прошу вернуть",
+        company_context="ПСБ",
+        sender_first_name="Иван",
+        sender_last_name="Петров",
+    )
+    analyzer = EmailAnalyzer(async_service=service)
+    return asyncio.run(analyzer.analyze_and_draft_async(request))
+
+
+def test_analysis_and_draft_come_from_one_call(monkeypatch):
+    answer = {"analysis": ANALYSIS, "draft": {"subject": "О возврате комиссии", "body": "Добрый день!\n\nКомиссия будет возвращена."}}
+    service = _CombinedService(json.dumps(answer, ensure_ascii=False))
+
+    analysis, draft = _run(monkeypatch, service)
+
+    assert service.calls == ["analysis_and_draft"]
+    assert analysis.category == "complaint"
+    assert analysis.department and analysis.estimated_sla_days
+    assert draft.subject == "О возврате комиссии"
+    assert draft.body.startswith("Добрый день!")
+    assert "Иван" in draft.body
+
+
+def test_unparseable_answer_falls_back_to_two_calls(monkeypatch):
+    service = _CombinedService("Извините, не могу ответить")
+
+    analysis, draft = _run(monkeypatch, service)
+
+    assert service.calls == ["analysis_and_draft", "detailed_email_analysis"]
+    assert draft.body == "Отдельный черновик"
+    # Получателя нет: обращение по ФИО из анализа заменяется на «Вы»
+    assert service.letters[0].parameters.address_style == "vy"
@@ -0,0 +1,114 @@
+import asyncio
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from backend.app.database import Base
+from backend.app.db_models import EmailMessage
+from backend.app.models import EmailGenerationRequest
+from backend.app.services.batch_generation import BatchGenerationService, in_submit_window, is_batch_eligible
+from backend.app.services.thread_service import ThreadService
+from backend.app.services.yandex_gpt_client import AsyncYandexCompletionService
+from backend.mock_upstream.operations import create_app
+
+
+def _service(monkeypatch, **stand_in_options):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("YANDEX_COMPLETION_ASYNC_URL", "http://stand-in/foundationModels/v1/completionAsync")
+    monkeypatch.setenv("YANDEX_OPERATIONS_URL", "http://stand-in/operations")
+    monkeypatch.setenv("BATCH_MAX_ATTEMPTS", "1")
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    sessions = sessionmaker(bind=engine)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(**stand_in_options)))
+    service = BatchGenerationService(
+        session_factory=sessions,
+        http_client=client,
+        completion_client=AsyncYandexCompletionService(api_key="test-key", folder_id="test-folder"),
+    )
+    return service, sessions
+
+
+def _enqueue(service, sessions):
+    db = sessions()
+    thread = ThreadService.create_thread(db, subject="Уведомление о плановых работах")
+    request = EmailGenerationRequest(
+        source_subject="Уведомление о плановых работах",
+        source_body="Сообщаем о плановых работах в субботу.",
+        company_context="ПСБ",
+        thread_id=thread.id,
+    )
+    job = service.enqueue(db, request)
+    db.close()
+    return job.id
+
+
+def test_job_is_submitted_polled_and_written_to_thread(monkeypatch):
+    service, sessions = _service(monkeypatch)
+    job_id = _enqueue(service, sessions)
+
+    assert asyncio.run(service.submit_pending()) == 1
+    assert asyncio.run(service.poll_submitted()) == 1
+
+    db = sessions()
+    job = service.get_job(db, job_id)
+    message = db.query(EmailMessage).filter(EmailMessage.id == job.result_message_id).one()
+    assert job.status == "done"
+    assert message.message_type == "outgoing"
+    assert "плановых работах" in message.subject
+    assert message.generation_time_seconds is None
+
+
+def test_failed_operation_marks_job_failed(monkeypatch):
+    service, sessions = _service(monkeypatch, fail_operations=True)
+    job_id = _enqueue(service, sessions)
+
+    asyncio.run(service.run_once())
+
+    job = service.get_job(sessions(), job_id)
+    assert job.status == "failed"
+    assert "Internal error" in job.error
+
+
+def test_submit_window_wraps_midnight():
+    assert in_submit_window("", 14)
+    assert in_submit_window("20-8", 23) and in_submit_window("20-8", 3)
+    assert not in_submit_window("20-8", 14)
+    assert in_submit_window("9-18", 10) and not in_submit_window("9-18", 18)
+
+
+def test_only_non_urgent_notifications_and_slow_information_requests_are_eligible(monkeypatch):
+    monkeypatch.setenv("LLM_BACKENDS", "local")
+    monkeypatch.setenv("BATCH_MIN_SLA_DAYS", "3")
+    assert is_batch_eligible("notification", "normal", 0)
+    assert is_batch_eligible("information_request", "low", 7)
+    assert not is_batch_eligible("information_request", "normal", 1)
+    assert not is_batch_eligible("notification", "high", 1)
+    assert not is_batch_eligible("complaint", "low", 10)
+
+
+def test_claimed_job_is_not_submitted_by_another_worker(monkeypatch):
+    service, sessions = _service(monkeypatch)
+    job_id = _enqueue(service, sessions)
+    other_worker = BatchGenerationService(
+        session_factory=sessions, http_client=service._http_client, completion_client=service._completion
+    )
+
+    claimed = service._claim_queued(10)
+
+    assert [job.id for job in claimed] == [job_id]
+    assert asyncio.run(other_worker.submit_pending()) == 0
+    assert service.get_job(sessions(), job_id).status == "submitting"
+
+
+def test_stale_claim_returns_to_the_queue(monkeypatch):
+    service, sessions = _service(monkeypatch)
+    job_id = _enqueue(service, sessions)
+    service._claim_queued(10)
+    monkeypatch.setenv("BATCH_CLAIM_TIMEOUT_SECONDS", "-1")
+
+    assert asyncio.run(service.submit_pending()) == 1
+    assert service.get_job(sessions(), job_id).status == "submitted"
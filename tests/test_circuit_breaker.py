@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from backend.app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+def _breaker(**overrides):
+    options = dict(window_size=4, min_calls=4, open_seconds=0.05, slow_call_seconds=1.0)
+    options.update(overrides)
+    return CircuitBreaker("test", **options)
+
+
+def test_opens_after_failure_rate_threshold():
+    breaker = _breaker()
+    for _ in range(2):
+        breaker.record_success(0.1)
+    for _ in range(2):
+        breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_opens_on_slow_calls():
+    breaker = _breaker(slow_call_rate_threshold=0.75)
+    for _ in range(3):
+        breaker.record_success(2.0)
+    breaker.record_success(0.1)
+
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_half_open_probe_closes_or_reopens():
+    breaker = _breaker()
+    for _ in range(4):
+        breaker.record_failure()
+    time.sleep(0.06)
+
+    breaker.before_call()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_success(0.1)
+    assert breaker.state == CircuitBreaker.CLOSED
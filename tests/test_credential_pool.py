@@ -0,0 +1,59 @@
+from backend.app.services.credential_pool import CredentialPool, YandexCredential
+
+A = YandexCredential("key-a", "folder-a")
+B = YandexCredential("key-b", "folder-b")
+
+
+def test_least_loaded_prefers_idle_credential():
+    pool = CredentialPool([A, B])
+    pool.start(A)
+
+    assert pool.candidates()[0] == B
+    pool.finish(A)
+    pool.start(B)
+    assert pool.candidates()[0] == A
+
+
+def test_weight_scales_the_load():
+    heavy = YandexCredential("key-h", "folder-h", weight=4.0)
+    pool = CredentialPool([A, heavy])
+    pool.start(heavy)
+    pool.start(heavy)
+
+    # Load is in-flight calls per unit of weight: 2/4 on the heavy one, 1/1 on A after its call
+    assert pool.candidates()[0] == A
+    pool.start(A)
+    assert pool.candidates()[0] == heavy
+
+
+def test_rate_limited_credential_cools_down_and_goes_last():
+    pool = CredentialPool([A, B])
+    pool.cool_down(A, 60)
+
+    assert pool.candidates() == [B, A]
+    assert pool.has_ready()
+    pool.cool_down(B, 30)
+    assert not pool.has_ready()
+    # Everyone is cooling down: the one that recovers first is tried first
+    assert pool.candidates() == [B, A]
+
+
+def test_consecutive_failures_cool_down_credential():
+    pool = CredentialPool([A, B], max_failures=2)
+    for _ in range(2):
+        pool.start(A)
+        pool.finish(A, failed=True)
+
+    assert pool.candidates()[-1] == A
+
+
+def test_success_resets_failures():
+    pool = CredentialPool([A, B], max_failures=2)
+    pool.start(A)
+    pool.finish(A, failed=True)
+    pool.start(A)
+    pool.finish(A)
+    pool.start(A)
+    pool.finish(A, failed=True)
+
+    assert pool.candidates()[0] == A
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import httpx
+from fastapi import FastAPI
+
+from backend.app.api import routes
+from backend.app.database import get_db
+from backend.app.models import EmailGenerationResponse
+
+LETTER = {"source_subject": "Справка", "source_body": "Прошу выдать справку", "company_context": "ПСБ"}
+
+
+class _SlowLongLetters:
+    """Long letters take longer; a "ty" letter fails."""
+
+    def __init__(self):
+        self.requests = []
+
+    async def generate_letter(self, payload, thread_history=None, recipient_name=None, deadline=None, analysis=None):
+        self.requests.append(payload)
+        if payload.parameters.address_style == "ty":
+            raise RuntimeError("Модель недоступна")
+        await asyncio.sleep(0.05 if payload.parameters.length == "long" else 0)
+        return EmailGenerationResponse(subject=f"Ответ ({payload.parameters.length})", body="Текст")
+
+
+def _events(monkeypatch, body):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    service = _SlowLongLetters()
+    monkeypatch.setattr(routes, "_get_service", lambda: service)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_db] = lambda: None
+
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/api/emails/generate", json=body)
+
+    response = asyncio.run(post())
+    events = []
+    if response.status_code != 200:
+        return response, events, service
+    for block in response.text.strip().split("\n\n"):
+        if block:
+            event, data = block.split("\n", 1)
+            events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return response, events, service
+
+
+def test_variants_are_streamed_as_they_finish(monkeypatch):
+    body = {
+        **LETTER,
+        "parameters": {"extra_directives": ["Без канцелярита"]},
+        "variants": [{"length": "long"}, {"length": "short", "tone": "friendly"}],
+    }
+    response, events, service = _events(monkeypatch, body)
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert [(name, data.get("index")) for name, data in events] == [("variant", 1), ("variant", 0), ("done", None)]
+    assert events[0][1]["subject"] == "Ответ (short)"
+    assert events[0][1]["parameters"]["tone"] == "friendly"
+    assert all(r.parameters.extra_directives == ["Без канцелярита"] for r in service.requests)
+
+
+def test_failed_variant_does_not_stop_the_others(monkeypatch):
+    _, events, _ = _events(monkeypatch, {**LETTER, "variants": [{"address_style": "ty"}, {"length": "short"}]})
+
+    assert ("error", 0) in [(name, data.get("index")) for name, data in events]
+    assert ("variant", 1) in [(name, data.get("index")) for name, data in events]
+
+
+def test_too_many_variants_are_rejected(monkeypatch):
+    monkeypatch.setenv("GENERATION_MAX_VARIANTS", "2")
+    response, _, service = _events(monkeypatch, {**LETTER, "variants": [{}, {}, {}]})
+
+    assert response.status_code == 400
+    assert service.requests == []
@@ -0,0 +1,77 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.app.services.email_analyzer import EmailAnalyzer
+from backend.app.services.latency_budget import Deadline, LatencyBudgetExceeded, resolve_deadline
+from backend.app.services.rate_limiter import RateLimiter
+from backend.app.services.yandex_gpt_client import AsyncYandexGPTService
+
+
+class _SlowService:
+    """Stands in for the YandexGPT client: answers long after any reasonable budget."""
+
+    def __init__(self):
+        self.fallback_calls = 0
+
+    async def _make_request(self, messages, temperature=0.4, response_format=None, deadline=None, model_tier=None, max_output_tokens=None):
+        await asyncio.sleep(1.0)
+        return "{}"
+
+    async def analyze_email_parameters(self, *args, **kwargs):
+        self.fallback_calls += 1
+        raise AssertionError("no second LLM call expected in degraded mode")
+
+
+def test_resolve_deadline_prefers_first_budget():
+    assert resolve_deadline(None, None) is None
+    assert resolve_deadline(None, 500).budget_ms == 500
+    assert resolve_deadline(200, 500).budget_ms == 200
+
+
+def test_deadline_expires():
+    deadline = Deadline.from_budget_ms(1)
+    time.sleep(0.01)
+    assert deadline.expired()
+
+
+def test_detailed_analysis_degrades_to_keywords_within_budget(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("SINGLE_FLIGHT_ENABLED", "false")
+    service = _SlowService()
+    analyzer = EmailAnalyzer(async_service=service)
+
+    started = time.monotonic()
+    result = asyncio.run(analyzer.analyze_email_detailed_async(
+        "Жалоба на списание",
+        "Прошу вернуть деньги в течение 2 рабочих дней",
+        "ПСБ банк",
+        deadline=Deadline.from_budget_ms(200),
+    ))
+
+    assert time.monotonic() - started < 0.9
+    assert result.degraded is True
+    assert result.extracted_deadline_days == 2
+    assert service.fallback_calls == 0
+
+
+def test_budget_spent_in_the_rate_limiter_queue_is_a_timeout(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    service = AsyncYandexGPTService(api_key="test-key", folder_id="test-folder")
+    limiter = RateLimiter("test", requests_per_second=0.1, burst=1)
+
+    async def no_quota(cost):
+        return service._credentials.primary, limiter, False
+
+    service._pick_credential = no_quota
+    service._circuit_breaker = lambda: None
+
+    async def generate():
+        await limiter.acquire()
+        await service._make_request([{"role": "user", "content": "Привет"}], deadline=Deadline.from_budget_ms(200))
+
+    with pytest.raises(LatencyBudgetExceeded):
+        asyncio.run(generate())
@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import pytest
+
+from backend.app.services.llm_backends import FailoverBackend
+from backend.app.services.local_llm_backend import LocalLLMBackend
+
+
+class _Backend:
+    def __init__(self, name, answer=None, error=None, delay=0.0, healthy=True):
+        self.name = name
+        self._answer = answer
+        self._error = error
+        self._delay = delay
+        self._healthy = healthy
+        self.calls = 0
+
+    def available(self):
+        return self._healthy
+
+    async def complete(self, messages, temperature=0.4, response_format=None, deadline=None, model_tier=None, max_output_tokens=None):
+        self.calls += 1
+        await asyncio.sleep(self._delay)
+        if self._error:
+            raise self._error
+        return self._answer
+
+    async def stream(self, messages, temperature=0.4, model_tier=None, max_output_tokens=None):
+        if self._error:
+            raise self._error
+        for word in self._answer.split():
+            yield word
+
+
+MESSAGES = [{"role": "user", "content": "Тема: Проверка\nТекст: Привет"}]
+
+
+def test_fails_over_on_error():
+    primary = _Backend("primary", error=RuntimeError("region down"))
+    secondary = _Backend("secondary", answer="ok")
+
+    assert asyncio.run(FailoverBackend([primary, secondary]).complete(MESSAGES)) == "ok"
+    assert primary.calls == 1
+
+
+def test_fails_over_on_slow_backend():
+    slow = _Backend("slow", answer="late", delay=1.0)
+    fast = _Backend("fast", answer="ok")
+
+    chain = FailoverBackend([slow, fast], attempt_timeout_seconds=0.05)
+    assert asyncio.run(chain.complete(MESSAGES)) == "ok"
+
+
+def test_skips_unhealthy_backend_and_raises_last_error():
+    unhealthy = _Backend("unhealthy", answer="never", healthy=False)
+    broken = _Backend("broken", error=RuntimeError("boom"))
+
+    with pytest.raises(RuntimeError, match="boom"):
+        asyncio.run(FailoverBackend([unhealthy, broken]).complete(MESSAGES))
+    assert unhealthy.calls == 0
+
+
+def test_stream_fails_over_before_first_delta():
+    async def collect():
+        chain = FailoverBackend([_Backend("down", error=RuntimeError("x")), _Backend("up", answer="a b")])
+        return [delta async for delta in chain.stream(MESSAGES)]
+
+    assert asyncio.run(collect()) == ["a", "b"]
+
+
+def test_local_backend_is_deterministic():
+    backend = LocalLLMBackend()
+    letter = asyncio.run(backend.complete(MESSAGES))
+
+    assert letter == asyncio.run(backend.complete(MESSAGES))
+    assert letter.startswith("Тема: ")
+    assert "Тело:" in letter
+
+
+def test_local_backend_answers_parameter_analysis_with_json():
+    messages = [
+        {"role": "system", "content": "Отвечай только валидным JSON."},
+        {"role": "user", "content": "Тема: Жалоба\nТекст: Требуем вернуть деньги"},
+    ]
+    params = json.loads(asyncio.run(LocalLLMBackend().complete(messages)))
+
+    assert params["tone"] == "formal"
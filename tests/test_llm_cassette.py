@@ -0,0 +1,76 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend.app.services import yandex_gpt_client
+from backend.app.services.llm_cassette import CassetteMiss, payload_key
+from backend.app.services.yandex_gpt_client import AsyncYandexGPTService
+from backend.mock_upstream.responses import create_app
+
+MESSAGES = [{"role": "user", "content": "Входящее письмо:\nТема: Справка\nТекст: Прошу выдать справку"}]
+
+
+def _offline(request):
+    raise AssertionError("replay must not touch the network")
+
+
+def _run(monkeypatch, mode, path, transport, prepare=None):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("YANDEX_RESPONSES_URL", "http://stand-in/v1/responses")
+    monkeypatch.setenv("LLM_CASSETTE_MODE", mode)
+    monkeypatch.setenv("LLM_CASSETTE_PATH", str(path))
+    client = httpx.AsyncClient(transport=transport)
+    monkeypatch.setattr(yandex_gpt_client, "get_async_http_client", lambda: client)
+    service = AsyncYandexGPTService(api_key="test-key", folder_id="test-folder")
+    if prepare is not None:
+        prepare(service)
+
+    async def calls():
+        streamed = "".join([delta async for delta in service.stream(MESSAGES)])
+        return await service.complete(MESSAGES), streamed
+
+    return asyncio.run(calls())
+
+
+def test_replay_serves_recorded_answers_without_network(monkeypatch, tmp_path):
+    path = tmp_path / "cassette.jsonl.gz"
+    recorded = _run(monkeypatch, "record", path, httpx.ASGITransport(app=create_app()))
+
+    assert _run(monkeypatch, "replay", path, httpx.MockTransport(_offline)) == recorded
+
+
+class _OpenBreaker:
+    def before_call(self):
+        raise AssertionError("replay must not consult the circuit breaker")
+
+
+async def _no_quota(cost):
+    raise AssertionError("replay must not take quota or a credential")
+
+
+def _offline_upstream(service):
+    service._circuit_breaker = lambda: _OpenBreaker()
+    service._pick_credential = _no_quota
+
+
+def test_replay_skips_breaker_and_quota(monkeypatch, tmp_path):
+    path = tmp_path / "cassette.jsonl"
+    recorded = _run(monkeypatch, "record", path, httpx.ASGITransport(app=create_app()))
+
+    assert _run(monkeypatch, "replay", path, httpx.MockTransport(_offline), _offline_upstream) == recorded
+
+
+def test_unrecorded_request_is_a_miss(monkeypatch, tmp_path):
+    with pytest.raises(CassetteMiss):
+        _run(monkeypatch, "replay", tmp_path / "empty.jsonl", httpx.MockTransport(_offline))
+
+
+def test_key_ignores_the_folder_of_the_model_uri():
+    payload = {"model": "gpt://folder-a/yandexgpt/latest", "input": "x"}
+
+    assert payload_key("yandex_responses", payload) == payload_key(
+        "yandex_responses", {**payload, "model": "gpt://folder-b/yandexgpt/latest"}
+    )
+    assert payload_key("yandex_responses", payload) != payload_key("yandex_responses", {**payload, "input": "y"})
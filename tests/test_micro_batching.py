@@ -0,0 +1,121 @@
+import asyncio
+import json
+
+from backend.app.services import email_analyzer
+from backend.app.services.email_analyzer import EmailAnalyzer
+from backend.app.services.micro_batcher import MicroBatcher
+
+
+def _analysis(index, essence):
+    return {
+        "index": index,
+        "category": "information_request",
+        "parameters": {"tone": "formal", "audience": "client"},
+        "extracted_info": {"request_essence": essence},
+    }
+
+
+class _PackingService:
+    """Answers a packed prompt for every letter except the ones listed in ``skip``."""
+
+    def __init__(self, skip=(), fail_packed=False):
+        self.calls = []
+        self._skip = set(skip)
+        self._fail_packed = fail_packed
+        self.parameter_calls = 0
+
+    async def _make_request(self, messages, temperature=0.4, response_format=None, deadline=None, model_tier=None, max_output_tokens=None):
+        self.calls.append(messages)
+        prompt = messages[-1]["content"]
+        if response_format and response_format["name"] == "detailed_email_analysis_batch":
+            if self._fail_packed:
+                raise RuntimeError("YandexGPT API error: 500")
+            count = prompt.count("\nТема: ")
+            results = [_analysis(i, f"Письмо {i}") for i in range(1, count + 1) if i not in self._skip]
+            return json.dumps({"results": list(reversed(results))}, ensure_ascii=False)
+        return json.dumps(_analysis(0, "Отдельно"), ensure_ascii=False)
+
+    async def analyze_email_parameters(self, *args, **kwargs):
+        self.parameter_calls += 1
+        raise AssertionError("a failed packed call must not fall back to the short parameters prompt")
+
+
+def _analyze_all(monkeypatch, service, subjects):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("SINGLE_FLIGHT_ENABLED", "false")
+    monkeypatch.setenv("ANALYSIS_BATCH_ENABLED", "true")
+    monkeypatch.setenv("ANALYSIS_BATCH_MAX_SIZE", str(len(subjects)))
+    monkeypatch.setattr(email_analyzer, "_analysis_batcher", None)
+    analyzer = EmailAnalyzer(async_service=service)
+
+    async def run():
+        return await asyncio.gather(*(
+            analyzer.analyze_email_detailed_async(subject, f"Прошу предоставить справку {subject}", "ПСБ")
+            for subject in subjects
+        ))
+
+    return asyncio.run(run())
+
+
+def test_concurrent_analyses_share_one_packed_call(monkeypatch):
+    service = _PackingService()
+    results = _analyze_all(monkeypatch, service, ["Справка 1", "Справка 2", "Справка 3"])
+
+    assert len(service.calls) == 1
+    assert [r.extracted_info.request_essence for r in results] == ["Письмо 1", "Письмо 2", "Письмо 3"]
+
+
+def test_letter_missing_from_packed_answer_is_analyzed_alone(monkeypatch):
+    service = _PackingService(skip={2})
+    results = _analyze_all(monkeypatch, service, ["Справка 1", "Справка 2"])
+
+    assert len(service.calls) == 2
+    assert [r.extracted_info.request_essence for r in results] == ["Письмо 1", "Отдельно"]
+
+
+def test_failed_packed_call_reanalyzes_each_letter_alone(monkeypatch):
+    service = _PackingService(fail_packed=True)
+    results = _analyze_all(monkeypatch, service, ["Справка 1", "Справка 2"])
+
+    assert len(service.calls) == 3
+    assert [r.extracted_info.request_essence for r in results] == ["Отдельно", "Отдельно"]
+    assert not any(r.degraded for r in results)
+    assert service.parameter_calls == 0
+
+
+def test_batch_is_flushed_after_window():
+    batches = []
+
+    async def process(key, items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    async def run():
+        batcher = MicroBatcher(process, window_seconds=0.01, max_size=10)
+        return await asyncio.gather(batcher.submit("k", 1), batcher.submit("k", 2), batcher.submit("other", 3))
+
+    assert asyncio.run(run()) == [2, 4, 6]
+    assert sorted(batches) == [[1, 2], [3]]
+
+
+def test_cancelled_batch_releases_its_callers():
+    started = asyncio.Event()
+
+    async def process(key, items):
+        started.set()
+        await asyncio.sleep(3600)
+
+    async def run():
+        batcher = MicroBatcher(process, window_seconds=10, max_size=2)
+        waiters = [asyncio.ensure_future(batcher.submit("k", item)) for item in (1, 2)]
+        await started.wait()
+        assert len(batcher._tasks) == 1  # the running batch is referenced until it ends
+        for task in list(batcher._tasks):
+            task.cancel()
+        results = await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), timeout=1)
+        return results, len(batcher._tasks)
+
+    results, running = asyncio.run(run())
+    assert all(isinstance(result, asyncio.CancelledError) for result in results)
+    assert running == 0
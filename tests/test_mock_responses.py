@@ -0,0 +1,70 @@
+import asyncio
+import json
+import random
+
+import httpx
+import pytest
+
+from backend.app.services import yandex_gpt_client
+from backend.app.services.yandex_gpt_client import AsyncYandexGPTService
+from backend.mock_upstream.responses import LatencyDistribution, create_app
+
+MESSAGES = [
+    {"role": "system", "content": "Ты профессиональный автор деловой корреспонденции."},
+    {"role": "user", "content": "Входящее письмо:\nТема: Справка\nТекст: Прошу выдать справку"},
+]
+
+
+def _service(monkeypatch, **stand_in_options):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("YANDEX_RESPONSES_URL", "http://stand-in/v1/responses")
+    monkeypatch.setenv("LLM_RETRY_MAX_ATTEMPTS", "1")
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app(**stand_in_options)))
+    monkeypatch.setattr(yandex_gpt_client, "get_async_http_client", lambda: client)
+    return AsyncYandexGPTService(api_key="test-key", folder_id="test-folder")
+
+
+@pytest.mark.parametrize("shape", ["output_text", "output"])
+def test_client_parses_both_output_shapes(monkeypatch, shape):
+    service = _service(monkeypatch, output_shape=shape)
+
+    letter = asyncio.run(service.complete(MESSAGES))
+
+    assert letter.startswith("Тема: ")
+    assert "Тело:" in letter
+
+
+def test_stream_matches_complete_answer(monkeypatch):
+    service = _service(monkeypatch)
+
+    async def collect():
+        return "".join([delta async for delta in service.stream(MESSAGES)])
+
+    assert asyncio.run(collect()).strip() == asyncio.run(service.complete(MESSAGES))
+
+
+def test_rate_limited_call_surfaces_429(monkeypatch):
+    service = _service(monkeypatch, rate_limit_rate=1.0, retry_after_seconds=0)
+
+    with pytest.raises(RuntimeError, match="429"):
+        asyncio.run(service.complete(MESSAGES))
+
+
+def test_canned_analysis_and_output_limit(monkeypatch):
+    canned = {"category": "complaint", "parameters": {}, "extracted_info": {"request_essence": "Жалоба"}}
+    service = _service(monkeypatch, canned_analysis=canned)
+    analysis = [{"role": "user", "content": 'Верни JSON: {"category": ..., "extracted_info": {...}}'}]
+
+    assert json.loads(asyncio.run(service.complete(analysis))) == canned
+    assert len(asyncio.run(service.complete(MESSAGES, max_output_tokens=5))) <= 15
+
+
+def test_latency_distributions():
+    rng = random.Random(1)
+
+    assert LatencyDistribution.parse("fixed:0.2").sample(rng) == 0.2
+    assert 0.1 <= LatencyDistribution.parse("uniform:0.1:0.3").sample(rng) <= 0.3
+    assert LatencyDistribution.parse("lognormal:0.8:0.5").sample(rng) > 0
+    with pytest.raises(ValueError):
+        LatencyDistribution.parse("pareto:1")
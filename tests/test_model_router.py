@@ -0,0 +1,30 @@
+import pytest
+
+from backend.app.services.model_router import FAST, LARGE, ModelRouter
+
+
+def test_routes_tasks_to_configured_tiers():
+    router = ModelRouter(parameters_tier=FAST, analysis_tier=LARGE, generation_tier=LARGE, short_generation_tier=FAST)
+
+    assert router.for_parameters() == FAST
+    assert router.for_analysis() == LARGE
+    assert router.for_generation("medium", prompt_tokens=500) == LARGE
+    assert router.for_generation("short", prompt_tokens=500) == FAST
+
+
+def test_large_context_goes_to_large_model():
+    router = ModelRouter(short_generation_tier=FAST, fast_max_prompt_tokens=1000)
+
+    assert router.for_generation("short", prompt_tokens=1500) == LARGE
+    assert router.for_parameters(prompt_tokens=1500) == LARGE
+
+
+def test_escalation_to_large_model():
+    assert ModelRouter().escalation_tier(FAST) == LARGE
+    assert ModelRouter().escalation_tier(LARGE) is None
+    assert ModelRouter(escalate_invalid_json=False).escalation_tier(FAST) is None
+
+
+def test_rejects_unknown_tier():
+    with pytest.raises(ValueError):
+        ModelRouter(parameters_tier="medium")
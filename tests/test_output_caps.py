@@ -0,0 +1,26 @@
+import asyncio
+
+from backend.app.services.prompt_builder import letter_output_tokens
+from backend.app.services.yandex_gpt_client import _skip_reasoning, _strip_reasoning
+
+
+def test_letter_cap_grows_with_requested_length():
+    assert letter_output_tokens("short") < letter_output_tokens("medium") < letter_output_tokens("long")
+    assert letter_output_tokens("short") < 800
+
+
+def test_strips_leading_reasoning_block():
+    assert _strip_reasoning("<think>\nсначала подумаем\n</think>\n\nТема: Ответ") == "Тема: Ответ"
+    assert _strip_reasoning("Тема: <think> в тексте") == "Тема: <think> в тексте"
+
+
+def test_stream_skips_reasoning_block_split_across_deltas():
+    async def deltas(parts):
+        for part in parts:
+            yield part
+
+    async def collect(parts):
+        return "".join([delta async for delta in _skip_reasoning(deltas(parts))])
+
+    assert asyncio.run(collect(["<thi", "nk>план", "</think>\n", "Тема: ", "Ответ"])) == "Тема: Ответ"
+    assert asyncio.run(collect(["Тема: ", "Ответ"])) == "Тема: Ответ"
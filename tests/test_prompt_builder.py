@@ -1,5 +1,6 @@
 from backend.app.models import EmailGenerationRequest, EmailParameters
 from backend.app.services.prompt_builder import build_messages
+from backend.app.services.yandex_gpt_client import _finalize_letter
 
 
 def _make_request(custom_prompt: str | None = None, **param_overrides):
@@ -71,3 +72,23 @@ def test_sender_block_omitted_when_no_data():
 
     assert "- Имя:" not in user_prompt
 
+
+
+def test_local_signature_prompt_leaves_the_signature_out():
+    req = _make_request()
+    full_prompt = build_messages(req)[1]["content"]
+    user_prompt = build_messages(req, local_signature=True)[1]["content"]
+
+    assert "Данные подписанта" not in user_prompt
+    assert "Иванова" not in user_prompt
+    assert "[LOGO]" not in user_prompt
+    assert "ответ возвращай строго" in user_prompt.lower()
+    assert "подпись добавляется автоматически" in user_prompt
+    assert len(user_prompt) < len(full_prompt) * 0.7
+
+
+def test_signature_is_attached_to_a_letter_written_without_it():
+    result = _finalize_letter(_make_request(), "Тема: Отчёт\nТело: Добрый день!\n\nОтчёт направим в пятницу.")
+
+    assert result.body.startswith("Добрый день!\n\nОтчёт направим в пятницу.\n\nС уважением,\nИванова\nАнна")
+    assert result.body.endswith("[LOGO]")
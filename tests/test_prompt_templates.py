@@ -0,0 +1,63 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI
+
+from backend.app.api import routes
+from backend.app.database import get_db
+from backend.app.models import EmailGenerationRequest
+from backend.app.services import yandex_gpt_client
+from backend.app.services.prompt_builder import LETTER_TEMPLATE, build_messages
+from backend.app.services.yandex_gpt_client import AsyncLetterOperations, _generation_cache_args
+
+
+def _request(subject, body):
+    return EmailGenerationRequest(source_subject=subject, source_body=body, company_context="ПСБ банк")
+
+
+def test_letters_share_the_static_prefix():
+    first = build_messages(_request("Запрос выписки", "Прошу выписку"))
+    second = build_messages(_request("Жалоба", "Не работает приложение"))
+
+    assert first[0] == second[0]
+    assert first[1]["content"].startswith(LETTER_TEMPLATE.instructions)
+    assert second[1]["content"].startswith(LETTER_TEMPLATE.instructions)
+    assert first[1]["content"].endswith("Входящее письмо:\nТема: Запрос выписки\nТекст: Прошу выписку")
+
+
+def test_template_version_feeds_the_generation_cache_key(monkeypatch):
+    request = _request("Запрос выписки", "Прошу выписку")
+    before = _generation_cache_args(request, None)
+    monkeypatch.setattr(yandex_gpt_client, "LETTER_PROMPT_VERSION", "changed")
+
+    assert _generation_cache_args(request, None) != before
+
+
+class _NoModel(AsyncLetterOperations):
+    async def _make_request(self, *args, **kwargs):
+        raise AssertionError("dry run must not call the model")
+
+
+def test_dry_run_returns_the_prompt_without_calling_the_model(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setattr(routes, "_get_service", lambda: _NoModel())
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_db] = lambda: None
+
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post(
+                "/api/emails/generate/dry-run",
+                json={"source_subject": "Запрос выписки", "source_body": "Прошу выписку", "company_context": "ПСБ банк"},
+            )
+
+    response = asyncio.run(post())
+    preview = response.json()
+
+    assert response.status_code == 200
+    assert (preview["template"], preview["template_version"]) == ("letter", LETTER_TEMPLATE.version)
+    assert preview["messages"][1]["content"].startswith(LETTER_TEMPLATE.instructions)
+    assert preview["messages"][1]["content"].endswith("Тема: Запрос выписки\nТекст: Прошу выписку")
+    assert preview["estimated_input_tokens"] > 0
@@ -0,0 +1,145 @@
+import asyncio
+import os
+import socket
+import threading
+import uuid
+
+import pytest
+
+from backend.app.services.rate_limiter import RateLimiter, RateLimitExceeded, _LocalBucket
+
+
+def test_local_bucket_refills_up_to_capacity():
+    bucket = _LocalBucket(rate_per_second=2.0, capacity=4)
+    bucket.updated = 100.0
+    bucket.take(4)
+
+    assert bucket.wait_for(1, 100.0) == pytest.approx(0.5)
+    assert bucket.wait_for(1, 100.5) == 0
+    bucket.wait_for(1, 1000.0)
+    assert bucket.tokens == 4
+
+
+def test_drained_bucket_refills_only_after_the_penalty():
+    bucket = _LocalBucket(rate_per_second=2.0, capacity=4)
+    bucket.updated = 100.0
+    bucket.drain(now=100.0, penalty_seconds=2.0)
+
+    assert bucket.wait_for(1, 101.0) == pytest.approx(0.5)
+    assert bucket.wait_for(1, 102.5) == 0
+
+
+def test_try_acquire_never_queues():
+    limiter = RateLimiter("test", requests_per_second=0.001, burst=2)
+
+    async def take_three():
+        return [await limiter.try_acquire() for _ in range(3)]
+
+    assert asyncio.run(take_three()) == [True, True, False]
+
+
+def test_token_quota_is_checked_with_the_request_quota():
+    limiter = RateLimiter("test", requests_per_second=100, burst=10, tokens_per_minute=600)
+
+    async def take():
+        return await limiter.try_acquire(600), await limiter.try_acquire(10)
+
+    assert asyncio.run(take()) == (True, False)
+
+
+def test_acquire_waits_for_refill():
+    limiter = RateLimiter("test", requests_per_second=20, burst=1)
+
+    async def take_two():
+        await limiter.acquire()
+        return await limiter.acquire()
+
+    assert asyncio.run(take_two()) > 0
+
+
+def test_queue_timeout_raises_rate_limit_exceeded():
+    limiter = RateLimiter("test", requests_per_second=0.1, burst=1, max_wait_seconds=0.05)
+
+    async def take_two():
+        await limiter.acquire()
+        await limiter.acquire()
+
+    with pytest.raises(RateLimitExceeded) as error:
+        asyncio.run(take_two())
+    assert error.value.retry_after_seconds == pytest.approx(10, abs=0.1)
+
+
+def test_drain_after_429_makes_callers_queue():
+    limiter = RateLimiter("test", requests_per_second=100, burst=10)
+
+    async def drain_and_take():
+        await limiter.drain(5)
+        return await limiter.try_acquire()
+
+    assert asyncio.run(drain_and_take()) is False
+
+
+class _RecordingRedis:
+    def __init__(self, result=0, error=None):
+        self.result = result
+        self.error = error
+        self.threads = []
+
+    def eval(self, script, numkeys, *args):
+        self.threads.append(threading.get_ident())
+        if self.error:
+            raise self.error
+        return self.result
+
+
+def test_redis_calls_run_off_the_event_loop():
+    redis = _RecordingRedis()
+    limiter = RateLimiter("test", requests_per_second=1, burst=1, redis_client=redis)
+
+    async def take():
+        await limiter.acquire()
+        await limiter.drain(1)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(take())
+    assert len(redis.threads) == 2
+    assert loop_thread not in redis.threads
+
+
+def test_redis_error_falls_back_to_the_local_bucket():
+    limiter = RateLimiter(
+        "test", requests_per_second=0.001, burst=1, redis_client=_RecordingRedis(error=ConnectionError("down"))
+    )
+
+    async def take_two():
+        return await limiter.try_acquire(), await limiter.try_acquire()
+
+    assert asyncio.run(take_two()) == (True, False)
+
+
+def _redis_or_skip():
+    redis = pytest.importorskip("redis")
+    host, port = os.getenv("REDIS_HOST", "localhost"), int(os.getenv("REDIS_PORT", "6379"))
+    try:
+        socket.create_connection((host, port), timeout=0.2).close()
+    except OSError:
+        pytest.skip("Redis is not running")
+    return redis.Redis(host=host, port=port)
+
+
+def test_lua_scripts_share_the_bucket_between_limiters():
+    client = _redis_or_skip()
+    name = f"test-{uuid.uuid4().hex}"
+    first = RateLimiter(name, requests_per_second=0.001, burst=2, redis_client=client)
+    second = RateLimiter(name, requests_per_second=0.001, burst=2, redis_client=client)
+
+    async def scenario():
+        taken = [await first.try_acquire(), await second.try_acquire(), await first.try_acquire()]
+        fresh = RateLimiter(f"{name}-drained", requests_per_second=100, burst=10, redis_client=client)
+        await fresh.drain(5)
+        return taken, await fresh.try_acquire()
+
+    try:
+        assert asyncio.run(scenario()) == ([True, True, False], False)
+    finally:
+        client.delete(*client.keys(f"bizmail:ratelimit:{name}*"))
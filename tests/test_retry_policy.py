@@ -0,0 +1,81 @@
+import asyncio
+
+import httpx
+
+from backend.app.services import yandex_gpt_client
+from backend.app.services.latency_tracker import LatencyTracker, get_latency_tracker
+from backend.app.services.retry_policy import RetryPolicy, parse_retry_after
+from backend.app.services.yandex_gpt_client import AsyncYandexGPTService
+from backend.mock_upstream.responses import create_app
+
+
+def _status_error(status_code, headers=None):
+    request = httpx.Request("POST", "https://llm.example/v1/responses")
+    response = httpx.Response(status_code, headers=headers, request=request)
+    return httpx.HTTPStatusError("error", request=request, response=response)
+
+
+def test_retries_transport_errors_429_and_5xx_but_not_4xx():
+    policy = RetryPolicy(max_attempts=5, min_read_timeout_seconds=0.1)
+
+    assert policy.next_delay(policy.start(), httpx.ReadTimeout("slow")) is not None
+    assert policy.next_delay(policy.start(), _status_error(429)) is not None
+    assert policy.next_delay(policy.start(), _status_error(503)) is not None
+    assert policy.next_delay(policy.start(), _status_error(400)) is None
+    assert policy.next_delay(policy.start(), RuntimeError("bad answer")) is None
+
+
+def test_stops_after_max_attempts():
+    policy = RetryPolicy(max_attempts=2, min_read_timeout_seconds=0.1)
+    state = policy.start()
+
+    assert policy.next_delay(state, httpx.ConnectError("down")) is not None
+    assert policy.next_delay(state, httpx.ConnectError("down")) is None
+
+
+def test_honors_retry_after_and_budget():
+    policy = RetryPolicy(max_delay_seconds=0.1, budget_seconds=30, min_read_timeout_seconds=1)
+
+    assert policy.next_delay(policy.start(), _status_error(429, {"Retry-After": "5"})) == 5.0
+    # Waiting 60 s would not fit into the 30 s budget
+    assert policy.next_delay(policy.start(), _status_error(429, {"Retry-After": "60"})) is None
+
+
+def test_read_timeout_follows_observed_latency():
+    tracker = LatencyTracker(min_samples=3)
+    policy = RetryPolicy(min_read_timeout_seconds=5, max_read_timeout_seconds=60, latency_tracker=tracker)
+    assert policy.read_timeout() == 60
+
+    for seconds in (4.0, 6.0, 8.0):
+        tracker.record(seconds)
+    assert policy.read_timeout() == 16.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_time_to_first_token_stays_out_of_the_latency_histogram(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("YANDEX_RESPONSES_URL", "http://stand-in/v1/responses")
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=create_app()))
+    monkeypatch.setattr(yandex_gpt_client, "get_async_http_client", lambda: client)
+    service = AsyncYandexGPTService(api_key="test-key", folder_id="test-folder")
+    tracker = get_latency_tracker(service.upstream_name)
+    messages = [{"role": "user", "content": "Входящее письмо:\nТема: Справка\nТекст: Прошу выдать справку"}]
+
+    async def calls():
+        before = tracker.count
+        streamed = "".join([delta async for delta in service.stream(messages)])
+        after_stream = tracker.count
+        await service.complete(messages)
+        return streamed, before, after_stream, tracker.count
+
+    streamed, before, after_stream, after_complete = asyncio.run(calls())
+    assert streamed
+    assert after_stream == before
+    assert after_complete == before + 1
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from backend.app.services.section_rewriter import rewrite_section
+
+SUBJECT = "Ответ на запрос справки"
+BODY = (
+    "Добрый день!\n\n"
+    "Справка будет готова в течение пяти рабочих дней.  \n"
+    "Получить её можно в любом отделении банка.\n\n"
+    "С уважением,\n"
+    "Иванова\n"
+    "Анна Сергеевна"
+)
+
+
+class _Rewriter:
+    def __init__(self, answer):
+        self.answer = answer
+        self.messages = []
+
+    async def _make_request(self, messages, temperature=0.4, response_format=None, deadline=None, model_tier=None, max_output_tokens=None):
+        self.messages.append(messages)
+        return self.answer
+
+
+def _rewrite(monkeypatch, service, **kwargs):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    return asyncio.run(rewrite_section(service, SUBJECT, BODY, **kwargs))
+
+
+def test_only_the_span_is_replaced(monkeypatch):
+    start = BODY.index("Справка")
+    end = BODY.index("Получить")  # вместе с хвостовыми пробелами и переводом строки
+    service = _Rewriter("«Справка будет готова завтра.»")
+
+    result = _rewrite(monkeypatch, service, target="body", start=start, end=end, instruction="Срок — завтра")
+
+    assert result.body == BODY[:start] + "Справка будет готова завтра." + "  \n" + BODY[end:]
+    assert result.body[result.start:result.end] == "Справка будет готова завтра."
+    assert result.body.endswith("С уважением,\nИванова\nАнна Сергеевна")
+    prompt = service.messages[0][-1]["content"]
+    assert "Иванова" not in prompt and "Срок — завтра" in prompt
+
+
+def test_subject_is_rewritten_alone(monkeypatch):
+    result = _rewrite(monkeypatch, _Rewriter("Тема: Справка готова"), target="subject", start=None, end=None, instruction="Короче")
+
+    assert result.subject == "Справка готова"
+    assert result.body == BODY
+
+
+def test_span_touching_the_signature_is_rejected(monkeypatch):
+    service = _Rewriter("Новый текст")
+    with pytest.raises(ValueError, match="подпись"):
+        _rewrite(monkeypatch, service, target="body", start=0, end=len(BODY), instruction="Короче")
+    assert service.messages == []
@@ -0,0 +1,247 @@
+import asyncio
+import threading
+
+import pytest
+
+from backend.app.models import EmailGenerationRequest
+from backend.app.services import cache_service
+from backend.app.services.conversation_chain import ThreadChain, current_chain, record_response_id, start_chain
+from backend.app.services.single_flight import SingleFlight
+from backend.app.services.yandex_gpt_client import AsyncLetterOperations
+
+
+class _FakeCache:
+    """Minimal stand-in for CacheService with an in-memory store and locks."""
+
+    def __init__(self):
+        self.values = {}
+        self.locks = {}
+
+    def is_enabled(self):
+        return True
+
+    def acquire_lock(self, key, ttl_seconds):
+        if key in self.locks:
+            return None
+        self.locks[key] = "token"
+        return "token"
+
+    def release_lock(self, key, token):
+        if self.locks.get(key) == token:
+            del self.locks[key]
+
+    def is_locked(self, key):
+        return key in self.locks
+
+
+def test_identical_calls_share_one_computation():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "draft"
+
+    async def main():
+        return await asyncio.gather(*(flight.run("k", compute) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["draft"] * 5
+    assert len(calls) == 1
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight()
+    calls = []
+
+    async def compute(value):
+        calls.append(value)
+        return value
+
+    async def main():
+        return await asyncio.gather(
+            flight.run("a", lambda: compute("a")),
+            flight.run("b", lambda: compute("b")),
+        )
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_error_is_shared_and_key_is_released():
+    flight = SingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0)
+        raise RuntimeError("upstream down")
+
+    async def main():
+        results = await asyncio.gather(
+            flight.run("k", failing), flight.run("k", failing), return_exceptions=True
+        )
+        assert all(isinstance(r, RuntimeError) for r in results)
+        return await flight.run("k", lambda: asyncio.sleep(0, result="ok"))
+
+    assert asyncio.run(main()) == "ok"
+
+
+def test_waits_for_result_of_another_worker():
+    cache = _FakeCache()
+    cache.locks["k"] = "other-worker"
+    flight = SingleFlight(cache=cache, poll_interval_seconds=0.01)
+
+    async def compute():
+        pytest.fail("another worker holds the lock, the LLM must not be called")
+
+    async def main():
+        async def other_worker_finishes():
+            await asyncio.sleep(0.03)
+            cache.values["k"] = "shared draft"
+            del cache.locks["k"]
+
+        asyncio.ensure_future(other_worker_finishes())
+        return await flight.run("k", compute, lambda: cache.values.get("k"))
+
+    assert asyncio.run(main()) == "shared draft"
+
+
+class _RecordingCache(_FakeCache):
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+
+    def acquire_lock(self, key, ttl_seconds):
+        self.threads.append(threading.get_ident())
+        return super().acquire_lock(key, ttl_seconds)
+
+    def release_lock(self, key, token):
+        self.threads.append(threading.get_ident())
+        super().release_lock(key, token)
+
+    def is_locked(self, key):
+        self.threads.append(threading.get_ident())
+        return super().is_locked(key)
+
+
+def test_redis_calls_run_off_the_event_loop():
+    cache = _RecordingCache()
+    cache.locks["k"] = "other-worker"
+    flight = SingleFlight(cache=cache, poll_interval_seconds=0.01)
+
+    async def main():
+        async def other_worker_gives_up():
+            await asyncio.sleep(0.03)
+            del cache.locks["k"]
+
+        asyncio.ensure_future(other_worker_gives_up())
+        draft = await flight.run("k", lambda: asyncio.sleep(0, result="own draft"), lambda: cache.values.get("k"))
+        return draft, threading.get_ident()
+
+    draft, loop_thread = asyncio.run(main())
+    assert draft == "own draft"
+    assert cache.threads and loop_thread not in cache.threads
+
+
+class _ChainedModel(AsyncLetterOperations):
+    def __init__(self):
+        self.calls = 0
+
+    async def draft_text(self, payload, *args, **kwargs):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(0.01)
+        record_response_id(f"response-{call}")
+        return "Тема: Справка\nТело:\nДобрый день!"
+
+
+def test_chained_replies_are_not_coalesced(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    service = _ChainedModel()
+    payload = EmailGenerationRequest(source_subject="Справка", source_body="Прошу справку", company_context="ПСБ")
+
+    async def reply():
+        start_chain(ThreadChain())
+        await service.generate_letter(payload)
+        return current_chain().response_id
+
+    async def main():
+        return await asyncio.gather(reply(), reply())
+
+    assert sorted(asyncio.run(main())) == ["response-1", "response-2"]
+    assert service.calls == 2
+
+
+class _SlowModel(AsyncLetterOperations):
+    def __init__(self):
+        self.calls = 0
+
+    async def draft_text(self, payload, *args, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        return "Тема: Справка\nТело:\nДобрый день!\n\nС уважением,\nИванова Анна"
+
+
+def test_joined_callers_keep_their_own_signature(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    service = _SlowModel()
+
+    def request(last_name, phone):
+        return EmailGenerationRequest(
+            source_subject="Справка",
+            source_body="Прошу справку",
+            company_context="ПСБ",
+            sender_last_name=last_name,
+            sender_phone_work=phone,
+        )
+
+    async def main():
+        return await asyncio.gather(
+            service.generate_letter(request("Иванова", "+7 495 111-11-11")),
+            service.generate_letter(request("Петров", "+7 495 222-22-22")),
+        )
+
+    first, second = asyncio.run(main())
+    assert service.calls == 1
+    assert "Иванова" in first.body and "111-11-11" in first.body
+    assert "Петров" in second.body and "222-22-22" in second.body and "Иванова" not in second.body
+
+
+class _ThreadRecordingCache:
+    def __init__(self):
+        self.values = {}
+        self.threads = []
+
+    def is_enabled(self):
+        return True
+
+    def generation_key(self, *args):
+        return repr(args)
+
+    def get_generation(self, *args):
+        self.threads.append(threading.get_ident())
+        return self.values.get(args[:4])
+
+    def set_generation(self, subject, body, context, params_hash, result, *rest):
+        self.threads.append(threading.get_ident())
+        self.values[(subject, body, context, params_hash)] = result
+
+
+def test_generation_cache_is_used_off_the_event_loop(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("SINGLE_FLIGHT_ENABLED", "false")
+    cache = _ThreadRecordingCache()
+    monkeypatch.setattr(cache_service, "get_cache_service", lambda: cache)
+    service = _SlowModel()
+    payload = EmailGenerationRequest(source_subject="Справка", source_body="Прошу справку", company_context="ПСБ")
+
+    async def main():
+        first = await service.generate_letter(payload)
+        second = await service.generate_letter(payload)
+        return first, second, threading.get_ident()
+
+    first, second, loop_thread = asyncio.run(main())
+    assert first == second and service.calls == 1
+    assert len(cache.threads) == 3 and loop_thread not in cache.threads
@@ -0,0 +1,146 @@
+import asyncio
+import threading
+
+from backend.app.models import DetailedEmailAnalysis, EmailParameters, ExtractedInfo
+from backend.app.services import cache_service, speculative_drafts
+from backend.app.services.local_llm_backend import LocalLLMBackend
+from backend.app.services.llm_backends import LLMService
+from backend.app.services.speculative_drafts import SpeculativeDrafts, speculate, speculative_request
+
+SUBJECT = "Справка об остатке"
+BODY = "Прошу выдать справку об остатке на счёте"
+
+
+class _CountingBackend(LocalLLMBackend):
+    def __init__(self):
+        super().__init__(latency_seconds=0.05)
+        self.calls = 0
+
+    async def complete(self, messages, *args, **kwargs):
+        self.calls += 1
+        return await super().complete(messages, *args, **kwargs)
+
+
+def _analysis(**parameters):
+    return DetailedEmailAnalysis(
+        category="information_request",
+        parameters=EmailParameters(**parameters),
+        extracted_info=ExtractedInfo(request_essence="Запрос справки"),
+        department="Отдел операционного обслуживания",
+        estimated_sla_days=5,
+    )
+
+
+def _setup(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("SPECULATIVE_DRAFTS_ENABLED", "true")
+    monkeypatch.setattr(speculative_drafts, "_speculative_drafts", SpeculativeDrafts())
+    backend = _CountingBackend()
+    return backend, LLMService(backend)
+
+
+def test_generate_with_suggested_parameters_takes_the_draft(monkeypatch):
+    backend, service = _setup(monkeypatch)
+    analysis = _analysis(tone="formal", length="short")
+
+    async def run():
+        assert await speculate(service, SUBJECT, BODY, "ПСБ", analysis)
+        request, recipient_name = speculative_request(SUBJECT, BODY, "ПСБ", analysis)
+        request = request.model_copy(update={"sender_first_name": "Анна", "sender_last_name": "Иванова"})
+        return await service.generate_letter(request, recipient_name=recipient_name, analysis=analysis)
+
+    letter = asyncio.run(run())
+
+    assert backend.calls == 1
+    assert "Анна" in letter.body  # подпись из запроса /generate, а не из черновика
+
+
+def test_changed_parameters_cancel_the_draft(monkeypatch):
+    backend, service = _setup(monkeypatch)
+    analysis = _analysis(tone="formal", length="short")
+
+    async def run():
+        await speculate(service, SUBJECT, BODY, "ПСБ", analysis)
+        request, _ = speculative_request(SUBJECT, BODY, "ПСБ", analysis)
+        request.parameters.length = "long"
+        task = speculative_drafts.get_speculative_drafts()._entries[speculative_drafts.letter_key(request)].task
+        letter = await service.generate_letter(request, analysis=analysis)
+        return task, letter
+
+    task, letter = asyncio.run(run())
+
+    assert task.cancelled()
+    assert backend.calls == 2
+    assert letter.body
+    assert len(speculative_drafts.get_speculative_drafts()) == 0
+
+
+def test_degraded_analysis_is_not_speculated(monkeypatch):
+    backend, service = _setup(monkeypatch)
+    analysis = _analysis().model_copy(update={"degraded": True})
+
+    assert not asyncio.run(speculate(service, SUBJECT, BODY, "ПСБ", analysis))
+    assert backend.calls == 0
+
+
+def test_generate_without_the_analysis_does_not_take_the_draft(monkeypatch):
+    backend, service = _setup(monkeypatch)
+    analysis = _analysis(tone="formal", length="short")
+
+    async def run():
+        await speculate(service, SUBJECT, BODY, "ПСБ", analysis)
+        request, recipient_name = speculative_request(SUBJECT, BODY, "ПСБ", analysis)
+        task = speculative_drafts.get_speculative_drafts()._entries[speculative_drafts.letter_key(request)].task
+        await service.generate_letter(request, recipient_name=recipient_name)
+        return task
+
+    task = asyncio.run(run())
+
+    assert task.cancelled()  # черновик построен с блоком анализа, а этот промпт — без него
+    assert backend.calls == 2
+
+
+class _RecordingCache:
+    def __init__(self):
+        self.drafts = {}
+        self.threads = []
+
+    def is_enabled(self):
+        return True
+
+    def generation_key(self, *args):
+        return repr(args)
+
+    def get_generation(self, *args):
+        self.threads.append(threading.get_ident())
+        return None
+
+    def set_draft(self, generation_key, text, ttl_seconds):
+        self.threads.append(threading.get_ident())
+        self.drafts[generation_key] = text
+
+    def get_draft(self, generation_key):
+        self.threads.append(threading.get_ident())
+        return self.drafts.get(generation_key)
+
+
+def test_draft_cache_is_used_off_the_event_loop(monkeypatch):
+    backend, service = _setup(monkeypatch)
+    cache = _RecordingCache()
+    monkeypatch.setattr(cache_service, "get_cache_service", lambda: cache)
+    analysis = _analysis(tone="formal", length="short")
+    drafts = speculative_drafts.get_speculative_drafts()
+
+    async def run():
+        await speculate(service, SUBJECT, BODY, "ПСБ", analysis)
+        request, _ = speculative_request(SUBJECT, BODY, "ПСБ", analysis)
+        key = next(iter(drafts._entries.values())).generation_key
+        await drafts.take(speculative_drafts.letter_key(request), key)
+        # черновик другого воркера: в этом процессе его нет, он читается из кэша
+        return await drafts.take(speculative_drafts.letter_key(request), key), threading.get_ident()
+
+    draft, loop_thread = asyncio.run(run())
+
+    assert draft and backend.calls == 1
+    assert len(cache.threads) == 3 and loop_thread not in cache.threads
@@ -0,0 +1,93 @@
+import asyncio
+import json
+
+import httpx
+from fastapi import FastAPI
+
+from backend.app.api import routes
+from backend.app.database import get_db
+from backend.app.services.yandex_gpt_client import AsyncLetterOperations, _LetterStreamParser
+
+RAW = "Тема: Справка   готова\nТело:\nДобрый день!\n\nСправка готова.\n\nС уважением,\nИванова"
+LETTER = {
+    "source_subject": "Справка",
+    "source_body": "Прошу выдать справку",
+    "company_context": "ПСБ",
+    "sender_first_name": "Анна",
+    "sender_last_name": "Иванова",
+}
+
+
+def _parse(chunks):
+    parser = _LetterStreamParser(cut_signature=True)
+    events = [event for chunk in chunks for event in parser.feed(chunk)] + parser.finish()
+    subjects = [text for name, text in events if name == "subject"]
+    deltas = [text for name, text in events if name == "delta"]
+    return subjects, deltas
+
+
+def test_markers_split_across_chunks():
+    for cut in range(1, len(RAW)):
+        subjects, deltas = _parse([RAW[:cut], RAW[cut:]])
+
+        assert subjects == ["Справка готова"], cut
+        assert "".join(deltas) == "Добрый день!\n\nСправка готова.", cut
+
+
+def test_token_by_token_stream_never_leaks_the_signature():
+    subjects, deltas = _parse(list(RAW))
+
+    assert subjects == ["Справка готова"]
+    assert "".join(deltas) == "Добрый день!\n\nСправка готова."
+
+
+class _StreamingModel(AsyncLetterOperations):
+    def __init__(self, chunks, fail_after=None):
+        self.chunks = chunks
+        self.fail_after = fail_after
+
+    async def _stream_request(self, messages, temperature=0.4, model_tier=None, max_output_tokens=None):
+        for index, chunk in enumerate(self.chunks):
+            if index == self.fail_after:
+                raise RuntimeError("YandexGPT API stream error: connection reset")
+            yield chunk
+
+
+def _events(monkeypatch, service):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setattr(routes, "_get_service", lambda: service)
+    app = FastAPI()
+    app.include_router(routes.router)
+    app.dependency_overrides[get_db] = lambda: None
+
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.post("/api/emails/generate/stream", json=LETTER)
+
+    response = asyncio.run(post())
+    events = []
+    for block in response.text.strip().split("\n\n"):
+        event, data = block.split("\n", 1)
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return response, events
+
+
+def test_stream_event_sequence(monkeypatch):
+    response, events = _events(monkeypatch, _StreamingModel(["Тема: Спра", "вка\nТело:\nДобрый ", "день!\n\nС уваж", "ением,\nX"]))
+    names = [name for name, _ in events]
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert names[0] == "subject" and names[-2:] == ["signature", "done"]
+    assert set(names[1:-2]) == {"delta"}
+    assert "".join(data["text"] for name, data in events if name == "delta") == "Добрый день!"
+    done = events[-1][1]
+    assert done["subject"] == "Справка"
+    assert done["body"].startswith("Добрый день!\n\nС уважением,\nИванова\nАнна")
+
+
+def test_upstream_failure_mid_stream_ends_with_error(monkeypatch):
+    _, events = _events(monkeypatch, _StreamingModel(["Тема: Справка\nТело:\n", "Добрый день!"], fail_after=1))
+
+    assert [name for name, _ in events] == ["subject", "error"]
+    assert "connection reset" in events[-1][1]["detail"]
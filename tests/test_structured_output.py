@@ -0,0 +1,38 @@
+import pytest
+
+from backend.app.models import DetailedEmailAnalysis
+from backend.app.services.structured_output import json_schema_format, repair_json
+
+
+def test_parses_fenced_json_with_surrounding_prose():
+    raw = 'Вот анализ:\n```json\n{"category": "complaint", "urgent": true}\n```\nГотово.'
+
+    assert repair_json(raw) == {"category": "complaint", "urgent": True}
+
+
+def test_fixes_quotes_literals_and_trailing_commas():
+    raw = "{'name': 'ООО \"Ромашка\"', 'ok': True, 'items': [1, 2,], 'note': None,}"
+
+    assert repair_json(raw) == {"name": 'ООО "Ромашка"', "ok": True, "items": [1, 2], "note": None}
+
+
+def test_closes_truncated_answer():
+    raw = '{"extracted_info": {"request_essence": "Вернуть\nплатёж", "requirements": ["срок", "отв'
+
+    assert repair_json(raw) == {
+        "extracted_info": {"request_essence": "Вернуть\nплатёж", "requirements": ["срок", "отв"]}
+    }
+    assert repair_json('{"a": 1, "b": ') == {"a": 1, "b": None}
+
+
+def test_raises_value_error_without_json():
+    with pytest.raises(ValueError):
+        repair_json("Извините, не могу помочь")
+
+
+def test_schema_keeps_only_model_fields():
+    response_format = json_schema_format("analysis", DetailedEmailAnalysis, ("category", "parameters"))
+
+    assert response_format["type"] == "json_schema"
+    assert set(response_format["schema"]["properties"]) == {"category", "parameters"}
+    assert response_format["schema"]["required"] == ["category", "parameters"]
@@ -0,0 +1,117 @@
+import asyncio
+import contextvars
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from backend.app.db_models import EmailMessage
+from backend.app.models import EmailGenerationRequest, EmailParameters
+from backend.app.services import yandex_gpt_client
+from backend.app.services.conversation_chain import chain_for_reply, start_chain
+from backend.app.services.credential_pool import CredentialPool, YandexCredential
+from backend.app.services.yandex_gpt_client import AsyncYandexGPTService
+
+
+def _message(message_type, subject, response_id=None, age_hours=1.0, folder_id=None):
+    return EmailMessage(
+        thread_id=1,
+        message_type=message_type,
+        subject=subject,
+        body=f"Текст: {subject}",
+        llm_response_id=response_id,
+        llm_folder_id=folder_id,
+        created_at=datetime.now(timezone.utc) - timedelta(hours=age_hours),
+    )
+
+
+def _request():
+    return EmailGenerationRequest(
+        source_subject="Уточнение по справке",
+        source_body="Когда будет готова справка?",
+        company_context="Большой корпоративный контекст банка",
+        thread_id=1,
+        parameters=EmailParameters(),
+    )
+
+
+def _enable(monkeypatch):
+    monkeypatch.setenv("YANDEX_API_KEY", "test-key")
+    monkeypatch.setenv("YANDEX_FOLDER_ID", "test-folder")
+    monkeypatch.setenv("LLM_THREAD_CHAINING_ENABLED", "true")
+
+
+def test_reply_continues_from_last_outgoing_answer(monkeypatch):
+    _enable(monkeypatch)
+    history = [
+        _message("incoming", "Запрос справки"),
+        _message("outgoing", "Ответ на запрос", response_id="resp-1"),
+        _message("incoming", "Дополнение к запросу"),
+    ]
+    chain = chain_for_reply(history, _request())
+
+    prompt = chain.followup_messages[-1]["content"]
+    assert chain.continues and chain.previous_response_id == "resp-1"
+    assert "Дополнение к запросу" in prompt and "Уточнение по справке" in prompt
+    assert "Запрос справки" not in prompt
+    assert "Большой корпоративный контекст" not in prompt
+
+
+def test_old_answer_starts_a_new_conversation(monkeypatch):
+    _enable(monkeypatch)
+    history = [_message("outgoing", "Ответ", response_id="resp-1", age_hours=48)]
+
+    assert not chain_for_reply(history, _request()).continues
+
+
+def test_rejected_previous_response_falls_back_to_full_history(monkeypatch):
+    _enable(monkeypatch)
+    chain = chain_for_reply([_message("outgoing", "Ответ", response_id="resp-1")], _request())
+    service = AsyncYandexGPTService(api_key="test-key", folder_id="test-folder")
+    full_messages = [{"role": "user", "content": "Вся история переписки"}]
+
+    def run():
+        start_chain(chain)
+        _, chained = service._build_request(full_messages)
+        rejected = httpx.HTTPStatusError(
+            "not found", request=httpx.Request("POST", "https://llm"), response=httpx.Response(404)
+        )
+        expired = service._chain_expired(rejected)
+        _, full = service._build_request(full_messages)
+        service._parse_response({"id": "resp-2", "output_text": "Тема: Ответ"})
+        return chained, expired, full
+
+    chained, expired, full = contextvars.copy_context().run(run)
+
+    assert chained["previous_response_id"] == "resp-1" and chained["store"] is True
+    assert "Вся история" not in chained["input"]
+    assert expired is True
+    assert "previous_response_id" not in full and full["input"] == "Вся история переписки"
+    assert chain.response_id == "resp-2"
+
+
+def test_continued_conversation_stays_in_the_folder_that_stores_it(monkeypatch):
+    _enable(monkeypatch)
+    monkeypatch.setenv("LLM_RATE_LIMIT_ENABLED", "false")
+    pool = CredentialPool([YandexCredential("key-a", "folder-a"), YandexCredential("key-b", "folder-b")])
+    pool.start(pool.for_folder("folder-b"))  # least_loaded would pick folder-a
+    service = AsyncYandexGPTService(credential_pool=pool)
+    chain = chain_for_reply([_message("outgoing", "Ответ", response_id="resp-1", folder_id="folder-b")], _request())
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, json={"id": "resp-2", "output_text": "Тема: Ответ"})
+    ))
+    monkeypatch.setattr(yandex_gpt_client, "get_async_http_client", lambda: client)
+
+    def run():
+        start_chain(chain)
+        pinned, _, _ = asyncio.run(service._pick_credential(100))
+        chain.expired = True
+        unpinned, _, _ = asyncio.run(service._pick_credential(100))
+        asyncio.run(service._make_request([{"role": "user", "content": "Вся история переписки"}]))
+        return pinned, unpinned
+
+    pinned, unpinned = contextvars.copy_context().run(run)
+
+    assert pinned.folder_id == "folder-b"
+    assert unpinned.folder_id == "folder-a"
+    assert (chain.response_id, chain.folder_id) == ("resp-2", "folder-a")